@@ -15,6 +15,8 @@ import logging
 from app_config import (
     SessionLocal,
     AsyncSessionLocal,
+    ReplicaSessionLocal,
+    AsyncReplicaSessionLocal,
     lifespan,
     ALLOWED_ORIGINS,
     engine,
@@ -98,6 +100,14 @@ def get_db():
     finally:
         db.close()
 
+# Session đọc từ read replica (fallback về primary) cho các route GET chỉ đọc
+def get_read_db():
+    db = ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
 # Dependency to get async database session
 async def get_async_db() -> AsyncIterator[AsyncSession]:
     async with AsyncSessionLocal() as session:
@@ -106,6 +116,23 @@ async def get_async_db() -> AsyncIterator[AsyncSession]:
         finally:
             await session.close()
 
+# Async session trong transaction cho các route ghi (POST/PUT/DELETE):
+# begin() tự commit khi handler thành công, rollback khi có exception.
+# Dùng với Depends(get_async_db_tx, scope="function") để commit xong trước khi gửi response.
+async def get_async_db_tx() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal.begin() as session:
+        yield session
+
+# Async session read-only cho các route GET (không commit, đóng sau khi response đã gửi)
+async def get_async_db_ro() -> AsyncIterator[AsyncSession]:
+    async with AsyncSessionLocal() as session:
+        yield session
+
+# Async session đọc từ read replica (fallback về primary) cho các route GET chỉ đọc
+async def get_async_read_db() -> AsyncIterator[AsyncSession]:
+    async with AsyncReplicaSessionLocal() as session:
+        yield session
+
 # Metrics endpoint for Prometheus
 @app.get("/metrics")
 async def metrics():
@@ -6,8 +6,12 @@ from config.app_config import (
     # Database
     SessionLocal,
     AsyncSessionLocal,
+    ReplicaSessionLocal,
+    AsyncReplicaSessionLocal,
     engine,
     async_engine,
+    replica_engine,
+    async_replica_engine,
     
     # Configuration
     ALLOWED_ORIGINS,
@@ -29,8 +33,12 @@ from config.app_config import (
 __all__ = [
     "SessionLocal",
     "AsyncSessionLocal",
+    "ReplicaSessionLocal",
+    "AsyncReplicaSessionLocal",
     "engine",
     "async_engine",
+    "replica_engine",
+    "async_replica_engine",
     "ALLOWED_ORIGINS",
     "lifespan",
     "setup_database_indexes",
@@ -159,6 +159,21 @@ async_db_config = get_async_database_config()
 async_engine = async_db_config.create_async_engine()
 AsyncSessionLocal = async_db_config.create_async_session_factory(async_engine)
 
+# Read replica cho các route chỉ đọc; không cấu hình DB_READ_REPLICA_HOST thì dùng lại primary
+if db_config.has_read_replica():
+    replica_engine = db_config.create_engine(use_read_replica=True)
+    ReplicaSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=replica_engine)
+else:
+    replica_engine = engine
+    ReplicaSessionLocal = SessionLocal
+
+if async_db_config.has_read_replica():
+    async_replica_engine = async_db_config.create_async_engine(use_read_replica=True)
+    AsyncReplicaSessionLocal = async_db_config.create_async_session_factory(async_replica_engine)
+else:
+    async_replica_engine = async_engine
+    AsyncReplicaSessionLocal = AsyncSessionLocal
+
 
 def index_exists(conn, table_name: str, index_name: str) -> bool:
     """Kiểm tra xem index đã tồn tại chưa"""
@@ -349,6 +364,18 @@ def setup_database_indexes():
         },
     ]
     
+    # HNSW indexes cho pgvector: ORDER BY embedding <=> :query LIMIT k thành ANN index scan
+    if os.getenv("USE_PGVECTOR", "false").lower() == "true":
+        for column in ("combined_embedding_vector", "user_message_embedding_vector"):
+            indexes_to_create.append({
+                "name": f"idx_conversation_embeddings_{column}_hnsw",
+                "table": "conversation_embeddings",
+                "columns": f"{column} vector_cosine_ops",
+                "using": "hnsw",
+                "requires_column": column,
+                "description": f"HNSW index (cosine) cho {column} để semantic search không quét toàn bảng"
+            })
+    
     try:
         with engine.connect() as conn:
             created_count = 0
@@ -368,10 +395,19 @@ def setup_database_indexes():
                         skipped_count += 1
                         continue
                     
+                    # Index trên cột optional (vd. pgvector columns) -> bỏ qua nếu cột chưa có
+                    if idx.get("requires_column") and idx["requires_column"] not in {
+                        col["name"] for col in inspect(engine).get_columns(idx["table"])
+                    }:
+                        logging.debug(f"⏭️  Cột {idx['requires_column']} không tồn tại, bỏ qua index {idx['name']}")
+                        skipped_count += 1
+                        continue
+                    
                     # Tạo index
+                    using = f"USING {idx['using']} " if idx.get("using") else ""
                     create_sql = f"""
                         CREATE INDEX {idx['name']} 
-                        ON {idx['table']} ({idx['columns']})
+                        ON {idx['table']} {using}({idx['columns']})
                     """
                     
                     conn.execute(text(create_sql))
@@ -401,6 +437,56 @@ def setup_database_indexes():
         logging.error(f"❌ Lỗi khi setup database indexes: {e}")
         # Không raise exception để app vẫn có thể khởi động nếu indexes không thể tạo
 
+def setup_pgvector_extension():
+    """Tạo extension vector (cần trước create_all khi model có pgvector columns)"""
+    if not (USE_PGVECTOR and PGVECTOR_AVAILABLE):
+        return
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            conn.commit()
+    except Exception as e:
+        logging.warning(f"⚠️  Không thể tạo extension vector (cần quyền hoặc cài pgvector trên server): {e}")
+
+def setup_embedding_columns():
+    """
+    Thêm các cột embedding mới vào bảng conversation_embeddings đã tồn tại
+    (create_all không ALTER bảng cũ). Chạy nếu AUTO_MIGRATE_EMBEDDING_COLUMNS=true (default: true)
+    """
+    auto_migrate = os.getenv("AUTO_MIGRATE_EMBEDDING_COLUMNS", "true").lower() == "true"
+    if not auto_migrate:
+        logging.info("⏭️  Auto-migrate embedding columns disabled (AUTO_MIGRATE_EMBEDDING_COLUMNS=false)")
+        return
+    
+    try:
+        with engine.connect() as conn:
+            conn.execute(text("""
+                ALTER TABLE conversation_embeddings
+                ADD COLUMN IF NOT EXISTS combined_embedding_i8 BYTEA,
+                ADD COLUMN IF NOT EXISTS combined_embedding_scale REAL,
+                ADD COLUMN IF NOT EXISTS user_message_embedding_f32 BYTEA,
+                ADD COLUMN IF NOT EXISTS ai_response_embedding_f32 BYTEA,
+                ADD COLUMN IF NOT EXISTS combined_embedding_f32 BYTEA
+            """))
+            conn.commit()
+            
+            # pgvector columns cho bảng tạo trước khi bật USE_PGVECTOR
+            # (backfill dữ liệu cũ bằng migrations/backfill_pgvector_columns.py)
+            if USE_PGVECTOR and PGVECTOR_AVAILABLE:
+                try:
+                    conn.execute(text("""
+                        ALTER TABLE conversation_embeddings
+                        ADD COLUMN IF NOT EXISTS user_message_embedding_vector vector(384),
+                        ADD COLUMN IF NOT EXISTS ai_response_embedding_vector vector(384),
+                        ADD COLUMN IF NOT EXISTS combined_embedding_vector vector(384)
+                    """))
+                    conn.commit()
+                except Exception as e:
+                    logging.warning(f"⚠️  Không thể thêm pgvector columns: {e}")
+                    conn.rollback()
+    except Exception as e:
+        logging.error(f"❌ Lỗi khi setup embedding columns: {e}")
+
 # Import models from models.py to avoid circular imports
 from .models import (
     Base, AgentTask, AgentConversation, ConversationFeedback, 
@@ -408,7 +494,9 @@ from .models import (
 )
 
 # Create tables
+setup_pgvector_extension()
 Base.metadata.create_all(bind=engine)
+setup_embedding_columns()
 
 # Import Pydantic models from separate module for better organization
 # Re-export for backward compatibility
@@ -426,11 +514,34 @@ from .pydantic_models import (
 @asynccontextmanager
 async def lifespan(app):
     # Startup
+    # Service singletons dùng chung cho mọi request (db session được truyền vào từng method)
+    from services.semantic_search_service import SemanticSearchService
+    from services.pattern_analysis_service import PatternAnalysisService
+    from services.fine_tuning_service import FineTuningService
+    app.state.semantic_service = SemanticSearchService()
+    app.state.pattern_service = PatternAnalysisService()
+    app.state.fine_tuning_service = FineTuningService()
+    
+    # Load embedding model một lần khi start thay vì ở request đầu tiên
+    try:
+        from services.embedding_service import embedding_service
+        from services.async_helpers import run_sync_in_thread
+        if embedding_service.embedding_provider == "sentence-transformers":
+            await run_sync_in_thread(embedding_service._load_sentence_model)
+    except Exception as e:
+        logging.warning(f"Embedding model preload skipped: {e}")
+    
     try:
         with engine.connect() as conn:
             conn.execute(text("SELECT 1"))
         logging.info("Database connection: OK")
         
+        # Mở sẵn connections của async pool cho các request đầu tiên
+        try:
+            await async_db_config.warm_up_pool(async_engine)
+        except Exception as e:
+            logging.warning(f"Async pool warm-up skipped: {e}")
+        
         # Setup database indexes tự động
         setup_database_indexes()
         
@@ -457,6 +568,14 @@ async def lifespan(app):
         await background_tasks_service.start()
         logging.info("Background tasks started")
         
+        # Buffer gom conversations cần index để ghi embeddings theo batch
+        from services.indexing_buffer import indexing_buffer
+        await indexing_buffer.start()
+        
+        # Buffer gom API key audit logs để ghi bằng multi-row INSERT
+        from services.audit_log_buffer import audit_log_buffer
+        await audit_log_buffer.start()
+        
         # Initialize cache service để test Redis connection khi app start
         try:
             from services.advanced_cache_service import get_advanced_cache_service
@@ -509,6 +628,18 @@ async def lifespan(app):
     except Exception as e:
         logging.debug(f"Error stopping background tasks: {e}")
     
+    try:
+        from services.indexing_buffer import indexing_buffer
+        await indexing_buffer.stop()
+    except Exception as e:
+        logging.debug(f"Error stopping indexing buffer: {e}")
+    
+    try:
+        from services.audit_log_buffer import audit_log_buffer
+        await audit_log_buffer.stop()
+    except Exception as e:
+        logging.debug(f"Error stopping audit log buffer: {e}")
+    
     try:
         from services.embedding_service import embedding_service
         embedding_service.stop_precompute_task()
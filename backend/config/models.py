@@ -2,7 +2,8 @@
 Database Models
 Tách riêng models để tránh circular imports
 """
-from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Index
+from sqlalchemy import Column, Integer, String, DateTime, Text, Boolean, ForeignKey, Index, LargeBinary, Float, JSON
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import declarative_base
 from datetime import datetime
 import os
@@ -89,6 +90,16 @@ class ConversationEmbedding(Base):
     ai_response_embedding: str | None = Column(Text, nullable=True)  # JSON array của embedding vector
     combined_embedding: str | None = Column(Text, nullable=True)  # JSON array của combined embedding
     
+    # Embeddings dạng float32 bytes (np.float32.tobytes()): đọc bằng np.frombuffer, không parse JSON
+    user_message_embedding_f32: bytes | None = Column(LargeBinary, nullable=True)
+    ai_response_embedding_f32: bytes | None = Column(LargeBinary, nullable=True)
+    combined_embedding_f32: bytes | None = Column(LargeBinary, nullable=True)
+    
+    # Combined embedding lượng tử hóa int8 (absmax theo từng vector): dùng cho similarity search,
+    # nhỏ hơn 4 lần so với float32. Giá trị gốc ≈ int8 * combined_embedding_scale
+    combined_embedding_i8: bytes | None = Column(LargeBinary, nullable=True)
+    combined_embedding_scale: float | None = Column(Float, nullable=True)
+    
     # pgvector columns (nếu enabled)
     # Note: Các cột vector này chỉ được tạo khi USE_PGVECTOR=true và pgvector extension được cài đặt
     # Sử dụng user_message_embedding, ai_response_embedding, combined_embedding cho JSON storage
@@ -112,15 +123,15 @@ class APIKey(Base):
     __tablename__ = "api_keys"
 
     id: int = Column(Integer, primary_key=True, index=True)
-    # SHA-256 hex hash của API key
-    key_hash: str = Column(String(64), unique=True, nullable=False, index=True)
+    # SHA-256 digest (32 bytes raw) của API key
+    key_hash: bytes = Column(LargeBinary(32), unique=True, nullable=False, index=True)
 
     # Thông tin mô tả và gán cho user (nếu có)
     name: str = Column(String(255), nullable=False)
     user_id: int | None = Column(Integer, nullable=True, index=True)
 
-    # Permissions được lưu dạng JSON string (["read", "write", "admin"])
-    permissions: str | None = Column(Text, nullable=True)
+    # Permissions lưu dạng JSONB (["read", "write", "admin"]): driver trả về list, không cần json.loads
+    permissions: list | None = Column(JSON().with_variant(JSONB(), "postgresql"), nullable=True)
 
     # Rate limit riêng cho key này (vd: "100/minute")
     rate_limit: str = Column(String(50), default="100/minute")
@@ -141,6 +152,10 @@ class APIKeyAuditLog(Base):
     """
 
     __tablename__ = "api_key_audit_logs"
+    __table_args__ = (
+        # Usage stats: filter api_key_id + created_at, group by endpoint
+        Index('idx_audit_logs_key_created_endpoint', 'api_key_id', 'created_at', 'endpoint'),
+    )
 
     id: int = Column(Integer, primary_key=True, index=True)
 
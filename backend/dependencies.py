@@ -5,12 +5,17 @@ This module helps avoid circular imports and enables proper dependency injection
 """
 from typing import Iterator
 from collections.abc import AsyncIterator
-from fastapi import Depends
+from fastapi import Depends, Request
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Import database session factories
-from config.app_config import SessionLocal, AsyncSessionLocal
+from config.app_config import (
+    SessionLocal,
+    AsyncSessionLocal,
+    ReplicaSessionLocal,
+    AsyncReplicaSessionLocal,
+)
 
 # Import repositories
 from repositories import (
@@ -37,6 +42,15 @@ def get_db() -> Iterator[Session]:
         db.close()
 
 
+def get_read_db() -> Iterator[Session]:
+    """Dependency to get read-only session (read replica, fallback to primary)"""
+    db = ReplicaSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
 async def get_async_db() -> AsyncIterator[AsyncSession]:
     """Dependency to get async database session"""
     async with AsyncSessionLocal() as session:
@@ -46,6 +60,28 @@ async def get_async_db() -> AsyncIterator[AsyncSession]:
             await session.close()
 
 
+async def get_async_db_tx() -> AsyncIterator[AsyncSession]:
+    """
+    Dependency to get async session inside a transaction (write routes).
+    Commit khi handler thành công, rollback khi lỗi; dùng scope="function"
+    để commit xong trước khi gửi response.
+    """
+    async with AsyncSessionLocal.begin() as session:
+        yield session
+
+
+async def get_async_db_ro() -> AsyncIterator[AsyncSession]:
+    """Dependency to get async session for read-only routes (no commit)"""
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+async def get_async_read_db() -> AsyncIterator[AsyncSession]:
+    """Dependency to get async read-only session (read replica, fallback to primary)"""
+    async with AsyncReplicaSessionLocal() as session:
+        yield session
+
+
 # Repository dependencies
 def get_task_repository(db: Session = Depends(get_db)) -> TaskRepository:
     """Dependency to get TaskRepository"""
@@ -107,4 +143,34 @@ def get_embedding_service(
     # Note: EmbeddingService might need additional dependencies
     # This will need to be adjusted based on actual EmbeddingService implementation
     # For now, keep backward compatibility - EmbeddingService may still use db directly
-    return EmbeddingService(embedding_repo, conversation_repo)
\ No newline at end of file
+    return EmbeddingService(embedding_repo, conversation_repo)
+
+
+def get_semantic_service(request: Request):
+    """Dependency to get the app-wide SemanticSearchService singleton (created in lifespan)"""
+    service = getattr(request.app.state, "semantic_service", None)
+    if service is None:
+        from services.semantic_search_service import SemanticSearchService
+        service = SemanticSearchService()
+        request.app.state.semantic_service = service
+    return service
+
+
+def get_pattern_service(request: Request):
+    """Dependency to get the app-wide PatternAnalysisService singleton (created in lifespan)"""
+    service = getattr(request.app.state, "pattern_service", None)
+    if service is None:
+        from services.pattern_analysis_service import PatternAnalysisService
+        service = PatternAnalysisService()
+        request.app.state.pattern_service = service
+    return service
+
+
+def get_fine_tuning_service(request: Request):
+    """Dependency to get the app-wide FineTuningService singleton (created in lifespan)"""
+    service = getattr(request.app.state, "fine_tuning_service", None)
+    if service is None:
+        from services.fine_tuning_service import FineTuningService
+        service = FineTuningService()
+        request.app.state.fine_tuning_service = service
+    return service
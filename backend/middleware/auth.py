@@ -3,10 +3,15 @@ Authentication module cho API
 Hỗ trợ API key authentication với multiple keys từ database
 """
 import os
+import time
 import logging
+import secrets
+import threading
+from datetime import datetime
+from functools import lru_cache
 from fastapi import Security, HTTPException, status, Request, Depends
 from fastapi.security import APIKeyHeader
-from typing import Optional
+from typing import Optional, Dict, Tuple
 from sqlalchemy.orm import Session
 from dotenv import load_dotenv
 
@@ -26,6 +31,123 @@ USE_DATABASE_API_KEYS = os.getenv("USE_DATABASE_API_KEYS", "true").lower() == "t
 # API Key Header
 api_key_header = APIKeyHeader(name=API_KEY_HEADER_NAME, auto_error=False)
 
+# In-process TTL cache cho các API key đã verify (tránh query DB mỗi request)
+# TTL ngắn để revoke ở worker khác có hiệu lực trễ tối đa API_KEY_CACHE_TTL giây
+API_KEY_CACHE_TTL = float(os.getenv("API_KEY_CACHE_TTL", "30"))
+API_KEY_CACHE_MAXSIZE = int(os.getenv("API_KEY_CACHE_MAXSIZE", "10000"))
+# last_used_at của keys verify qua cache được gom lại, ghi bằng một UPDATE mỗi interval (giây)
+API_KEY_LAST_USED_FLUSH_INTERVAL = float(os.getenv("API_KEY_LAST_USED_FLUSH_INTERVAL", "30"))
+# Digest của keys đúng format nhưng bị DB từ chối được nhớ trong TTL này (giây)
+# để junk lặp lại không query DB mỗi request; TTL ngắn vì lỗi DB cũng trả về "không hợp lệ"
+API_KEY_INVALID_CACHE_TTL = float(os.getenv("API_KEY_INVALID_CACHE_TTL", "10"))
+API_KEY_INVALID_CACHE_MAXSIZE = int(os.getenv("API_KEY_INVALID_CACHE_MAXSIZE", "10000"))
+
+
+class CachedAPIKey:
+    """Snapshot của APIKey đã verify (không gắn với DB session), dùng cho cache"""
+    __slots__ = ("id", "name", "user_id", "permissions", "rate_limit", "is_active", "expires_at")
+    
+    def __init__(self, api_key: APIKey):
+        for attr in self.__slots__:
+            setattr(self, attr, getattr(api_key, attr))
+
+
+# SHA-256 digest của key (cùng giá trị với api_keys.key_hash) -> (expires_at monotonic, CachedAPIKey)
+_api_key_cache: Dict[bytes, Tuple[float, CachedAPIKey]] = {}
+_api_key_cache_lock = threading.Lock()
+
+# SHA-256 digest của key không hợp lệ -> expires_at monotonic
+_invalid_api_key_cache: Dict[bytes, float] = {}
+
+# api_key_id -> thời điểm dùng gần nhất chưa ghi DB
+_pending_last_used: Dict[int, datetime] = {}
+_pending_last_used_lock = threading.Lock()
+_last_used_flush_at = time.monotonic() + API_KEY_LAST_USED_FLUSH_INTERVAL
+
+
+def _get_cached_api_key(cache_key: bytes) -> Optional[CachedAPIKey]:
+    """Lấy API key từ cache theo digest, None nếu miss/hết TTL/key đã hết hạn"""
+    entry = _api_key_cache.get(cache_key)
+    if entry is None:
+        return None
+    cached_until, cached_key = entry
+    if cached_until < time.monotonic() or (
+        cached_key.expires_at and cached_key.expires_at < datetime.utcnow()
+    ):
+        _api_key_cache.pop(cache_key, None)
+        return None
+    return cached_key
+
+
+def _cache_api_key(cache_key: bytes, api_key: APIKey) -> CachedAPIKey:
+    """Lưu snapshot của API key vào cache"""
+    cached_key = CachedAPIKey(api_key)
+    with _api_key_cache_lock:
+        if len(_api_key_cache) >= API_KEY_CACHE_MAXSIZE:
+            # Bỏ entry cũ nhất (dict giữ thứ tự insert)
+            _api_key_cache.pop(next(iter(_api_key_cache)), None)
+        _api_key_cache[cache_key] = (time.monotonic() + API_KEY_CACHE_TTL, cached_key)
+    return cached_key
+
+
+def _is_known_invalid_api_key(key_hash: bytes) -> bool:
+    """True nếu digest vừa bị DB từ chối trong API_KEY_INVALID_CACHE_TTL giây gần đây"""
+    invalid_until = _invalid_api_key_cache.get(key_hash)
+    if invalid_until is None:
+        return False
+    if invalid_until < time.monotonic():
+        _invalid_api_key_cache.pop(key_hash, None)
+        return False
+    return True
+
+
+def _remember_invalid_api_key(key_hash: bytes) -> None:
+    """Nhớ digest không có trong DB (bounded, bỏ entry cũ nhất khi đầy)"""
+    with _api_key_cache_lock:
+        if len(_invalid_api_key_cache) >= API_KEY_INVALID_CACHE_MAXSIZE:
+            _invalid_api_key_cache.pop(next(iter(_invalid_api_key_cache)), None)
+        _invalid_api_key_cache[key_hash] = time.monotonic() + API_KEY_INVALID_CACHE_TTL
+
+
+def _is_legacy_env_key(api_key: str) -> bool:
+    """So sánh với legacy env key bằng constant-time compare"""
+    return bool(API_KEY_ENV) and secrets.compare_digest(api_key.encode(), API_KEY_ENV.encode())
+
+
+def _record_api_key_use(api_key_id: int) -> bool:
+    """Ghi nhận key vừa được dùng (cache hit); True nếu đã tới lúc flush last_used_at"""
+    with _pending_last_used_lock:
+        _pending_last_used[api_key_id] = datetime.utcnow()
+    return time.monotonic() >= _last_used_flush_at
+
+
+def _flush_api_key_last_used(db: Session) -> None:
+    """Ghi last_used_at đã gom bằng một UPDATE ... WHERE id IN (...)"""
+    global _last_used_flush_at
+    with _pending_last_used_lock:
+        pending = dict(_pending_last_used)
+        _pending_last_used.clear()
+        _last_used_flush_at = time.monotonic() + API_KEY_LAST_USED_FLUSH_INTERVAL
+    if pending:
+        APIKeyService(db).mark_api_keys_used(pending)
+
+
+def invalidate_api_key_cache(api_key_id: Optional[int] = None) -> None:
+    """
+    Xóa API key khỏi cache của process hiện tại (gọi khi revoke/rotate)
+    
+    Args:
+        api_key_id: ID của API key, None = xóa toàn bộ cache
+    """
+    with _api_key_cache_lock:
+        if api_key_id is None:
+            _api_key_cache.clear()
+            _invalid_api_key_cache.clear()
+            return
+        for cache_key, (_, cached_key) in list(_api_key_cache.items()):
+            if cached_key.id == api_key_id:
+                _api_key_cache.pop(cache_key, None)
+
 
 def get_db_from_request(request: Request) -> Session:
     """
@@ -84,25 +206,47 @@ async def verify_api_key(
     
     # Nếu sử dụng database API keys (recommended)
     if USE_DATABASE_API_KEYS:
+        # Key sai format (scanner, junk) không thể có trong DB -> bỏ qua SHA-256 và query,
+        # chỉ còn khả năng là legacy env key
+        key_hash = None
+        if APIKeyService.is_well_formed_api_key(api_key):
+            # Digest dùng chung cho cache key và DB lookup (hash một lần mỗi request)
+            key_hash = APIKeyService.hash_api_key(api_key)
+            cached_key = _get_cached_api_key(key_hash)
+            if cached_key is not None:
+                request.state.api_key = cached_key
+                if _record_api_key_use(cached_key.id):
+                    try:
+                        _flush_api_key_last_used(get_db_from_request(request))
+                    except Exception as e:
+                        logger.warning(f"Failed to flush API key last_used_at: {e}")
+                return cached_key
+            if _is_known_invalid_api_key(key_hash):
+                key_hash = None
+        
         try:
-            # Get database session từ request state hoặc create new
-            db = getattr(request.state, "db", None)
-            if not db:
-                import app
-                db = next(app.get_db())
-                request.state.db = db
-            
-            # Verify với database
-            api_key_service = APIKeyService(db)
-            db_api_key = api_key_service.verify_api_key(api_key)
-            
-            if db_api_key:
-                # Store API key object trong request state để dùng sau
-                request.state.api_key = db_api_key
-                return db_api_key
+            if key_hash is not None:
+                # Get database session từ request state hoặc create new
+                db = getattr(request.state, "db", None)
+                if not db:
+                    import app
+                    db = next(app.get_db())
+                    request.state.db = db
+                
+                # Verify với database (cập nhật last_used_at ngay trong lần verify này)
+                api_key_service = APIKeyService(db)
+                db_api_key = api_key_service.verify_api_key_hash(key_hash)
+                
+                if db_api_key:
+                    # Store API key snapshot trong request state để dùng sau
+                    cached_key = _cache_api_key(key_hash, db_api_key)
+                    request.state.api_key = cached_key
+                    return cached_key
+                
+                _remember_invalid_api_key(key_hash)
             
             # Nếu không tìm thấy trong database, thử legacy env key
-            if API_KEY_ENV and api_key == API_KEY_ENV:
+            if _is_legacy_env_key(api_key):
                 logger.warning("Using legacy API key from environment. Consider migrating to database API keys.")
                 class LegacyAPIKey:
                     id = -1
@@ -144,7 +288,7 @@ async def verify_api_key(
             request.state.api_key = mock_key
             return mock_key
         
-        if api_key != API_KEY_ENV:
+        if not _is_legacy_env_key(api_key):
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail="Invalid API key.",
@@ -184,9 +328,12 @@ async def optional_api_key(
         return None
 
 
+@lru_cache(maxsize=16)
 def require_permission(permission: str):
     """
     Dependency để kiểm tra permission của API key
+    Cùng một permission luôn trả về cùng một callable, nên FastAPI
+    cache dependency theo callable và chỉ resolve signature một lần
     
     Usage:
         @router.get("/admin")
@@ -200,16 +347,8 @@ def require_permission(permission: str):
         request: Request,
         api_key: APIKey = Depends(verify_api_key)
     ) -> APIKey:
-        from services.api_key_service import APIKeyService
-        import app
-        
-        # Get database session
-        db = getattr(request.state, "db", None)
-        if not db:
-            db = next(app.get_db())
-            request.state.db = db
-        
-        api_key_service = APIKeyService(db)
+        # check_permission chỉ đọc permissions của key (đã cache) -> không cần DB session
+        api_key_service = APIKeyService(None)
         
         if not api_key_service.check_permission(api_key, permission):
             raise HTTPException(
@@ -16,11 +16,23 @@ RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
 DEFAULT_RATE_LIMIT = os.getenv("DEFAULT_RATE_LIMIT", "100/minute")  # Format: "number/period"
 STRICT_RATE_LIMIT = os.getenv("STRICT_RATE_LIMIT", "10/minute")  # Cho các endpoints quan trọng
 
+# Storage cho rate limit counters
+# - "memory://": chỉ đúng trong 1 process
+# - "redis://host:port/db": dùng chung giữa các workers; mỗi request chỉ 1 EVALSHA
+#   (Lua script check + increment atomic của thư viện limits, không có race INCR/EXPIRE)
+RATE_LIMIT_STORAGE_URI = os.getenv("RATE_LIMIT_STORAGE_URI", "memory://")
+# sliding-window-counter: atomic acquire (Lua) trên Redis, không bị burst ở biên window như fixed-window
+RATE_LIMIT_STRATEGY = os.getenv("RATE_LIMIT_STRATEGY", "sliding-window-counter")
+# Nếu Redis lỗi thì fallback về in-memory thay vì fail request
+RATE_LIMIT_IN_MEMORY_FALLBACK = not RATE_LIMIT_STORAGE_URI.startswith("memory://")
+
 # Initialize limiter
 limiter = Limiter(
     key_func=get_remote_address,  # Sử dụng IP address để identify clients
     default_limits=[DEFAULT_RATE_LIMIT] if RATE_LIMIT_ENABLED else [],
-    storage_uri="memory://",  # In-memory storage (có thể thay bằng Redis sau)
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+    in_memory_fallback_enabled=RATE_LIMIT_IN_MEMORY_FALLBACK,
     headers_enabled=False  # Disable headers để tránh lỗi với exception handling
 )
 
@@ -60,7 +72,9 @@ def get_rate_limit_for_api_key(request: Request) -> str:
 limiter_with_api_key = Limiter(
     key_func=get_rate_limit_key,
     default_limits=[DEFAULT_RATE_LIMIT] if RATE_LIMIT_ENABLED else [],
-    storage_uri="memory://",
+    storage_uri=RATE_LIMIT_STORAGE_URI,
+    strategy=RATE_LIMIT_STRATEGY,
+    in_memory_fallback_enabled=RATE_LIMIT_IN_MEMORY_FALLBACK,
     headers_enabled=False  # Disable headers để tránh lỗi với exception handling
 )
 
@@ -113,6 +113,14 @@ def create_indexes():
             "columns": "conversation_id",
             "description": "Index cho conversation_id để join embeddings với conversations nhanh hơn"
         },
+        
+        # Indexes cho api_key_audit_logs
+        {
+            "name": "idx_audit_logs_key_created_endpoint",
+            "table": "api_key_audit_logs",
+            "columns": "api_key_id, created_at, endpoint",
+            "description": "Composite index cho usage stats theo api_key_id + khoảng thời gian, group by endpoint"
+        },
     ]
     
     with engine.connect() as conn:
@@ -0,0 +1,116 @@
+"""
+Migration script để thêm và backfill các cột binary cho embeddings:
+- combined_embedding_i8 BYTEA + combined_embedding_scale REAL (int8 absmax)
+- *_embedding_f32 BYTEA (float32 bytes, đọc bằng np.frombuffer thay vì parse JSON)
+
+LƯU Ý: Các cột sẽ TỰ ĐỘNG được thêm khi app khởi động
+       (nếu AUTO_MIGRATE_EMBEDDING_COLUMNS=true trong .env, mặc định là true).
+       Rows chưa backfill vẫn được search bình thường (parse JSON khi load).
+
+Chạy script này để backfill các embeddings cũ từ các cột JSON.
+"""
+import sys
+import os
+import json
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+import logging
+
+from services.semantic_search_service import quantize_int8, to_f32_bytes
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Database configuration
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    # Fallback to individual components
+    DB_HOST = os.getenv("DB_HOST", "localhost")
+    DB_PORT = os.getenv("DB_PORT", "5432")
+    DB_NAME = os.getenv("DB_NAME", "senai_db")
+    DB_USER = os.getenv("DB_USER", "postgres")
+    DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+    
+    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+BATCH_SIZE = int(os.getenv("QUANTIZE_BATCH_SIZE", "1000"))
+
+def quantize_embeddings():
+    """Thêm các cột binary (nếu chưa có) và backfill từ JSON embeddings theo batch"""
+    engine = create_engine(DATABASE_URL)
+    
+    with engine.connect() as conn:
+        conn.execute(text("""
+            ALTER TABLE conversation_embeddings
+            ADD COLUMN IF NOT EXISTS combined_embedding_i8 BYTEA,
+            ADD COLUMN IF NOT EXISTS combined_embedding_scale REAL,
+            ADD COLUMN IF NOT EXISTS user_message_embedding_f32 BYTEA,
+            ADD COLUMN IF NOT EXISTS ai_response_embedding_f32 BYTEA,
+            ADD COLUMN IF NOT EXISTS combined_embedding_f32 BYTEA
+        """))
+        conn.commit()
+        
+        total = 0
+        last_id = 0
+        while True:
+            rows = conn.execute(text("""
+                SELECT id, combined_embedding, user_message_embedding, ai_response_embedding
+                FROM conversation_embeddings
+                WHERE id > :last_id
+                AND combined_embedding IS NOT NULL
+                AND (combined_embedding_i8 IS NULL OR combined_embedding_f32 IS NULL)
+                ORDER BY id
+                LIMIT :batch_size
+            """), {"last_id": last_id, "batch_size": BATCH_SIZE}).fetchall()
+            
+            if not rows:
+                break
+            
+            updates = []
+            for row_id, combined_str, user_str, ai_str in rows:
+                try:
+                    combined = json.loads(combined_str)
+                    vec, scale = quantize_int8(combined)
+                    updates.append({
+                        "id": row_id,
+                        "i8": vec.tobytes(),
+                        "scale": scale,
+                        "combined_f32": to_f32_bytes(combined),
+                        "user_f32": to_f32_bytes(json.loads(user_str)) if user_str else None,
+                        "ai_f32": to_f32_bytes(json.loads(ai_str)) if ai_str else None
+                    })
+                except Exception as e:
+                    logger.warning(f"Skip embedding {row_id}: {e}")
+            
+            if updates:
+                conn.execute(text("""
+                    UPDATE conversation_embeddings
+                    SET combined_embedding_i8 = :i8, combined_embedding_scale = :scale,
+                        combined_embedding_f32 = :combined_f32,
+                        user_message_embedding_f32 = :user_f32,
+                        ai_response_embedding_f32 = :ai_f32
+                    WHERE id = :id
+                """), updates)
+                conn.commit()
+            
+            total += len(updates)
+            last_id = rows[-1][0]
+            logger.info(f"Backfilled {total} embeddings...")
+        
+        logger.info(f"✅ Đã backfill {total} embeddings sang int8/float32 bytes")
+
+if __name__ == "__main__":
+    try:
+        quantize_embeddings()
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi backfill binary embeddings: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
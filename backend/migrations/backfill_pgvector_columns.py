@@ -0,0 +1,90 @@
+"""
+Migration script để backfill pgvector columns từ JSON embeddings
+(user_message_embedding_vector, ai_response_embedding_vector, combined_embedding_vector)
+
+LƯU Ý: Extension vector và các cột sẽ TỰ ĐỘNG được tạo khi app khởi động với USE_PGVECTOR=true
+       (nếu AUTO_MIGRATE_EMBEDDING_COLUMNS=true), HNSW indexes do AUTO_MIGRATE_INDEXES tạo.
+       Chỉ rows đã có vector mới được pgvector search (ORDER BY <=> LIMIT k) trả về.
+
+Chạy script này một lần sau khi bật USE_PGVECTOR cho database đã có embeddings.
+JSON array '[0.1, 0.2, ...]' đúng text format của pgvector -> cast trực tiếp trong SQL.
+"""
+import sys
+import os
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+import logging
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+logging.basicConfig(level=logging.INFO)
+
+# Database configuration
+DATABASE_URL = os.getenv("DATABASE_URL")
+if not DATABASE_URL:
+    # Fallback to individual components
+    DB_HOST = os.getenv("DB_HOST", "localhost")
+    DB_PORT = os.getenv("DB_PORT", "5432")
+    DB_NAME = os.getenv("DB_NAME", "senai_db")
+    DB_USER = os.getenv("DB_USER", "postgres")
+    DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+    
+    DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+BATCH_SIZE = int(os.getenv("BACKFILL_BATCH_SIZE", "5000"))
+
+def backfill_pgvector_columns():
+    """Tạo extension/cột nếu chưa có và backfill vector columns theo id range"""
+    engine = create_engine(DATABASE_URL)
+    
+    with engine.connect() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.execute(text("""
+            ALTER TABLE conversation_embeddings
+            ADD COLUMN IF NOT EXISTS user_message_embedding_vector vector(384),
+            ADD COLUMN IF NOT EXISTS ai_response_embedding_vector vector(384),
+            ADD COLUMN IF NOT EXISTS combined_embedding_vector vector(384)
+        """))
+        conn.commit()
+        
+        max_id = conn.execute(text("SELECT COALESCE(MAX(id), 0) FROM conversation_embeddings")).scalar()
+        total = 0
+        for start in range(0, max_id + 1, BATCH_SIZE):
+            # Chỉ cast embeddings đúng 384 chiều (embeddings của model khác giữ JSON)
+            result = conn.execute(text("""
+                UPDATE conversation_embeddings
+                SET combined_embedding_vector = CAST(combined_embedding AS vector),
+                    user_message_embedding_vector = CASE
+                        WHEN user_message_embedding IS NOT NULL THEN CAST(user_message_embedding AS vector)
+                    END,
+                    ai_response_embedding_vector = CASE
+                        WHEN ai_response_embedding IS NOT NULL THEN CAST(ai_response_embedding AS vector)
+                    END
+                WHERE id >= :start AND id < :end
+                AND combined_embedding IS NOT NULL
+                AND combined_embedding_vector IS NULL
+                AND embedding_dimension = 384
+            """), {"start": start, "end": start + BATCH_SIZE})
+            conn.commit()
+            total += result.rowcount
+            logger.info(f"Backfilled {total} embeddings...")
+        
+        # Cập nhật statistics để planner dùng HNSW index
+        conn.execute(text("ANALYZE conversation_embeddings"))
+        conn.commit()
+        logger.info(f"✅ Đã backfill {total} embeddings sang pgvector columns")
+
+if __name__ == "__main__":
+    try:
+        backfill_pgvector_columns()
+    except Exception as e:
+        logger.error(f"❌ Lỗi khi backfill pgvector columns: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,75 @@
+"""
+Migration script để chuyển api_keys.key_hash từ hex string (VARCHAR) sang BYTEA (digest 32 bytes)
+Chạy script này một lần sau khi cập nhật code; keys đã tạo vẫn dùng được (decode hex -> bytes)
+"""
+import os
+import sys
+import io
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_HOST = os.getenv("DB_HOST", "192.168.0.106")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "ai_system")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+def convert_key_hash_column():
+    """Chuyển key_hash sang BYTEA"""
+    engine = create_engine(DATABASE_URL)
+    
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT data_type 
+            FROM information_schema.columns 
+            WHERE table_name = 'api_keys' AND column_name = 'key_hash'
+        """))
+        
+        row = result.fetchone()
+        if not row:
+            print("[ERROR] Cot key_hash khong ton tai. Chay create_api_keys_tables.py truoc.")
+            return False
+        
+        current_type = row[0]
+        print(f"[INFO] Kieu du lieu hien tai cua key_hash: {current_type}")
+        
+        if current_type.lower() == 'bytea':
+            print("[OK] Cot key_hash da la BYTEA. Khong can sua.")
+            return True
+        
+        if current_type.lower() in ['character varying', 'varchar', 'text', 'character']:
+            print("[INFO] Dang chuyen doi key_hash tu hex string sang BYTEA...")
+            
+            # decode(hex) giữ nguyên giá trị SHA-256; unique index được PostgreSQL rebuild cùng ALTER
+            conn.execute(text("""
+                ALTER TABLE api_keys 
+                ALTER COLUMN key_hash TYPE BYTEA 
+                USING decode(key_hash, 'hex')
+            """))
+            
+            conn.commit()
+            print("[OK] Da chuyen doi thanh cong key_hash sang BYTEA")
+            return True
+        else:
+            print(f"[WARNING] Kieu du lieu khong xac dinh: {current_type}. Vui long kiem tra thu cong.")
+            return False
+
+if __name__ == "__main__":
+    try:
+        convert_key_hash_column()
+    except Exception as e:
+        print(f"[ERROR] Loi khi chuyen doi key_hash: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
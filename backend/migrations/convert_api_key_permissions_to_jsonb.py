@@ -0,0 +1,75 @@
+"""
+Migration script để chuyển api_keys.permissions từ JSON string (TEXT) sang JSONB
+Chạy script này một lần sau khi cập nhật code; permissions cũ được parse thành JSON array
+"""
+import os
+import sys
+import io
+from sqlalchemy import create_engine, text
+from dotenv import load_dotenv
+
+# Fix encoding cho Windows console
+if sys.platform == 'win32':
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', errors='replace')
+    sys.stderr = io.TextIOWrapper(sys.stderr.buffer, encoding='utf-8', errors='replace')
+
+# Load environment variables
+load_dotenv()
+
+# Database configuration
+DB_HOST = os.getenv("DB_HOST", "192.168.0.106")
+DB_PORT = os.getenv("DB_PORT", "5432")
+DB_NAME = os.getenv("DB_NAME", "ai_system")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASSWORD = os.getenv("DB_PASSWORD", "")
+
+DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+def convert_permissions_column():
+    """Chuyển permissions sang JSONB"""
+    engine = create_engine(DATABASE_URL)
+    
+    with engine.connect() as conn:
+        result = conn.execute(text("""
+            SELECT data_type 
+            FROM information_schema.columns 
+            WHERE table_name = 'api_keys' AND column_name = 'permissions'
+        """))
+        
+        row = result.fetchone()
+        if not row:
+            print("[ERROR] Cot permissions khong ton tai. Chay create_api_keys_tables.py truoc.")
+            return False
+        
+        current_type = row[0]
+        print(f"[INFO] Kieu du lieu hien tai cua permissions: {current_type}")
+        
+        if current_type.lower() == 'jsonb':
+            print("[OK] Cot permissions da la JSONB. Khong can sua.")
+            return True
+        
+        if current_type.lower() in ['character varying', 'varchar', 'text', 'character']:
+            print("[INFO] Dang chuyen doi permissions tu TEXT sang JSONB...")
+            
+            # Giá trị rỗng -> NULL, còn lại là JSON array do json.dumps tạo ra
+            conn.execute(text("""
+                ALTER TABLE api_keys 
+                ALTER COLUMN permissions TYPE JSONB 
+                USING NULLIF(permissions, '')::jsonb
+            """))
+            
+            conn.commit()
+            print("[OK] Da chuyen doi thanh cong permissions sang JSONB")
+            return True
+        else:
+            print(f"[WARNING] Kieu du lieu khong xac dinh: {current_type}. Vui long kiem tra thu cong.")
+            return False
+
+if __name__ == "__main__":
+    try:
+        convert_permissions_column()
+    except Exception as e:
+        print(f"[ERROR] Loi khi chuyen doi permissions: {e}")
+        import traceback
+        traceback.print_exc()
+        sys.exit(1)
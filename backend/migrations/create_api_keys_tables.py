@@ -28,10 +28,10 @@ def create_tables():
         conn.execute(text("""
             CREATE TABLE IF NOT EXISTS api_keys (
                 id SERIAL PRIMARY KEY,
-                key_hash VARCHAR(255) NOT NULL UNIQUE,
+                key_hash BYTEA NOT NULL UNIQUE,
                 name VARCHAR(255) NOT NULL,
                 user_id INTEGER,
-                permissions TEXT,
+                permissions JSONB,
                 rate_limit VARCHAR(50) DEFAULT '100/minute',
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
                 expires_at TIMESTAMP,
@@ -22,8 +22,8 @@ class APIKeyRepository(BaseRepository[APIKey]):
         import logging
         logger = logging.getLogger(__name__)
     
-    def get_by_key_hash(self, key_hash: str) -> Optional[APIKey]:
-        """Get API key by key hash"""
+    def get_by_key_hash(self, key_hash: bytes) -> Optional[APIKey]:
+        """Get API key by key hash (SHA-256 digest 32 bytes)"""
         return (
             self.session.query(self.model)
             .filter(self.model.key_hash == key_hash)
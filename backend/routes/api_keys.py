@@ -4,18 +4,26 @@ Endpoints để quản lý API keys: GET/POST/DELETE /api/keys
 """
 from fastapi import APIRouter, HTTPException, Depends, Request
 from sqlalchemy.orm import Session
-from typing import Optional, List
+from typing import Optional, List, Any
 from pydantic import BaseModel, Field
+import hashlib
+import json
 import logging
+import os
 
-from middleware.auth import verify_api_key, require_permission
+from middleware.auth import verify_api_key, require_permission, invalidate_api_key_cache
 from middleware.rate_limit import limiter_with_api_key, STRICT_RATE_LIMIT
 from services.api_key_service import APIKeyService
+from services.cache_service import get_redis_client
 from models import APIKey
 import app
 
 logger = logging.getLogger(__name__)
 
+# Response cache cho các GET endpoints (Redis, dùng chung giữa các workers)
+API_KEYS_CACHE_PREFIX = "sen-api:api_keys"
+API_KEYS_CACHE_TTL = int(os.getenv("API_KEYS_CACHE_TTL", "60"))  # seconds
+
 router = APIRouter(prefix="/api/keys", tags=["API Keys"])
 
 # Pydantic models
@@ -74,14 +82,54 @@ class APIKeyUsageStats(BaseModel):
     endpoint_counts: dict
 
 
-# Get database dependency
-def get_db(request: Request) -> Session:
-    """Get database session từ request state"""
-    db = getattr(request.state, "db", None)
-    if not db:
-        db = next(app.get_db())
-        request.state.db = db
-    return db
+def _response_cache_key(endpoint: str, **params: Any) -> str:
+    """Cache key chỉ từ endpoint và query/path params (bỏ qua db session và API key)"""
+    params_hash = hashlib.sha256(
+        json.dumps(params, sort_keys=True, default=str).encode()
+    ).hexdigest()
+    return f"{API_KEYS_CACHE_PREFIX}:{endpoint}:{params_hash}"
+
+
+def _get_cached_response(cache_key: str) -> Optional[Any]:
+    """Lấy response đã cache, None nếu miss hoặc Redis không available"""
+    redis_client = get_redis_client()
+    if not redis_client:
+        return None
+    try:
+        cached = redis_client.get(cache_key)
+        return json.loads(cached) if cached else None
+    except Exception as e:
+        logger.warning(f"API keys cache get error: {e}")
+        return None
+
+
+def _set_cached_response(cache_key: str, value: Any) -> None:
+    """Cache response với TTL ngắn"""
+    redis_client = get_redis_client()
+    if not redis_client:
+        return
+    try:
+        redis_client.setex(cache_key, API_KEYS_CACHE_TTL, json.dumps(value, default=str))
+    except Exception as e:
+        logger.warning(f"API keys cache set error: {e}")
+
+
+def _invalidate_response_cache() -> None:
+    """Xóa toàn bộ response cache của API keys (gọi sau create/revoke/rotate)"""
+    redis_client = get_redis_client()
+    if not redis_client:
+        return
+    try:
+        keys = list(redis_client.scan_iter(match=f"{API_KEYS_CACHE_PREFIX}:*", count=500))
+        if keys:
+            redis_client.delete(*keys)
+    except Exception as e:
+        logger.warning(f"API keys cache invalidation error: {e}")
+
+
+# Database dependency dùng chung (QueuePool session, được close sau request).
+# FastAPI cache dependency này trong một request nên require_permission và route dùng chung session.
+get_db = app.get_db
 
 
 @router.get("", response_model=List[APIKeyResponse])
@@ -101,12 +149,20 @@ async def list_api_keys(
     - Yêu cầu permission: admin
     """
     try:
+        cache_key = _response_cache_key(
+            "list", user_id=user_id, include_inactive=include_inactive
+        )
+        cached = _get_cached_response(cache_key)
+        if cached is not None:
+            return cached
+        
         api_key_service = APIKeyService(db)
         api_keys = api_key_service.get_api_keys(
             user_id=user_id,
             include_inactive=include_inactive
         )
         
+        _set_cached_response(cache_key, api_keys)
         return api_keys
     except Exception as e:
         logger.error(f"Error listing API keys: {e}")
@@ -153,6 +209,7 @@ async def create_api_key(
                 detail=result.get("error", "Failed to create API key")
             )
         
+        _invalidate_response_cache()
         return result
     except HTTPException:
         raise
@@ -188,6 +245,8 @@ async def revoke_api_key(
                 detail=result.get("error", "Failed to revoke API key")
             )
         
+        _invalidate_response_cache()
+        invalidate_api_key_cache(api_key_id)
         return result
     except HTTPException:
         raise
@@ -231,6 +290,9 @@ async def rotate_api_key(
                 detail=result.get("error", "Failed to rotate API key")
             )
         
+        _invalidate_response_cache()
+        if rotate_data.revoke_old:
+            invalidate_api_key_cache(api_key_id)
         return result
     except HTTPException:
         raise
@@ -259,6 +321,11 @@ async def get_api_key_stats(
     - Yêu cầu permission: admin
     """
     try:
+        cache_key = _response_cache_key("stats", api_key_id=api_key_id, days=days)
+        cached = _get_cached_response(cache_key)
+        if cached is not None:
+            return cached
+        
         api_key_service = APIKeyService(db)
         stats = api_key_service.get_api_key_usage_stats(
             api_key_id=api_key_id,
@@ -271,6 +338,7 @@ async def get_api_key_stats(
                 detail="API key not found or no usage data"
             )
         
+        _set_cached_response(cache_key, stats)
         return stats
     except HTTPException:
         raise
@@ -297,16 +365,20 @@ async def get_api_key(
     - Yêu cầu permission: admin
     """
     try:
-        api_key_service = APIKeyService(db)
-        api_keys = api_key_service.get_api_keys(include_inactive=True)
+        cache_key = _response_cache_key("get", api_key_id=api_key_id)
+        cached = _get_cached_response(cache_key)
+        if cached is not None:
+            return cached
         
-        api_key = next((k for k in api_keys if k["id"] == api_key_id), None)
+        api_key_service = APIKeyService(db)
+        api_key = api_key_service.get_api_key_by_id(api_key_id)
         if not api_key:
             raise HTTPException(
                 status_code=404,
                 detail="API key not found"
             )
         
+        _set_cached_response(cache_key, api_key)
         return api_key
     except HTTPException:
         raise
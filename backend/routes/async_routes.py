@@ -2,17 +2,24 @@
 Async Routes
 Các routes sử dụng async database operations
 """
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, BackgroundTasks
+from fastapi.responses import StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from typing import Optional, List
+from sqlalchemy import select, tuple_
+from typing import Optional, List, Tuple
+from datetime import datetime
+import asyncio
+import json
 import logging
+import os
 
 # Import services
 from services.llm_service import llm_service
 from services.async_cache_service import get_async_cache_service
 from services.celery_tasks import index_conversation_task
 from services.batch_processing import batch_processor
+from services.semantic_search_service import SemanticSearchService
+from services.pattern_analysis_service import PatternAnalysisService
 
 # Import centralized error handler
 from services.error_handler import (
@@ -32,11 +39,17 @@ from services.async_helpers import run_sync_in_thread
 # Import models
 from config.models import AgentTask, AgentConversation
 
+# Service singletons (app.state)
+from dependencies import get_semantic_service, get_pattern_service
+
 # Import dependencies from app
 import app
 
 # Get references from app module
-get_async_db = app.get_async_db
+get_async_db_tx = app.get_async_db_tx
+get_async_db_ro = app.get_async_db_ro
+SessionLocal = app.SessionLocal
+AsyncSessionLocal = app.AsyncSessionLocal
 TaskCreate = app.TaskCreate
 TaskResponse = app.TaskResponse
 ConversationCreate = app.ConversationCreate
@@ -47,6 +60,17 @@ async_router = APIRouter(prefix="/async", tags=["async"])
 
 logger = logging.getLogger(__name__)
 
+# Timeouts (giây) cho các bước chuẩn bị context chạy song song trước khi gọi LLM
+SEMANTIC_CONTEXT_TIMEOUT = float(os.getenv("SEMANTIC_CONTEXT_TIMEOUT", "0.5"))
+PATTERN_SUGGESTIONS_TIMEOUT = float(os.getenv("PATTERN_SUGGESTIONS_TIMEOUT", "0.3"))
+BEST_RESPONSE_TIMEOUT = float(os.getenv("BEST_RESPONSE_TIMEOUT", "0.4"))
+
+# Message ngắn hơn ngưỡng này ("ok", "hi", ...) bỏ qua embedding, semantic search và pattern analysis
+MIN_SEMANTIC_LEN = int(os.getenv("MIN_SEMANTIC_LEN", "8"))
+
+# Số lượt conversation gần nhất trong session đưa vào history cho LLM
+HISTORY_WINDOW = int(os.getenv("CONVERSATION_HISTORY_WINDOW", "20"))
+
 
 # Async Task endpoints
 @async_router.post("/tasks", response_model=TaskResponse)
@@ -54,7 +78,7 @@ logger = logging.getLogger(__name__)
 async def create_task_async(
     request: Request,
     task: TaskCreate,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_async_db_tx, scope="function"),
     api_key = Depends(verify_api_key)
 ):
     """Create task với async database operations"""
@@ -65,11 +89,11 @@ async def create_task_async(
             status="pending"
         )
         db.add(db_task)
-        await db.commit()
-        await db.refresh(db_task)
+        # Commit do get_async_db_tx thực hiện trước khi gửi response.
+        # flush = INSERT ... RETURNING id; created_at/updated_at là Python-side defaults -> không cần refresh SELECT lại
+        await db.flush()
         return db_task
     except Exception as e:
-        await db.rollback()
         raise handle_database_error(e, context="create_task_async")
 
 
@@ -78,14 +102,23 @@ async def get_tasks_async(
     request: Request,
     skip: int = 0,
     limit: int = 100,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_async_db_ro),
     api_key = Depends(verify_api_key)
 ):
     """Get tasks với async database operations"""
     try:
-        stmt = select(AgentTask).offset(skip).limit(limit)
+        # Chỉ select các cột của TaskResponse, trả về row mappings (không tạo ORM objects)
+        stmt = select(
+            AgentTask.id,
+            AgentTask.task_name,
+            AgentTask.description,
+            AgentTask.status,
+            AgentTask.result,
+            AgentTask.created_at,
+            AgentTask.updated_at
+        ).offset(skip).limit(limit)
         result = await db.execute(stmt)
-        tasks = result.scalars().all()
+        tasks = result.mappings().all()
         return tasks
     except Exception as e:
         raise handle_database_error(e, context="get_tasks_async")
@@ -95,7 +128,7 @@ async def get_tasks_async(
 async def get_task_async(
     request: Request,
     task_id: int,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_async_db_ro),
     api_key = Depends(verify_api_key)
 ):
     """Get task by ID với async database operations"""
@@ -118,13 +151,11 @@ async def update_task_async(
     task_id: int,
     status: str,
     result: Optional[str] = None,
-    db: AsyncSession = Depends(get_async_db),
+    db: AsyncSession = Depends(get_async_db_tx, scope="function"),
     api_key = Depends(verify_api_key)
 ):
     """Update task với async database operations"""
     try:
-        from datetime import datetime
-        
         stmt = select(AgentTask).where(AgentTask.id == task_id)
         result_query = await db.execute(stmt)
         task = result_query.scalar_one_or_none()
@@ -137,117 +168,193 @@ async def update_task_async(
             task.result = result
         task.updated_at = datetime.utcnow()
         
-        await db.commit()
-        await db.refresh(task)
+        # updated_at đã set ở trên -> flush UPDATE là đủ, không cần refresh SELECT lại
+        await db.flush()
         return task
     except HTTPException:
         raise
     except Exception as e:
-        await db.rollback()
         raise handle_database_error(e, context="update_task_async")
 
 
 # Async Conversation endpoints
-@async_router.post("/conversations", response_model=ConversationResponse)
-@limiter_with_api_key.limit(STRICT_RATE_LIMIT)
-async def create_conversation_async(
-    request: Request,
+def _queue_indexing(conversation_id: int, user_message: str, ai_response: str) -> None:
+    """Queue Celery indexing task (broker RPC), không raise nếu broker lỗi"""
+    try:
+        index_conversation_task.delay(
+            conversation_id=conversation_id,
+            user_message=user_message,
+            ai_response=ai_response
+        )
+    except Exception as e:
+        logger.warning(f"Failed to queue indexing for conversation {conversation_id}: {e}")
+
+
+async def _prepare_conversation_context(
     conversation: ConversationCreate,
-    db: AsyncSession = Depends(get_async_db),
-    api_key: str = Depends(verify_api_key)
-):
+    db: AsyncSession,
+    semantic_service: SemanticSearchService,
+    pattern_service: PatternAnalysisService
+) -> Tuple[List[dict], str]:
     """
-    Tạo conversation mới với AI response từ LLM (async version)
-    Sử dụng Celery cho background indexing
+    Chuẩn bị conversation history và enhanced system prompt cho LLM
+    
+    Returns:
+        (conversation_history, system_prompt)
     """
-    try:
-        # Lấy conversation history nếu có session_id
-        conversation_history = []
-        if conversation.session_id:
-            stmt = select(AgentConversation).where(
-                AgentConversation.session_id == conversation.session_id
-            ).order_by(AgentConversation.created_at)
-            result = await db.execute(stmt)
-            previous_convs = result.scalars().all()
-            
-            for conv in previous_convs:
-                conversation_history.append({
-                    "role": "user",
-                    "content": conv.user_message
-                })
-                if conv.ai_response:
-                    conversation_history.append({
-                        "role": "assistant",
-                        "content": conv.ai_response
-                    })
-        
-        # Semantic search để tìm similar conversations (async)
-        semantic_context = []
-        best_response = None
-        suggestions = {}
-        semantic_service = None
+    async def fetch_history() -> List[dict]:
+        """Lấy conversation history nếu có session_id"""
+        history = []
+        if not conversation.session_id:
+            return history
+        # Chỉ lấy HISTORY_WINDOW lượt gần nhất, chỉ 2 cột cần cho prompt
+        stmt = select(
+            AgentConversation.user_message,
+            AgentConversation.ai_response
+        ).where(
+            AgentConversation.session_id == conversation.session_id
+        ).order_by(AgentConversation.created_at.desc()).limit(HISTORY_WINDOW)
+        result = await db.execute(stmt)
+        rows = result.all()
+        rows.reverse()
         
+        for user_message, ai_response in rows:
+            history.append({
+                "role": "user",
+                "content": user_message
+            })
+            if ai_response:
+                history.append({
+                    "role": "assistant",
+                    "content": ai_response
+                })
+        return history
+    
+    # Semantic/pattern services dùng sync session riêng vì chạy song song với history query
+    async def fetch_semantic_context():
+        # shield: timeout của một nhánh không được cancel embedding dùng chung
+        query_embedding = await asyncio.shield(embedding_task)
+        search_db = SessionLocal()
         try:
-            from services.semantic_search_service import SemanticSearchService
-            semantic_service = SemanticSearchService(db)
-            semantic_context = await semantic_service.get_semantic_context(
+            return await semantic_service.get_semantic_context(
                 user_message=conversation.user_message,
-                context_limit=3
+                context_limit=3,
+                query_embedding=query_embedding,
+                db=search_db
             )
-        except Exception as e:
-            logger.warning(f"Error in semantic search, continuing without context: {e}")
-        
-        # Phân tích patterns và tìm suggestions (async nếu có)
+        finally:
+            search_db.close()
+    
+    async def fetch_best_response():
+        # shield: timeout của một nhánh không được cancel embedding dùng chung
+        query_embedding = await asyncio.shield(embedding_task)
+        search_db = SessionLocal()
+        try:
+            return await semantic_service.find_best_response(
+                user_message=conversation.user_message,
+                limit=1,
+                min_similarity=0.7,
+                query_embedding=query_embedding,
+                db=search_db
+            )
+        finally:
+            search_db.close()
+    
+    def fetch_suggestions():
+        pattern_db = SessionLocal()
         try:
-            from services.pattern_analysis_service import PatternAnalysisService
-            pattern_service = PatternAnalysisService(db)
-            # Note: pattern_service có thể cần convert sang async
-            suggestions = await run_sync_in_thread(
-                pattern_service.get_response_suggestions,
+            return pattern_service.get_response_suggestions(
                 conversation.user_message,
-                use_patterns=True
+                use_patterns=True,
+                db=pattern_db
             )
-        except Exception as e:
-            logger.warning(f"Error in pattern analysis, continuing without suggestions: {e}")
-            suggestions = {}
-        
-        # Kết hợp semantic search results với pattern suggestions
-        if semantic_context:
-            suggestions["semantic_matches"] = semantic_context
-        
-        # Tìm best response từ semantic search
-        if semantic_service:
-            try:
-                best_response = await semantic_service.find_best_response(
-                    user_message=conversation.user_message,
-                    limit=1,
-                    min_similarity=0.7
-                )
-            except Exception as e:
-                logger.warning(f"Error finding best response, continuing: {e}")
-        
-        # Tạo enhanced system prompt
-        pattern_insights = {
-            "insights": suggestions.get("common_patterns", {}),
-            "recommended_approach": suggestions.get("recommended_approach")
-        }
-        
-        system_prompt = llm_service.get_system_prompt(
-            use_fine_tuned=False,
-            pattern_insights=pattern_insights if suggestions.get("recommended_approach") else None
+        finally:
+            pattern_db.close()
+    
+    if len(conversation.user_message.strip()) < MIN_SEMANTIC_LEN:
+        # Message quá ngắn: semantic search không đem lại gì, chỉ cần history
+        conversation_history = await fetch_history()
+        semantic_context, suggestions, best_response = [], {}, None
+    else:
+        # Embed user_message một lần, dùng chung cho semantic context và best response
+        embedding_task = asyncio.create_task(
+            semantic_service.embed_query(conversation.user_message)
         )
         
-        # Thêm semantic context vào prompt nếu có
-        if semantic_context and len(semantic_context) > 0:
-            context_text = "\n\nCác conversations tương tự đã có:\n"
-            for i, ctx in enumerate(semantic_context[:2], 1):
-                context_text += f"{i}. User: {ctx['user_message'][:100]}...\n"
-                context_text += f"   Assistant: {ctx['ai_response'][:150]}...\n"
-            system_prompt += context_text
+        # History, semantic search, pattern analysis và best response độc lập nhau -> chạy song song
+        # (CancelledError từ wait_for timeout là BaseException -> kiểm tra BaseException)
+        conversation_history, semantic_context, suggestions, best_response = await asyncio.gather(
+            fetch_history(),
+            asyncio.wait_for(fetch_semantic_context(), timeout=SEMANTIC_CONTEXT_TIMEOUT),
+            asyncio.wait_for(run_sync_in_thread(fetch_suggestions), timeout=PATTERN_SUGGESTIONS_TIMEOUT),
+            asyncio.wait_for(fetch_best_response(), timeout=BEST_RESPONSE_TIMEOUT),
+            return_exceptions=True
+        )
         
-        # Nếu có best response với high confidence, tham khảo
-        if best_response and best_response.get("confidence") == "high":
-            system_prompt += f"\n\nTham khảo response tốt (similarity: {best_response['similarity']:.2f}): {best_response['suggested_response'][:200]}"
+        if isinstance(conversation_history, BaseException):
+            raise conversation_history
+        if isinstance(semantic_context, BaseException):
+            logger.warning(f"Error in semantic search, continuing without context: {semantic_context!r}")
+            semantic_context = []
+        if isinstance(suggestions, BaseException):
+            logger.warning(f"Error in pattern analysis, continuing without suggestions: {suggestions!r}")
+            suggestions = {}
+        if isinstance(best_response, BaseException):
+            logger.warning(f"Error finding best response, continuing: {best_response!r}")
+            best_response = None
+    
+    # Kết hợp semantic search results với pattern suggestions
+    if semantic_context:
+        suggestions["semantic_matches"] = semantic_context
+    
+    # Tạo enhanced system prompt
+    pattern_insights = {
+        "insights": suggestions.get("common_patterns", {}),
+        "recommended_approach": suggestions.get("recommended_approach")
+    }
+    
+    system_prompt = llm_service.get_system_prompt(
+        use_fine_tuned=False,
+        pattern_insights=pattern_insights if suggestions.get("recommended_approach") else None
+    )
+    
+    prompt_parts = [system_prompt]
+    
+    # Thêm semantic context vào prompt nếu có
+    if semantic_context:
+        prompt_parts.append("\n\nCác conversations tương tự đã có:\n")
+        for i, ctx in enumerate(semantic_context[:2], 1):
+            prompt_parts.append(f"{i}. User: {ctx['user_message'][:100]}...\n")
+            prompt_parts.append(f"   Assistant: {ctx['ai_response'][:150]}...\n")
+    
+    # Nếu có best response với high confidence, tham khảo
+    if best_response and best_response.get("confidence") == "high":
+        prompt_parts.append(f"\n\nTham khảo response tốt (similarity: {best_response['similarity']:.2f}): {best_response['suggested_response'][:200]}")
+    
+    system_prompt = "".join(prompt_parts)
+    
+    return conversation_history, system_prompt
+
+
+@async_router.post("/conversations", response_model=ConversationResponse)
+@limiter_with_api_key.limit(STRICT_RATE_LIMIT)
+async def create_conversation_async(
+    request: Request,
+    conversation: ConversationCreate,
+    background_tasks: BackgroundTasks,
+    db: AsyncSession = Depends(get_async_db_tx, scope="function"),
+    api_key: str = Depends(verify_api_key),
+    semantic_service: SemanticSearchService = Depends(get_semantic_service),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
+):
+    """
+    Tạo conversation mới với AI response từ LLM (async version)
+    Sử dụng Celery cho background indexing
+    """
+    try:
+        conversation_history, system_prompt = await _prepare_conversation_context(
+            conversation, db, semantic_service, pattern_service
+        )
         
         # Generate AI response từ LLM (async)
         ai_response = await llm_service.generate_response(
@@ -263,11 +370,12 @@ async def create_conversation_async(
             session_id=conversation.session_id
         )
         db.add(db_conversation)
-        await db.commit()
-        await db.refresh(db_conversation)
+        # flush để lấy id (created_at đã có từ default), không cần refresh SELECT lại
+        await db.flush()
         
-        # Index conversation trong background qua Celery (không block response)
-        index_conversation_task.delay(
+        # Queue Celery indexing sau khi response đã gửi (broker RPC không nằm trên response path)
+        background_tasks.add_task(
+            _queue_indexing,
             conversation_id=db_conversation.id,
             user_message=conversation.user_message,
             ai_response=ai_response
@@ -277,7 +385,6 @@ async def create_conversation_async(
     except HTTPException:
         raise
     except Exception as e:
-        await db.rollback()
         raise handle_error(
             e,
             category=ErrorCategory.LLM,
@@ -288,24 +395,137 @@ async def create_conversation_async(
         )
 
 
+@async_router.post("/conversations/stream")
+@limiter_with_api_key.limit(STRICT_RATE_LIMIT)
+async def create_conversation_stream(
+    request: Request,
+    conversation: ConversationCreate,
+    # scope="function": session trả về pool ngay khi handler return, trước khi stream body
+    db: AsyncSession = Depends(get_async_db_ro, scope="function"),
+    api_key: str = Depends(verify_api_key),
+    semantic_service: SemanticSearchService = Depends(get_semantic_service),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
+):
+    """
+    Tạo conversation mới và stream AI response (Server-Sent Events)
+    Client nhận token đầu tiên ngay khi LLM trả về; conversation được lưu và
+    index sau khi stream kết thúc
+    """
+    try:
+        conversation_history, system_prompt = await _prepare_conversation_context(
+            conversation, db, semantic_service, pattern_service
+        )
+    except Exception as e:
+        raise handle_error(
+            e,
+            category=ErrorCategory.LLM,
+            severity=ErrorSeverity.ERROR,
+            context="create_conversation_stream",
+            user_message="Không thể tạo conversation. Vui lòng thử lại sau.",
+            status_code=500
+        )
+    
+    async def generate_sse():
+        """Stream chunks, sau đó lưu conversation và queue indexing"""
+        chunks = []
+        try:
+            async for chunk in llm_service.generate_stream(
+                user_message=conversation.user_message,
+                conversation_history=conversation_history if conversation_history else None,
+                system_prompt=system_prompt
+            ):
+                chunks.append(chunk)
+                yield f"data: {json.dumps({'content': chunk})}\n\n"
+            
+            ai_response = "".join(chunks)
+            
+            # Session của dependency đã đóng khi body được stream -> dùng session riêng
+            async with AsyncSessionLocal() as session:
+                db_conversation = AgentConversation(
+                    user_message=conversation.user_message,
+                    ai_response=ai_response,
+                    session_id=conversation.session_id
+                )
+                session.add(db_conversation)
+                await session.commit()
+                conversation_id = db_conversation.id
+            
+            yield f"data: {json.dumps({'done': True, 'conversation_id': conversation_id})}\n\n"
+            
+            # Queue indexing sau khi đã gửi done event
+            await run_sync_in_thread(
+                _queue_indexing,
+                conversation_id,
+                conversation.user_message,
+                ai_response
+            )
+        except Exception as e:
+            logger.error(f"Error streaming conversation: {e}")
+            yield f"data: {json.dumps({'error': 'Không thể tạo conversation. Vui lòng thử lại sau.'})}\n\n"
+    
+    return StreamingResponse(
+        generate_sse(),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"  # Disable buffering for nginx
+        }
+    )
+
+
 @async_router.get("/conversations", response_model=List[ConversationResponse])
 async def get_conversations_async(
     request: Request,
+    response: Response,
     session_id: Optional[str] = None,
     skip: int = 0,
     limit: int = 100,
-    db: AsyncSession = Depends(get_async_db),
+    cursor_created_at: Optional[datetime] = None,
+    cursor_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_db_ro),
     api_key = Depends(verify_api_key)
 ):
-    """Get conversations với async database operations"""
+    """
+    Get conversations với async database operations
+    
+    Keyset pagination: truyền cursor_created_at (+ cursor_id) lấy từ header
+    X-Next-Cursor-Created-At / X-Next-Cursor-Id của trang trước thay cho skip.
+    """
     try:
-        stmt = select(AgentConversation)
+        # Chỉ select các cột của ConversationResponse, trả về row mappings (không tạo ORM objects)
+        stmt = select(
+            AgentConversation.id,
+            AgentConversation.user_message,
+            AgentConversation.ai_response,
+            AgentConversation.session_id,
+            AgentConversation.created_at
+        )
         if session_id:
             stmt = stmt.where(AgentConversation.session_id == session_id)
-        stmt = stmt.order_by(AgentConversation.created_at.desc()).offset(skip).limit(limit)
+        if cursor_created_at is not None:
+            if cursor_id is not None:
+                stmt = stmt.where(
+                    tuple_(AgentConversation.created_at, AgentConversation.id)
+                    < tuple_(cursor_created_at, cursor_id)
+                )
+            else:
+                stmt = stmt.where(AgentConversation.created_at < cursor_created_at)
+        elif skip:
+            stmt = stmt.offset(skip)
+        # Lấy dư 1 row để biết còn trang tiếp theo không
+        stmt = stmt.order_by(
+            AgentConversation.created_at.desc(), AgentConversation.id.desc()
+        ).limit(limit + 1)
         
         result = await db.execute(stmt)
-        conversations = result.scalars().all()
+        conversations = result.mappings().all()
+        
+        if len(conversations) > limit:
+            conversations = conversations[:limit]
+            last = conversations[-1]
+            response.headers["X-Next-Cursor-Created-At"] = last["created_at"].isoformat()
+            response.headers["X-Next-Cursor-Id"] = str(last["id"])
         return conversations
     except Exception as e:
         raise handle_database_error(e, context="get_conversations_async")
\ No newline at end of file
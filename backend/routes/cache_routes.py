@@ -67,6 +67,7 @@ async def warm_cache(db: Session = Depends(get_db)) -> Dict[str, Any]:
 async def clear_cache(
     pattern: Optional[str] = None,
     cache_type: Optional[str] = None,
+    confirm: bool = False,
     db: Session = Depends(get_db)
 ) -> Dict[str, Any]:
     """
@@ -75,14 +76,21 @@ async def clear_cache(
     Args:
         pattern: Pattern to match keys (e.g., "embedding:*", "llm:*")
         cache_type: Type of cache to clear (embedding, llm, pattern_analysis)
+        confirm: Bắt buộc = true khi clear toàn bộ cache (không có pattern/cache_type)
     """
+    if cache_type:
+        # Clear by cache type
+        pattern = f"{cache_type}:*" if not pattern else pattern
+    
+    if (not pattern or pattern == "*") and not confirm:
+        raise HTTPException(
+            status_code=400,
+            detail="Clearing the whole cache requires confirm=true"
+        )
+    
     try:
         advanced_cache = get_advanced_cache_service(db_session=db)
         
-        if cache_type:
-            # Clear by cache type
-            pattern = f"{cache_type}:*" if not pattern else pattern
-        
         if pattern:
             count = advanced_cache.invalidate_pattern(pattern)
         else:
@@ -107,6 +115,7 @@ async def cache_health(db: Session = Depends(get_db)) -> Dict[str, Any]:
     """
     try:
         advanced_cache = get_advanced_cache_service(db_session=db)
+        # get_stats được memoize nên /health không query Redis lại ngay sau /stats
         stats = advanced_cache.get_stats()
         
         health = {
@@ -31,6 +31,9 @@ async def get_pool_stats(
         return {
             "pool_size": db_config.pool_size,
             "max_overflow": db_config.max_overflow,
+            "pool_recycle": db_config.pool_recycle,
+            "pool_pre_ping": db_config.pool_pre_ping,
+            "pool_use_lifo": db_config.pool_use_lifo,
             "current_stats": pool_stats,
             "read_replica_available": db_config.has_read_replica()
         }
@@ -44,18 +47,23 @@ async def explain_query(
     request: Request,
     query: str,
     params: Optional[Dict[str, Any]] = None,
+    analyze: bool = False,
     api_key = Depends(verify_api_key)
 ):
     """
-    Chạy EXPLAIN ANALYZE cho một query
+    Chạy EXPLAIN cho một query
+    
+    Mặc định chỉ trả về plan ước lượng, query không được thực thi.
+    Plan thực tế của query chậm: bật DB_AUTO_EXPLAIN để PostgreSQL tự log.
     
     Body:
         query: SQL query string
         params: Query parameters (optional)
+        analyze: Thực thi query (EXPLAIN ANALYZE, rollback sau đó)
     """
     try:
         optimizer = get_query_optimizer(app.engine)
-        result = optimizer.explain_analyze(query, params)
+        result = optimizer.explain_analyze(query, params, analyze=analyze)
         
         if "error" in result:
             raise HTTPException(status_code=400, detail=result["error"])
@@ -71,6 +79,7 @@ async def check_index_usage(
     request: Request,
     query: str,
     params: Optional[Dict[str, Any]] = None,
+    analyze: bool = False,
     api_key = Depends(verify_api_key)
 ):
     """
@@ -79,10 +88,11 @@ async def check_index_usage(
     Body:
         query: SQL query string
         params: Query parameters (optional)
+        analyze: Thực thi query (EXPLAIN ANALYZE, rollback sau đó)
     """
     try:
         optimizer = get_query_optimizer(app.engine)
-        result = optimizer.check_index_usage(query, params)
+        result = optimizer.check_index_usage(query, params, analyze=analyze)
         
         return result
     except Exception as e:
@@ -94,6 +104,7 @@ async def check_index_usage(
 async def get_slow_queries(
     request: Request,
     min_time: float = 100.0,
+    limit: int = 50,
     api_key = Depends(verify_api_key)
 ):
     """
@@ -101,10 +112,11 @@ async def get_slow_queries(
     
     Args:
         min_time: Minimum execution time in milliseconds (default: 100)
+        limit: Số queries tối đa (default: 50)
     """
     try:
         optimizer = get_query_optimizer(app.engine)
-        slow_queries = optimizer.analyze_slow_queries(min_execution_time=min_time)
+        slow_queries = optimizer.analyze_slow_queries(min_execution_time=min_time, limit=limit)
         
         return {
             "slow_queries": slow_queries,
@@ -179,14 +191,19 @@ async def database_health(
         cache_service = get_query_cache_service()
         cache_stats = cache_service.get_stats()
         
+        # Pool gần cạn -> báo "degraded" để monitoring cảnh báo trước khi request bị timeout
+        pool_saturated = pool_stats["utilization"] > db_config.pool_utilization_warn
+        
         return {
-            "status": "healthy",
+            "status": "degraded" if pool_saturated else "healthy",
             "database": "connected",
             "pool": {
                 "size": pool_stats["size"],
+                "max_overflow": db_config.max_overflow,
                 "checked_in": pool_stats["checked_in"],
                 "checked_out": pool_stats["checked_out"],
-                "overflow": pool_stats["overflow"]
+                "overflow": pool_stats["overflow"],
+                "utilization": pool_stats["utilization"]
             },
             "cache": {
                 "backend": cache_stats["backend"],
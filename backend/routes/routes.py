@@ -1,15 +1,22 @@
-from fastapi import APIRouter, HTTPException, Depends, Request, BackgroundTasks
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, BackgroundTasks, Query
 from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, tuple_, func
+from datetime import datetime
 from typing import Optional, List, Dict, Any
+import asyncio
 import logging
 import json
+import os
 
 # Import services
 from services.llm_service import llm_service
 from services.fine_tuning_service import FineTuningService
 from services.pattern_analysis_service import PatternAnalysisService
 from services.semantic_search_service import SemanticSearchService
+from services.celery_tasks import index_conversation_task
+from services.indexing_buffer import indexing_buffer
 
 # Import centralized error handler
 from services.error_handler import (
@@ -23,6 +30,12 @@ from middleware.auth import verify_api_key
 # Import rate limiting
 from middleware.rate_limit import limiter_with_api_key, STRICT_RATE_LIMIT, DEFAULT_RATE_LIMIT
 
+# Import async helpers
+from services.async_helpers import run_sync_in_thread
+
+# Service singletons (app.state)
+from dependencies import get_semantic_service, get_pattern_service, get_fine_tuning_service
+
 # Create router first
 router = APIRouter()
 
@@ -34,18 +47,24 @@ import app
 
 # Get references from app module
 get_db = app.get_db
+get_async_db_tx = app.get_async_db_tx
+get_async_read_db = app.get_async_read_db
+SessionLocal = app.SessionLocal
 TaskCreate = app.TaskCreate
 TaskResponse = app.TaskResponse
 ConversationCreate = app.ConversationCreate
 ConversationResponse = app.ConversationResponse
 
+# Số lượt hội thoại gần nhất đưa vào prompt
+HISTORY_WINDOW = int(os.getenv("CONVERSATION_HISTORY_WINDOW", "20"))
+
 # Task endpoints
 @router.post("/tasks", response_model=TaskResponse)
 @limiter_with_api_key.limit(DEFAULT_RATE_LIMIT)
 async def create_task(
     request: Request,
     task: TaskCreate, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db_tx, scope="function"),
     api_key = Depends(verify_api_key)
 ):
     try:
@@ -55,32 +74,50 @@ async def create_task(
             status="pending"
         )
         db.add(db_task)
-        db.commit()
-        db.refresh(db_task)
+        # Commit do get_async_db_tx thực hiện trước khi gửi response.
+        # flush = INSERT ... RETURNING id; created_at/updated_at là Python-side defaults -> không cần refresh SELECT lại
+        await db.flush()
         return db_task
     except Exception as e:
-        db.rollback()
         raise handle_database_error(e, context="create_task")
 
 @router.get("/tasks", response_model=List[TaskResponse])
 async def get_tasks(
     request: Request,
+    response: Response,
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db),
+    after_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_async_read_db),
     api_key = Depends(verify_api_key)
 ):
-    tasks = db.query(AgentTask).offset(skip).limit(limit).all()
+    """
+    Keyset pagination: truyền after_id lấy từ header X-Next-Cursor-Id
+    của trang trước thay cho skip.
+    """
+    stmt = select(AgentTask)
+    if after_id is not None:
+        stmt = stmt.where(AgentTask.id > after_id)
+    elif skip:
+        stmt = stmt.offset(skip)
+    # Lấy dư 1 row để biết còn trang tiếp theo không
+    stmt = stmt.order_by(AgentTask.id).limit(limit + 1)
+    result = await db.execute(stmt)
+    tasks = result.scalars().all()
+    
+    if len(tasks) > limit:
+        tasks = tasks[:limit]
+        response.headers["X-Next-Cursor-Id"] = str(tasks[-1].id)
     return tasks
 
 @router.get("/tasks/{task_id}", response_model=TaskResponse)
 async def get_task(
     request: Request,
     task_id: int, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_read_db),
     api_key = Depends(verify_api_key)
 ):
-    task = db.query(AgentTask).filter(AgentTask.id == task_id).first()
+    task = await db.get(AgentTask, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     return task
@@ -91,51 +128,46 @@ async def update_task(
     task_id: int, 
     status: str, 
     result: Optional[str] = None, 
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db_tx, scope="function"),
     api_key = Depends(verify_api_key)
 ):
-    from datetime import datetime
-    task = db.query(AgentTask).filter(AgentTask.id == task_id).first()
+    task = await db.get(AgentTask, task_id)
     if task is None:
         raise HTTPException(status_code=404, detail="Task not found")
     task.status = status
     if result:
         task.result = result
     task.updated_at = datetime.utcnow()
-    db.commit()
-    db.refresh(task)
+    # updated_at đã set ở trên -> flush UPDATE là đủ, không cần refresh SELECT lại
+    await db.flush()
     return task
 
 # Helper function để index conversation trong background
 async def index_conversation_background(
     conversation_id: int,
     user_message: str,
-    ai_response: str
+    ai_response: str,
+    semantic_service: Optional[SemanticSearchService] = None
 ):
     """
     Background task để index conversation (tạo embeddings)
     Chạy sau khi response đã được trả về cho client
     """
+    semantic_service = semantic_service or SemanticSearchService()
     try:
         # Tạo database session mới cho background task
-        import sys
-        import os
-        # Add parent directory to path để import app
-        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        if parent_dir not in sys.path:
-            sys.path.insert(0, parent_dir)
-        from app import SessionLocal  # SessionLocal is still in app.py
         db = SessionLocal()
         try:
-            from services.semantic_search_service import SemanticSearchService
-            semantic_service = SemanticSearchService(db)
             indexing_result = await semantic_service.index_conversation(
                 conversation_id=conversation_id,
                 user_message=user_message,
-                ai_response=ai_response
+                ai_response=ai_response,
+                db=db
             )
             if not indexing_result.get("success"):
                 logging.warning(f"Failed to index conversation {conversation_id}: {indexing_result.get('error')}")
+            # Tính sẵn best response cho user_message để request sau chỉ cần một cache GET
+            await semantic_service.precompute_best_response(user_message, db=db)
         finally:
             db.close()
     except Exception as e:
@@ -148,73 +180,122 @@ async def create_conversation(
     request: Request,
     conversation: ConversationCreate,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: AsyncSession = Depends(get_async_db_tx, scope="function"),
+    api_key: str = Depends(verify_api_key),
+    semantic_service: SemanticSearchService = Depends(get_semantic_service),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
 ):
     """
     Tạo conversation mới với AI response từ LLM (llama3.1)
     """
-    try:
-        # Lấy conversation history nếu có session_id
-        conversation_history = []
-        if conversation.session_id:
-            previous_convs = db.query(AgentConversation).filter(
+    async def fetch_history() -> List[dict]:
+        """Lấy conversation history nếu có session_id"""
+        history = []
+        if not conversation.session_id:
+            return history
+        # Chỉ lấy HISTORY_WINDOW lượt gần nhất, chỉ 2 cột cần cho prompt
+        result = await db.execute(
+            select(
+                AgentConversation.user_message,
+                AgentConversation.ai_response
+            ).where(
                 AgentConversation.session_id == conversation.session_id
-            ).order_by(AgentConversation.created_at).all()
-            
-            for conv in previous_convs:
-                conversation_history.append({
-                    "role": "user",
-                    "content": conv.user_message
-                })
-                if conv.ai_response:
-                    conversation_history.append({
-                        "role": "assistant",
-                        "content": conv.ai_response
-                    })
-        
-        # Semantic search để tìm similar conversations
-        semantic_context = []
-        best_response = None
-        suggestions = {}
-        semantic_service = None
+            ).order_by(AgentConversation.created_at.desc()).limit(HISTORY_WINDOW)
+        )
         
+        for user_message, ai_response in reversed(result.all()):
+            history.append({
+                "role": "user",
+                "content": user_message
+            })
+            if ai_response:
+                history.append({
+                    "role": "assistant",
+                    "content": ai_response
+                })
+        return history
+    
+    # Semantic/pattern services dùng sync Session riêng cho mỗi nhánh vì chạy song song
+    async def fetch_semantic_context():
+        # shield: timeout của một nhánh không được cancel embedding dùng chung
+        query_embedding = await asyncio.shield(embedding_task)
+        search_db = SessionLocal()
         try:
-            semantic_service = SemanticSearchService(db)
-            semantic_context = await semantic_service.get_semantic_context(
+            return await semantic_service.get_semantic_context(
                 user_message=conversation.user_message,
-                context_limit=3
+                context_limit=3,
+                query_embedding=query_embedding,
+                db=search_db
             )
-        except Exception as e:
-            logging.warning(f"Error in semantic search, continuing without context: {e}")
-        
-        # Phân tích patterns và tìm suggestions
+        finally:
+            search_db.close()
+    
+    async def fetch_best_response():
+        search_db = SessionLocal()
         try:
-            pattern_service = PatternAnalysisService(db)
-            suggestions = pattern_service.get_response_suggestions(
+            # Fast path: best response đã tính sẵn bởi background indexer
+            precomputed = await run_sync_in_thread(
+                semantic_service.get_precomputed_best_response,
                 conversation.user_message,
-                use_patterns=True
+                db=search_db
             )
-        except Exception as e:
-            logging.warning(f"Error in pattern analysis, continuing without suggestions: {e}")
+            if precomputed:
+                return precomputed
+            # shield: timeout của một nhánh không được cancel embedding dùng chung
+            query_embedding = await asyncio.shield(embedding_task)
+            return await semantic_service.find_best_response(
+                user_message=conversation.user_message,
+                limit=1,
+                min_similarity=0.7,
+                query_embedding=query_embedding,
+                db=search_db
+            )
+        finally:
+            search_db.close()
+    
+    def fetch_suggestions():
+        pattern_db = SessionLocal()
+        try:
+            return pattern_service.get_response_suggestions(
+                conversation.user_message,
+                use_patterns=True,
+                db=pattern_db
+            )
+        finally:
+            pattern_db.close()
+    
+    try:
+        # Embed user_message một lần, dùng chung cho semantic context và best response
+        embedding_task = asyncio.create_task(
+            semantic_service.embed_query(conversation.user_message)
+        )
+        
+        # History, semantic search, pattern analysis và best response độc lập nhau -> chạy song song
+        conversation_history, semantic_context, suggestions, best_response = await asyncio.gather(
+            fetch_history(),
+            fetch_semantic_context(),
+            run_sync_in_thread(fetch_suggestions),
+            fetch_best_response(),
+            return_exceptions=True
+        )
+        
+        if isinstance(conversation_history, BaseException):
+            raise conversation_history
+        if isinstance(semantic_context, BaseException):
+            logging.warning(f"Error in semantic search, continuing without context: {semantic_context}")
+            semantic_context = []
+        if isinstance(suggestions, BaseException):
+            logging.warning(f"Error in pattern analysis, continuing without suggestions: {suggestions}")
             suggestions = {}
+        if isinstance(best_response, BaseException):
+            logging.warning(f"Error finding best response, continuing: {best_response}")
+            best_response = None
         
         # Kết hợp semantic search results với pattern suggestions
         if semantic_context:
             # Thêm semantic results vào suggestions
             suggestions["semantic_matches"] = semantic_context
         
-        # Tìm best response từ semantic search
-        if semantic_service:
-            try:
-                best_response = await semantic_service.find_best_response(
-                    user_message=conversation.user_message,
-                    limit=1,
-                    min_similarity=0.7
-                )
-            except Exception as e:
-                logging.warning(f"Error finding best response, continuing: {e}")
-        
         # Tạo enhanced system prompt với pattern insights và semantic context
         pattern_insights = {
             "insights": suggestions.get("common_patterns", {}),
@@ -226,17 +307,20 @@ async def create_conversation(
             pattern_insights=pattern_insights if suggestions.get("recommended_approach") else None
         )
         
+        prompt_parts = [system_prompt]
+        
         # Thêm semantic context vào prompt nếu có
-        if semantic_context and len(semantic_context) > 0:
-            context_text = "\n\nCác conversations tương tự đã có:\n"
+        if semantic_context:
+            prompt_parts.append("\n\nCác conversations tương tự đã có:\n")
             for i, ctx in enumerate(semantic_context[:2], 1):  # Top 2
-                context_text += f"{i}. User: {ctx['user_message'][:100]}...\n"
-                context_text += f"   Assistant: {ctx['ai_response'][:150]}...\n"
-            system_prompt += context_text
+                prompt_parts.append(f"{i}. User: {ctx['user_message'][:100]}...\n")
+                prompt_parts.append(f"   Assistant: {ctx['ai_response'][:150]}...\n")
         
         # Nếu có best response với high confidence, tham khảo
         if best_response and best_response.get("confidence") == "high":
-            system_prompt += f"\n\nTham khảo response tốt (similarity: {best_response['similarity']:.2f}): {best_response['suggested_response'][:200]}"
+            prompt_parts.append(f"\n\nTham khảo response tốt (similarity: {best_response['similarity']:.2f}): {best_response['suggested_response'][:200]}")
+        
+        system_prompt = "".join(prompt_parts)
         
         # Generate AI response từ LLM
         ai_response = await llm_service.generate_response(
@@ -252,35 +336,46 @@ async def create_conversation(
             session_id=conversation.session_id
         )
         db.add(db_conversation)
-        db.commit()
-        db.refresh(db_conversation)
+        # flush để lấy id (created_at đã có từ default), không cần refresh SELECT lại
+        await db.flush()
+        conversation_response = ConversationResponse(
+            id=db_conversation.id,
+            user_message=db_conversation.user_message,
+            ai_response=db_conversation.ai_response,
+            session_id=db_conversation.session_id,
+            created_at=db_conversation.created_at
+        )
+        # Commit trước khi queue indexing để worker thấy conversation
+        await db.commit()
         
         # Index conversation trong background qua Celery (không block response)
         # Celery task sẽ chạy trong worker process riêng
         try:
-            from services.celery_tasks import index_conversation_task
             index_conversation_task.delay(
-                conversation_id=db_conversation.id,
+                conversation_id=conversation_response.id,
                 user_message=conversation.user_message,
                 ai_response=ai_response
             )
         except Exception as e:
-            # Fallback to FastAPI BackgroundTasks nếu Celery không available
-            logging.warning(f"Celery not available, using BackgroundTasks: {e}")
-            background_tasks.add_task(
-                index_conversation_background,
-                conversation_id=db_conversation.id,
-                user_message=conversation.user_message,
-                ai_response=ai_response
-            )
+            # Fallback: indexing buffer (ghi embeddings theo batch), cuối cùng mới tới BackgroundTasks
+            logging.warning(f"Celery not available, indexing in-process: {e}")
+            if not indexing_buffer.enqueue(
+                conversation_response.id, conversation.user_message, ai_response
+            ):
+                background_tasks.add_task(
+                    index_conversation_background,
+                    conversation_id=conversation_response.id,
+                    user_message=conversation.user_message,
+                    ai_response=ai_response,
+                    semantic_service=semantic_service
+                )
         
-        return db_conversation
+        return conversation_response
     except HTTPException:
         # Re-raise HTTPException as-is
         raise
     except Exception as e:
-        # Rollback transaction nếu có lỗi
-        db.rollback()
+        # Rollback do get_async_db_tx thực hiện khi exception lan ra
         # Use centralized error handler
         raise handle_error(
             e,
@@ -294,16 +389,60 @@ async def create_conversation(
 @router.get("/conversations", response_model=List[ConversationResponse])
 async def get_conversations(
     request: Request,
+    response: Response,
     session_id: Optional[str] = None, 
     skip: int = 0, 
     limit: int = 100, 
-    db: Session = Depends(get_db),
+    cursor_created_at: Optional[datetime] = None,
+    cursor_id: Optional[int] = None,
+    preview_length: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_read_db),
     api_key = Depends(verify_api_key)
 ):
-    query = db.query(AgentConversation)
+    """
+    Keyset pagination: truyền cursor_created_at (+ cursor_id) lấy từ header
+    X-Next-Cursor-Created-At / X-Next-Cursor-Id của trang trước thay cho skip.
+    
+    preview_length: cắt user_message/ai_response phía PostgreSQL (cho list view)
+    """
+    user_message_col = AgentConversation.user_message
+    ai_response_col = AgentConversation.ai_response
+    if preview_length:
+        user_message_col = func.left(user_message_col, preview_length)
+        ai_response_col = func.left(ai_response_col, preview_length)
+    
+    # Chỉ select các cột của ConversationResponse, trả về row mappings (không tạo ORM objects)
+    stmt = select(
+        AgentConversation.id,
+        user_message_col.label("user_message"),
+        ai_response_col.label("ai_response"),
+        AgentConversation.session_id,
+        AgentConversation.created_at
+    )
     if session_id:
-        query = query.filter(AgentConversation.session_id == session_id)
-    conversations = query.order_by(AgentConversation.created_at.desc()).offset(skip).limit(limit).all()
+        stmt = stmt.where(AgentConversation.session_id == session_id)
+    if cursor_created_at is not None:
+        if cursor_id is not None:
+            stmt = stmt.where(
+                tuple_(AgentConversation.created_at, AgentConversation.id)
+                < tuple_(cursor_created_at, cursor_id)
+            )
+        else:
+            stmt = stmt.where(AgentConversation.created_at < cursor_created_at)
+    elif skip:
+        stmt = stmt.offset(skip)
+    # Lấy dư 1 row để biết còn trang tiếp theo không
+    stmt = stmt.order_by(
+        AgentConversation.created_at.desc(), AgentConversation.id.desc()
+    ).limit(limit + 1)
+    result = await db.execute(stmt)
+    conversations = result.mappings().all()
+    
+    if len(conversations) > limit:
+        conversations = conversations[:limit]
+        last = conversations[-1]
+        response.headers["X-Next-Cursor-Created-At"] = last["created_at"].isoformat()
+        response.headers["X-Next-Cursor-Id"] = str(last["id"])
     return conversations
 
 # LLM Management endpoints
@@ -373,19 +512,20 @@ async def stream_llm_response(
     )
 
 # Fine-tuning endpoints
+# Chỉ gọi sync DB -> `def` để FastAPI chạy trong threadpool
 @router.get("/api/finetune/stats")
-async def get_finetune_stats(
+def get_finetune_stats(
     request: Request,
     db: Session = Depends(get_db),
-    api_key = Depends(verify_api_key)
+    api_key = Depends(verify_api_key),
+    ft_service: FineTuningService = Depends(get_fine_tuning_service)
 ):
     """Lấy thống kê về dữ liệu training"""
-    ft_service = FineTuningService(db)
-    return ft_service.get_training_stats()
+    return ft_service.get_training_stats(db=db)
 
 @router.post("/api/finetune/export")
 @limiter_with_api_key.limit(STRICT_RATE_LIMIT)
-async def export_training_data(
+def export_training_data(
     request: Request,
     session_id: Optional[str] = None,
     format: str = "jsonl",
@@ -393,8 +533,10 @@ async def export_training_data(
     use_feedback: bool = True,
     min_rating: int = 3,
     include_corrections: bool = True,
+    stream: bool = False,
     db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    ft_service: FineTuningService = Depends(get_fine_tuning_service)
 ):
     """
     Export conversations để tạo training data cho fine-tuning
@@ -406,8 +548,39 @@ async def export_training_data(
         use_feedback: Có sử dụng feedback để cải thiện training data không
         min_rating: Rating tối thiểu để include (nếu dùng feedback)
         include_corrections: Có include user corrections không
+        stream: Stream trực tiếp JSONL (format jsonl/ollama) thay vì ghi file
     """
-    ft_service = FineTuningService(db)
+    # Stream JSONL từ server-side cursor: memory không đổi, không ghi file
+    if stream and format in ("jsonl", "ollama"):
+        filters = {
+            "use_feedback": use_feedback,
+            "min_rating": min_rating,
+            "include_corrections": include_corrections
+        }
+        count = ft_service.count_exportable_conversations(session_id, db=db, **filters)
+        if count < min_conversations:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Cần ít nhất {min_conversations} conversations, hiện có {count}"
+            )
+        
+        def generate():
+            # Session riêng cho toàn bộ thời gian stream body
+            stream_db = SessionLocal()
+            try:
+                yield from ft_service.iter_export_jsonl(session_id, format, db=stream_db, **filters)
+            finally:
+                stream_db.close()
+        
+        filename = f"{'ollama_finetune' if format == 'ollama' else 'training_data'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl"
+        return StreamingResponse(
+            generate(),
+            media_type="application/x-ndjson",
+            headers={
+                "X-Export-Count": str(count),
+                "Content-Disposition": f'attachment; filename="{filename}"'
+            }
+        )
     
     # Ưu tiên sử dụng feedback nếu có
     if use_feedback:
@@ -433,9 +606,9 @@ async def export_training_data(
     # Fallback to normal export
     if not use_feedback:
         if format == "ollama":
-            result = ft_service.create_ollama_finetune_data(session_id, min_conversations)
+            result = ft_service.create_ollama_finetune_data(session_id, min_conversations, db=db)
         else:
-            result = ft_service.export_conversations_for_training(session_id, min_conversations, format)
+            result = ft_service.export_conversations_for_training(session_id, min_conversations, format, db=db)
     
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("message") or result.get("error"))
@@ -443,13 +616,12 @@ async def export_training_data(
     return result
 
 @router.get("/api/finetune/instructions")
-async def get_finetune_instructions(
+def get_finetune_instructions(
     request: Request,
-    db: Session = Depends(get_db),
-    api_key = Depends(verify_api_key)
+    api_key = Depends(verify_api_key),
+    ft_service: FineTuningService = Depends(get_fine_tuning_service)
 ):
     """Lấy hướng dẫn fine-tuning"""
-    ft_service = FineTuningService(db)
     return {
         "instructions": ft_service.prepare_finetune_instructions()
     }
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, HTTPException, Depends, Request
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from typing import Optional, List, Dict
+from typing import Optional, List, Dict, Any, Callable
+import asyncio
 import logging
+import os
+import time
 
 # Import services
 from services.feedback_service import FeedbackService
 from services.pattern_analysis_service import PatternAnalysisService
 from services.semantic_search_service import SemanticSearchService
+from services.query_cache_service import get_query_cache_service
 
 # Import authentication
 from middleware.auth import verify_api_key
@@ -28,18 +33,94 @@ import app
 from dependencies import (
     get_feedback_repository,
     get_conversation_repository,
-    get_feedback_service
+    get_feedback_service,
+    get_semantic_service,
+    get_pattern_service
 )
 
 # Get references from app module
 get_db = app.get_db
+get_read_db = app.get_read_db
+SessionLocal = app.SessionLocal
 FeedbackCreate = app.FeedbackCreate
 FeedbackStats = app.FeedbackStats
 
+# Re-index: số conversations mỗi chunk (một batch embedding + một INSERT) và số chunks chạy song song
+REINDEX_CHUNK_SIZE = int(os.getenv("REINDEX_CHUNK_SIZE", "256"))
+REINDEX_CONCURRENCY = int(os.getenv("REINDEX_CONCURRENCY", "4"))
+
+# Response cache cho các pattern analysis endpoints (aggregate trên toàn bộ conversations)
+PATTERNS_CACHE_NAMESPACE = "patterns"
+PATTERN_INSIGHTS_CACHE_TTL = int(os.getenv("PATTERN_INSIGHTS_CACHE_TTL", "60"))
+PATTERN_TOPICS_CACHE_TTL = int(os.getenv("PATTERN_TOPICS_CACHE_TTL", "300"))
+PATTERN_INTENTS_CACHE_TTL = int(os.getenv("PATTERN_INTENTS_CACHE_TTL", "300"))
+
+# ETag cho analytics endpoints: cache max(id) vài giây để poll liên tục không query DB mỗi lần
+ANALYTICS_ETAG_TTL = float(os.getenv("ANALYTICS_ETAG_TTL", "5"))
+_etag_cache: Dict[str, Any] = {"tag": None, "expires": 0.0}
+
+
+def _cached_pattern_response(
+    response: Response,
+    endpoint: str,
+    ttl: int,
+    compute: Callable[[], Any],
+    **params: Any
+) -> Any:
+    """
+    Read-through cache (Redis, fallback in-memory) cho pattern analysis endpoints
+    Set header X-Cache: HIT/MISS; hits/misses hiển thị ở /api/db/cache/stats
+    """
+    cache_service = get_query_cache_service()
+    cached = cache_service.get(endpoint, params, namespace=PATTERNS_CACHE_NAMESPACE)
+    if cached is not None:
+        response.headers["X-Cache"] = "HIT"
+        return cached
+    
+    # jsonable_encoder để response HIT và MISS giống nhau (datetime -> ISO string)
+    result = jsonable_encoder(compute())
+    cache_service.set(endpoint, result, ttl=ttl, params=params, namespace=PATTERNS_CACHE_NAMESPACE)
+    response.headers["X-Cache"] = "MISS"
+    return result
+
+def etag_from_counters(
+    request: Request,
+    response: Response,
+    db: Session = Depends(get_read_db)
+) -> str:
+    """
+    Weak ETag từ max(id) của conversations và max(id)/count/max(updated_at) của feedback
+    (upsert_feedback sửa rating tại chỗ -> max(id) không đổi, updated_at thì có)
+    Trả 304 Not Modified nếu If-None-Match khớp (không chạy SQL của endpoint)
+    """
+    now = time.monotonic()
+    if _etag_cache["tag"] is None or now >= _etag_cache["expires"]:
+        row = db.execute(text("""
+            SELECT
+                (SELECT COALESCE(MAX(id), 0) FROM agent_conversations),
+                COALESCE(MAX(id), 0), COUNT(*), MAX(updated_at)
+            FROM conversation_feedback
+        """)).one()
+        updated_at = row[3].timestamp() if hasattr(row[3], "timestamp") else (row[3] or 0)
+        _etag_cache["tag"] = f'W/"{row[0]}-{row[1]}-{row[2]}-{updated_at}"'
+        _etag_cache["expires"] = now + ANALYTICS_ETAG_TTL
+    tag = _etag_cache["tag"]
+    
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        client_tags = [t.strip() for t in if_none_match.split(",")]
+        if "*" in client_tags or tag in client_tags:
+            raise HTTPException(status_code=304, headers={"ETag": tag})
+    
+    response.headers["ETag"] = tag
+    return tag
+
 # Feedback endpoints
+# Handlers chỉ gọi sync DB (psycopg2) khai báo bằng `def` để FastAPI chạy trong threadpool,
+# không block event loop
 @router.post("/api/feedback", response_model=Dict)
 @limiter_with_api_key.limit(DEFAULT_RATE_LIMIT)
-async def submit_feedback(
+def submit_feedback(
     request: Request,
     feedback: FeedbackCreate,
     db: Session = Depends(get_db),
@@ -70,13 +151,18 @@ async def submit_feedback(
     if not result.get("success"):
         raise HTTPException(status_code=400, detail=result.get("error"))
     
+    # Feedback mới thay đổi kết quả pattern analysis -> xóa cached aggregates
+    get_query_cache_service().invalidate(f"{PATTERNS_CACHE_NAMESPACE}:")
+    _etag_cache["expires"] = 0.0
+    
     return result
 
 @router.get("/api/feedback/stats", response_model=FeedbackStats)
-async def get_feedback_stats(
+def get_feedback_stats(
     conversation_id: Optional[int] = None,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    etag: str = Depends(etag_from_counters)
 ):
     """Lấy thống kê feedback"""
     # Use dependency injection for FeedbackService
@@ -87,10 +173,10 @@ async def get_feedback_stats(
     return FeedbackStats(**stats)
 
 @router.get("/api/feedback/conversations")
-async def get_conversations_with_feedback(
+def get_conversations_with_feedback(
     rating_threshold: Optional[int] = None,
     limit: int = 100,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(verify_api_key)
 ):
     """Lấy conversations kèm feedback để review"""
@@ -105,10 +191,10 @@ async def get_conversations_with_feedback(
     return conversations
 
 @router.get("/api/feedback/training-data")
-async def get_feedback_for_training(
+def get_feedback_for_training(
     min_rating: int = 3,
     include_corrections: bool = True,
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
     api_key: str = Depends(verify_api_key)
 ):
     """Lấy feedback để sử dụng trong training/fine-tuning"""
@@ -127,90 +213,112 @@ async def get_feedback_for_training(
 
 # Pattern Analysis endpoints
 @router.get("/api/patterns/insights")
-async def get_pattern_insights(
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+def get_pattern_insights(
+    response: Response,
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    etag: str = Depends(etag_from_counters),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
 ):
     """Lấy tổng hợp insights từ pattern analysis"""
-    pattern_service = PatternAnalysisService(db)
-    return pattern_service.get_pattern_insights()
+    return _cached_pattern_response(
+        response, "insights", PATTERN_INSIGHTS_CACHE_TTL,
+        lambda: pattern_service.get_pattern_insights(db=db)
+    )
 
 @router.get("/api/patterns/common-questions")
-async def get_common_questions(
+def get_common_questions(
     min_frequency: int = 2,
     limit: int = 20,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    etag: str = Depends(etag_from_counters),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
 ):
     """Lấy danh sách câu hỏi thường gặp"""
-    pattern_service = PatternAnalysisService(db)
     return pattern_service.analyze_common_questions(
         min_frequency=min_frequency,
-        limit=limit
+        limit=limit,
+        db=db
     )
 
 @router.get("/api/patterns/topics")
-async def get_topics(
+def get_topics(
+    response: Response,
     min_occurrences: int = 3,
     limit: int = 15,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    etag: str = Depends(etag_from_counters),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
 ):
     """Lấy danh sách topics phổ biến"""
-    pattern_service = PatternAnalysisService(db)
-    return pattern_service.analyze_topics(
+    return _cached_pattern_response(
+        response, "topics", PATTERN_TOPICS_CACHE_TTL,
+        lambda: pattern_service.analyze_topics(
+            min_occurrences=min_occurrences,
+            limit=limit,
+            db=db
+        ),
         min_occurrences=min_occurrences,
         limit=limit
     )
 
 @router.get("/api/patterns/intents")
-async def get_user_intents(
+def get_user_intents(
+    response: Response,
     limit: int = 10,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
 ):
     """Lấy phân tích user intents"""
-    pattern_service = PatternAnalysisService(db)
-    return pattern_service.analyze_user_intents(limit=limit)
+    return _cached_pattern_response(
+        response, "intents", PATTERN_INTENTS_CACHE_TTL,
+        lambda: pattern_service.analyze_user_intents(limit=limit, db=db),
+        limit=limit
+    )
 
 @router.get("/api/patterns/response-patterns")
-async def get_response_patterns(
+def get_response_patterns(
     min_rating: int = 4,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
 ):
     """Lấy phân tích response patterns tốt/xấu"""
-    pattern_service = PatternAnalysisService(db)
-    return pattern_service.analyze_response_patterns(min_rating=min_rating)
+    return pattern_service.analyze_response_patterns(min_rating=min_rating, db=db)
 
 @router.get("/api/patterns/similar")
-async def find_similar_conversations(
+def find_similar_conversations(
     user_message: str,
     limit: int = 5,
     min_rating: Optional[int] = None,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
 ):
     """Tìm conversations tương tự"""
-    pattern_service = PatternAnalysisService(db)
     return pattern_service.find_similar_conversations(
         user_message=user_message,
         limit=limit,
-        min_rating=min_rating
+        min_rating=min_rating,
+        db=db
     )
 
 @router.get("/api/patterns/suggestions")
-async def get_response_suggestions(
+def get_response_suggestions(
     user_message: str,
     use_patterns: bool = True,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    pattern_service: PatternAnalysisService = Depends(get_pattern_service)
 ):
     """Lấy suggestions cho response dựa trên patterns"""
-    pattern_service = PatternAnalysisService(db)
     return pattern_service.get_response_suggestions(
         user_message=user_message,
-        use_patterns=use_patterns
+        use_patterns=use_patterns,
+        db=db
     )
 
 # Semantic Search endpoints
@@ -220,8 +328,9 @@ async def semantic_search(
     limit: int = 5,
     min_similarity: float = 0.5,
     filter_by_rating: Optional[int] = None,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    semantic_service: SemanticSearchService = Depends(get_semantic_service)
 ):
     """
     Tìm kiếm ngữ nghĩa conversations tương tự
@@ -232,12 +341,12 @@ async def semantic_search(
         min_similarity: Độ tương tự tối thiểu (0-1)
         filter_by_rating: Filter theo rating tối thiểu
     """
-    semantic_service = SemanticSearchService(db)
     results = await semantic_service.search_similar_conversations(
         query_text=query,
         limit=limit,
         min_similarity=min_similarity,
-        filter_by_rating=filter_by_rating
+        filter_by_rating=filter_by_rating,
+        db=db
     )
     return {
         "query": query,
@@ -249,14 +358,15 @@ async def semantic_search(
 async def get_best_response(
     user_message: str,
     min_similarity: float = 0.6,
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    semantic_service: SemanticSearchService = Depends(get_semantic_service)
 ):
     """Tìm best response cho user message"""
-    semantic_service = SemanticSearchService(db)
     result = await semantic_service.find_best_response(
         user_message=user_message,
-        min_similarity=min_similarity
+        min_similarity=min_similarity,
+        db=db
     )
     return result if result else {"message": "No similar high-rated conversation found"}
 
@@ -264,7 +374,8 @@ async def get_best_response(
 async def index_conversation(
     conversation_id: int,
     db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    semantic_service: SemanticSearchService = Depends(get_semantic_service)
 ):
     """Index conversation (tạo embeddings)"""
     # Lấy conversation
@@ -275,11 +386,11 @@ async def index_conversation(
     if not conv:
         raise HTTPException(status_code=404, detail="Conversation not found")
     
-    semantic_service = SemanticSearchService(db)
     result = await semantic_service.index_conversation(
         conversation_id=conversation_id,
         user_message=conv.user_message,
-        ai_response=conv.ai_response
+        ai_response=conv.ai_response,
+        db=db
     )
     
     if not result.get("success"):
@@ -288,13 +399,13 @@ async def index_conversation(
     return result
 
 @router.get("/api/semantic/indexing-stats")
-async def get_indexing_stats(
-    db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+def get_indexing_stats(
+    db: Session = Depends(get_read_db),
+    api_key: str = Depends(verify_api_key),
+    semantic_service: SemanticSearchService = Depends(get_semantic_service)
 ):
     """Lấy thống kê về indexing"""
-    semantic_service = SemanticSearchService(db)
-    return semantic_service.get_indexing_stats()
+    return semantic_service.get_indexing_stats(db=db)
 
 @router.post("/api/semantic/reindex-all")
 @limiter_with_api_key.limit(STRICT_RATE_LIMIT)
@@ -302,46 +413,54 @@ async def reindex_all_conversations(
     request: Request,
     limit: Optional[int] = None,
     db: Session = Depends(get_db),
-    api_key: str = Depends(verify_api_key)
+    api_key: str = Depends(verify_api_key),
+    semantic_service: SemanticSearchService = Depends(get_semantic_service)
 ):
     """Re-index tất cả conversations (background task)"""
     # Lấy conversations chưa có embeddings
+    # SQL text cố định, LIMIT là bound param (NULL = không giới hạn) -> một entry pg_stat_statements/plan
     query = """
         SELECT ac.id, ac.user_message, ac.ai_response
         FROM agent_conversations ac
         LEFT JOIN conversation_embeddings ce ON ac.id = ce.conversation_id
         WHERE ce.id IS NULL
         ORDER BY ac.created_at DESC
+        LIMIT :limit
     """
+    params = {"limit": limit or None}
+    
+    semaphore = asyncio.Semaphore(REINDEX_CONCURRENCY)
     
-    if limit:
-        query += f" LIMIT {limit}"
+    async def index_chunk(chunk) -> Dict:
+        # Session riêng cho INSERT/commit: commit trên session đang stream sẽ đóng server-side cursor
+        write_db = SessionLocal()
+        try:
+            return await semantic_service.index_conversations_bulk(chunk, db=write_db)
+        finally:
+            write_db.close()
+            semaphore.release()
     
-    conversations = db.execute(text(query)).fetchall()
+    # Server-side cursor: đọc từng chunk thay vì fetchall() toàn bộ
+    result = db.execute(
+        text(query).execution_options(stream_results=True, yield_per=REINDEX_CHUNK_SIZE),
+        params
+    )
     
-    semantic_service = SemanticSearchService(db)
-    indexed = 0
-    errors = 0
+    total_processed = 0
+    tasks = []
+    for partition in result.partitions(REINDEX_CHUNK_SIZE):
+        chunk = [(conv_id, user_msg, ai_resp) for conv_id, user_msg, ai_resp in partition]
+        total_processed += len(chunk)
+        # Tối đa REINDEX_CONCURRENCY chunks đang embed/insert cùng lúc
+        await semaphore.acquire()
+        tasks.append(asyncio.create_task(index_chunk(chunk)))
     
-    for conv_id, user_msg, ai_resp in conversations:
-        try:
-            result = await semantic_service.index_conversation(
-                conversation_id=conv_id,
-                user_message=user_msg,
-                ai_response=ai_resp
-            )
-            if result.get("success"):
-                indexed += 1
-            else:
-                errors += 1
-        except Exception as e:
-            logging.error(f"Error indexing conversation {conv_id}: {e}")
-            errors += 1
+    results = await asyncio.gather(*tasks)
     
     return {
-        "total_processed": len(conversations),
-        "indexed": indexed,
-        "errors": errors
+        "total_processed": total_processed,
+        "indexed": sum(r["indexed"] for r in results),
+        "errors": sum(r["errors"] for r in results)
     }
 
 @router.get("/api/embedding/status")
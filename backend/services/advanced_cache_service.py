@@ -12,14 +12,14 @@ Tính năng:
 - Comprehensive cache metrics và monitoring
 """
 import os
-import json
-import hashlib
 import logging
+import queue
+import socket
 import time
 import threading
-from typing import Optional, Any, Dict, List
+from collections import OrderedDict
+from typing import Optional, Any, Callable, Dict, List
 from datetime import datetime, timedelta
-from collections import defaultdict
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -37,22 +37,12 @@ except ImportError:
 # Redis configuration
 REDIS_ENABLED = os.getenv("REDIS_ENABLED", "false").lower() == "true"
 
-# Auto-configure Redis host nếu được bật
+# Auto-configure Redis host nếu được bật (probe hosts, chạy lúc kết nối chứ không lúc import)
 REDIS_AUTO_DETECT = os.getenv("REDIS_AUTO_DETECT", "true").lower() == "true"
-if REDIS_ENABLED and REDIS_AUTO_DETECT:
-    try:
-        from .redis_auto_config import auto_configure_redis
-        REDIS_HOST = auto_configure_redis()
-        logger.debug(f"Redis auto-configuration completed, using host: {REDIS_HOST}")
-    except ImportError:
-        # Redis module chưa được cài, dùng default
-        REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-        logger.debug(f"Redis module not available, using default host: {REDIS_HOST}")
-    except Exception as e:
-        logger.warning(f"Redis auto-configuration failed: {e}, using default")
-        REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
-else:
-    REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+REDIS_HOST = os.getenv("REDIS_HOST", "localhost")
+# Kết nối + ping Redis trên thread nền: khởi tạo service không bị block tới REDIS_CONNECT_TIMEOUT,
+# L2 được bật khi ping thành công (trước đó các requests đi thẳng L1 -> L3)
+REDIS_CONNECT_IN_BACKGROUND = os.getenv("REDIS_CONNECT_IN_BACKGROUND", "true").lower() == "true"
 
 REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
 REDIS_DB = int(os.getenv("REDIS_DB", "0"))
@@ -61,30 +51,64 @@ if '#' in REDIS_PASSWORD:
     REDIS_PASSWORD = REDIS_PASSWORD.split('#')[0].strip()
 if not REDIS_PASSWORD:
     REDIS_PASSWORD = None
+# Số connections tối đa trong pool (nên >= số threads/workers dùng cache đồng thời)
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", "32"))
+REDIS_KEEPALIVE_IDLE = int(os.getenv("REDIS_KEEPALIVE_IDLE", "60"))  # Giây trước khi gửi TCP keepalive probe
 
 # Cache configuration
 L1_CACHE_SIZE = int(os.getenv("L1_CACHE_SIZE", "1000"))  # Max entries in memory
+L1_CACHE_SHARDS = int(os.getenv("L1_CACHE_SHARDS", "16"))  # Số shards (mỗi shard một lock)
 L1_DEFAULT_TTL = int(os.getenv("L1_DEFAULT_TTL", "300"))  # 5 minutes
 L2_DEFAULT_TTL = int(os.getenv("L2_DEFAULT_TTL", "3600"))  # 1 hour
 L3_DEFAULT_TTL = int(os.getenv("L3_DEFAULT_TTL", "86400"))  # 24 hours
 L3_ENABLED = os.getenv("L3_CACHE_ENABLED", "true").lower() == "true"
+# Chỉ bật khi Redis DB dành riêng cho cache (Celery broker mặc định dùng chung REDIS_DB)
+L2_FLUSHDB_ON_CLEAR = os.getenv("L2_FLUSHDB_ON_CLEAR", "false").lower() == "true"
 
 # Adaptive TTL configuration
 ADAPTIVE_TTL_ENABLED = os.getenv("ADAPTIVE_TTL_ENABLED", "true").lower() == "true"
 MIN_TTL = int(os.getenv("MIN_TTL", "60"))  # 1 minute minimum
 MAX_TTL = int(os.getenv("MAX_TTL", "86400"))  # 24 hours maximum
 TTL_MULTIPLIER = float(os.getenv("TTL_MULTIPLIER", "1.5"))  # Multiply TTL for frequently accessed items
+# Multiplier adaptive TTL theo access_count: 0-5 -> 1, 6-10 -> TTL_MULTIPLIER, > 10 -> 2 * TTL_MULTIPLIER
+_TTL_MULTIPLIER_TABLE = (1.0,) * 6 + (TTL_MULTIPLIER,) * 5 + (TTL_MULTIPLIER * 2,)
+_TTL_TABLE_MAX_INDEX = len(_TTL_MULTIPLIER_TABLE) - 1
+# Số keys tối đa được theo dõi access pattern (LRU), tránh dict tăng vô hạn với keys high-cardinality
+ACCESS_PATTERNS_MAX = int(os.getenv("ACCESS_PATTERNS_MAX", str(L1_CACHE_SIZE * 4)))
+# Chu kỳ (giây) chia đôi access_count để TTL phản ánh truy cập gần đây
+ACCESS_PATTERNS_DECAY_INTERVAL = float(os.getenv("ACCESS_PATTERNS_DECAY_INTERVAL", "600"))
 
 # Cache warming configuration
 CACHE_WARMING_ENABLED = os.getenv("CACHE_WARMING_ENABLED", "true").lower() == "true"
 WARMING_TOP_N = int(os.getenv("WARMING_TOP_N", "100"))  # Top N items to warm
+# Warming chạy ngay trước khi hot entries trong L1 hết hạn (hoặc khi có hot key mới),
+# giới hạn trong [WARMING_MIN_INTERVAL, WARMING_MAX_INTERVAL] giây giữa hai lần
+WARMING_MIN_INTERVAL = float(os.getenv("WARMING_MIN_INTERVAL", "30"))
+WARMING_MAX_INTERVAL = float(os.getenv("WARMING_MAX_INTERVAL", "300"))
+WARMING_PREFETCH_SECONDS = float(os.getenv("WARMING_PREFETCH_SECONDS", "10"))  # Warm trước khi hết hạn
+WARMING_HOT_ACCESS_COUNT = int(os.getenv("WARMING_HOT_ACCESS_COUNT", "5"))  # Ngưỡng coi là hot key
+
+# Negative cache: keys vừa miss ở mọi level được ghi vào counting Bloom filter để lookup lặp lại
+# không tốn round trip Redis/DB; reset sau NEGATIVE_CACHE_TTL giây
+NEGATIVE_CACHE_ENABLED = os.getenv("NEGATIVE_CACHE_ENABLED", "true").lower() == "true"
+NEGATIVE_CACHE_SIZE = int(os.getenv("NEGATIVE_CACHE_SIZE", "131072"))  # Số counters
+NEGATIVE_CACHE_TTL = float(os.getenv("NEGATIVE_CACHE_TTL", "30"))
+
+# Metrics hit/miss được gom vào một buffer chung, flush sang metrics_service mỗi N events hoặc sau interval
+METRICS_FLUSH_EVERY = int(os.getenv("CACHE_METRICS_FLUSH_EVERY", "256"))
+METRICS_FLUSH_INTERVAL = float(os.getenv("CACHE_METRICS_FLUSH_INTERVAL", "1.0"))  # Seconds
+
+# Stats configuration
+STATS_MEMO_TTL = float(os.getenv("CACHE_STATS_MEMO_TTL", "1.0"))  # Seconds to reuse computed stats
 
 # Import cache components from separate module
 from .cache_components import (
     CacheLevel,
     CacheEntry,
     CacheStats,
-    LRUCache,
+    ShardedLRUCache,
+    NegativeLookupFilter,
+    build_cache_key,
 )
 
 # Import cache operations
@@ -96,7 +120,7 @@ class AdvancedCacheService:
     
     def __init__(self, db_session=None):
         # L1: In-memory cache
-        self.l1_cache = LRUCache(max_size=L1_CACHE_SIZE)
+        self.l1_cache = ShardedLRUCache(max_size=L1_CACHE_SIZE, num_shards=L1_CACHE_SHARDS)
         
         # L2: Redis cache
         self.redis_client = None
@@ -109,17 +133,37 @@ class AdvancedCacheService:
         
         # Statistics
         self.stats = CacheStats()
-        self.stats_lock = threading.Lock()
+        self._stats_memo = None  # (monotonic timestamp, stats dict)
+        # Buffer metrics dùng chung mọi thread: {(kind, level, cache_type): n}
+        # Flush khi đủ METRICS_FLUSH_EVERY events / quá interval, thread access-patterns flush định kỳ khi rảnh
+        self._metric_counts: Dict[tuple, int] = {}
+        self._metric_pending = 0
+        self._metrics_flushed_at = time.monotonic()
+        self._metric_lock = threading.Lock()
+        
+        # Negative cache cho keys miss ở mọi level (chỉ có ích khi có L2/L3)
+        self._neg_filter = (
+            NegativeLookupFilter(NEGATIVE_CACHE_SIZE, NEGATIVE_CACHE_TTL)
+            if NEGATIVE_CACHE_ENABLED else None
+        )
+        
+        # Access pattern tracking for adaptive TTL: key -> [access_count, last_accessed (monotonic), cache_type]
+        # OrderedDict theo thứ tự truy cập, giới hạn ACCESS_PATTERNS_MAX entries (LRU)
+        # Chỉ thread access-patterns ghi vào dict (không cần lock); requests đẩy event vào queue
+        self.access_patterns: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._patterns_decay_at = time.monotonic() + ACCESS_PATTERNS_DECAY_INTERVAL
+        self._pattern_queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._pattern_thread = threading.Thread(
+            target=self._access_pattern_worker, daemon=True, name="cache-access-patterns"
+        )
+        self._pattern_thread.start()
         
-        # Access pattern tracking for adaptive TTL
-        self.access_patterns: Dict[str, Dict[str, Any]] = defaultdict(lambda: {
-            "access_count": 0,
-            "last_accessed": None,
-            "avg_ttl": L2_DEFAULT_TTL
-        })
-        self.patterns_lock = threading.Lock()
+        # Single-flight: key -> [Event, value, exception] của lần load đang chạy
+        self._inflight: Dict[str, List[Any]] = {}
+        self._inflight_lock = threading.Lock()
         
-        # Cache warming
+        # Cache warming (worker chờ event hoặc deadline tính từ hot entries)
+        self._warming_event = threading.Event()
         self.warming_enabled = CACHE_WARMING_ENABLED
         self._init_cache_warming()
         
@@ -129,37 +173,68 @@ class AdvancedCacheService:
         logger.info(f"Advanced Cache Service initialized - L1: enabled, L2: {self.l2_enabled}, L3: {self.l3_enabled}")
     
     def _init_redis(self):
-        """Initialize Redis client"""
+        """Initialize Redis client (mặc định kết nối trên thread nền)"""
         if not REDIS_ENABLED:
             return
         
+        if REDIS_CONNECT_IN_BACKGROUND:
+            threading.Thread(target=self._connect_redis, daemon=True, name="redis-connect").start()
+        else:
+            self._connect_redis()
+    
+    @staticmethod
+    def _resolve_redis_host() -> str:
+        """Redis host: auto-detect nếu được bật, ngược lại REDIS_HOST"""
+        if not REDIS_AUTO_DETECT:
+            return REDIS_HOST
+        try:
+            from .redis_auto_config import auto_configure_redis
+            host = auto_configure_redis()
+            logger.debug(f"Redis auto-configuration completed, using host: {host}")
+            return host
+        except ImportError:
+            # Redis module chưa được cài, dùng default
+            logger.debug(f"Redis module not available, using default host: {REDIS_HOST}")
+        except Exception as e:
+            logger.warning(f"Redis auto-configuration failed: {e}, using default")
+        return REDIS_HOST
+    
+    def _connect_redis(self):
+        """Tạo Redis client và ping; chỉ bật L2 khi ping thành công"""
         try:
             import redis
             
+            redis_host = self._resolve_redis_host()
+            
             # Cấu hình timeout từ environment variables
             redis_connect_timeout = int(os.getenv("REDIS_CONNECT_TIMEOUT", "10"))  # Default 10 seconds
             redis_socket_timeout = int(os.getenv("REDIS_SOCKET_TIMEOUT", "10"))  # Default 10 seconds
             
+            # Giữ raw bytes (không decode_responses): values là JSON bytes được parse trực tiếp
             redis_kwargs = {
-                'host': REDIS_HOST,
+                'host': redis_host,
                 'port': REDIS_PORT,
                 'db': REDIS_DB,
-                'decode_responses': True,
+                'max_connections': REDIS_POOL_SIZE,
                 'socket_connect_timeout': redis_connect_timeout,
                 'socket_timeout': redis_socket_timeout,
                 'socket_keepalive': True,  # Giữ connection alive
                 'health_check_interval': 30,  # Check connection health mỗi 30 giây
             }
+            if hasattr(socket, "TCP_KEEPIDLE"):
+                redis_kwargs['socket_keepalive_options'] = {socket.TCP_KEEPIDLE: REDIS_KEEPALIVE_IDLE}
             if REDIS_PASSWORD and REDIS_PASSWORD.strip():
                 redis_kwargs['password'] = REDIS_PASSWORD.strip()
             
-            self.redis_client = redis.Redis(**redis_kwargs)
+            pool = redis.ConnectionPool(**redis_kwargs)
+            client = redis.Redis(connection_pool=pool)
             
-            # Test connection với retry
+            # Test connection; client chỉ được dùng (l2_enabled) sau khi ping thành công
             try:
-                self.redis_client.ping()
+                client.ping()
+                self.redis_client = client
                 self.l2_enabled = True
-                logger.info(f"Redis (L2) cache connected: {REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}")
+                logger.info(f"Redis (L2) cache connected: {redis_host}:{REDIS_PORT}/{REDIS_DB}")
             except redis.ConnectionError as e:
                 logger.warning(f"Redis ping failed: {e}. L2 cache disabled.")
                 self.redis_client = None
@@ -185,72 +260,81 @@ class AdvancedCacheService:
     
     def _generate_key(self, prefix: str, *args, **kwargs) -> str:
         """Generate cache key from prefix and arguments"""
-        key_parts = [prefix]
-        
-        for arg in args:
-            if isinstance(arg, (dict, list)):
-                key_parts.append(json.dumps(arg, sort_keys=True))
-            else:
-                key_parts.append(str(arg))
-        
-        if kwargs:
-            sorted_kwargs = sorted(kwargs.items())
-            key_parts.append(json.dumps(sorted_kwargs, sort_keys=True))
-        
-        key_string = ":".join(key_parts)
-        if len(key_string) > 200:
-            key_hash = hashlib.md5(key_string.encode()).hexdigest()
-            return f"{prefix}:{key_hash}"
-        
-        return key_string
+        return build_cache_key(prefix, args, kwargs)
     
     def _calculate_adaptive_ttl(self, key: str, base_ttl: int, cache_type: str) -> int:
         """Calculate adaptive TTL based on access patterns"""
         if not ADAPTIVE_TTL_ENABLED:
             return base_ttl
         
-        with self.patterns_lock:
-            pattern = self.access_patterns[key]
-            access_count = pattern["access_count"]
-            
-            # Increase TTL for frequently accessed items
-            if access_count > 10:
-                # Very frequently accessed: increase TTL significantly
-                adaptive_ttl = int(base_ttl * TTL_MULTIPLIER * 2)
-            elif access_count > 5:
-                # Frequently accessed: increase TTL moderately
-                adaptive_ttl = int(base_ttl * TTL_MULTIPLIER)
-            else:
-                # Normal access: use base TTL
-                adaptive_ttl = base_ttl
-            
-            # Clamp to min/max
-            adaptive_ttl = max(MIN_TTL, min(MAX_TTL, adaptive_ttl))
-            
-            return adaptive_ttl
+        # dict.get không tạo entry cho key chưa từng được truy cập
+        pattern = self.access_patterns.get(key)
+        if pattern is None:
+            return max(MIN_TTL, min(MAX_TTL, base_ttl))
+        
+        # Multiplier tra bảng theo access_count (> 10: x2 TTL_MULTIPLIER, > 5: x TTL_MULTIPLIER)
+        multiplier = _TTL_MULTIPLIER_TABLE[min(pattern[0], _TTL_TABLE_MAX_INDEX)]
+        return max(MIN_TTL, min(MAX_TTL, int(base_ttl * multiplier)))
     
     def _update_access_pattern(self, key: str, cache_type: str):
-        """Update access pattern for adaptive TTL"""
-        with self.patterns_lock:
-            pattern = self.access_patterns[key]
-            pattern["access_count"] += 1
-            pattern["last_accessed"] = datetime.now()
-            pattern["cache_type"] = cache_type
+        """
+        Update access pattern for adaptive TTL
+        Chỉ đẩy event vào queue; thread access-patterns áp dụng sau (TTL heuristic chấp nhận trễ nhẹ)
+        """
+        self._pattern_queue.put((key, cache_type, time.monotonic()))
+    
+    def _access_pattern_worker(self):
+        """Single writer: áp dụng access events vào access_patterns (LRU cap + decay)"""
+        patterns = self.access_patterns
+        pattern_queue = self._pattern_queue
+        while True:
+            try:
+                key, cache_type, now = pattern_queue.get(timeout=METRICS_FLUSH_INTERVAL)
+            except queue.Empty:
+                # Không có traffic: đẩy metrics còn nằm trong buffer
+                self._flush_metrics()
+                continue
+            try:
+                pattern = patterns.get(key)
+                if pattern is None:
+                    patterns[key] = [1, now, cache_type]
+                    while len(patterns) > ACCESS_PATTERNS_MAX:
+                        patterns.popitem(last=False)
+                    if now >= self._patterns_decay_at:
+                        self._decay_access_patterns(now)
+                else:
+                    patterns.move_to_end(key)
+                    pattern[0] += 1
+                    pattern[1] = now
+                    pattern[2] = cache_type
+            except Exception as e:
+                logger.error(f"Access pattern worker error: {e}")
+    
+    def _decay_access_patterns(self, now: float):
+        """Chia đôi access_count của mọi entry (chỉ gọi từ thread access-patterns)"""
+        for pattern in self.access_patterns.values():
+            pattern[0] >>= 1
+        self._patterns_decay_at = now + ACCESS_PATTERNS_DECAY_INTERVAL
     
     def get(self, key: str, cache_type: str = "generic") -> Optional[Any]:
         """Get value from cache (tries L1 -> L2 -> L3)"""
         # Try L1 first
         value = self.l1_cache.get(key)
         if value is not None:
-            with self.stats_lock:
-                self.stats.hits += 1
-                self.stats.l1_hits += 1
+            self.stats.hits += 1
+            self.stats.l1_hits += 1
             self._update_access_pattern(key, cache_type)
             self._record_cache_hit("l1", cache_type)
             return value
         
-        with self.stats_lock:
-            self.stats.l1_misses += 1
+        self.stats.l1_misses += 1
+        
+        # Key vừa miss ở mọi level -> trả về miss không cần hỏi Redis/DB
+        if self._neg_filter is not None and key in self._neg_filter:
+            self.stats.misses += 1
+            self.stats.negative_hits += 1
+            self._record_cache_miss(cache_type)
+            return None
         
         # Try L2 (Redis)
         if self.l2_enabled:
@@ -260,41 +344,147 @@ class AdvancedCacheService:
                 ttl = self._calculate_adaptive_ttl(key, L1_DEFAULT_TTL, cache_type)
                 self.l1_cache.set(key, value, ttl, cache_type)
                 
-                with self.stats_lock:
-                    self.stats.hits += 1
-                    self.stats.l2_hits += 1
+                self.stats.hits += 1
+                self.stats.l2_hits += 1
                 self._update_access_pattern(key, cache_type)
                 self._record_cache_hit("l2", cache_type)
                 return value
         
-        with self.stats_lock:
-            self.stats.l2_misses += 1
+        self.stats.l2_misses += 1
         
         # Try L3 (Database)
         if self.l3_enabled:
-            value = CacheOperations.get_from_l3(self.db_session, key)
+            value, raw_json = CacheOperations.get_from_l3_with_raw(self.db_session, key)
             if value is not None:
-                # Promote to L1 and L2
+                # Promote to L1 (đồng bộ) and L2 (pipeline chạy nền, dùng lại JSON của L3)
                 ttl_l1 = self._calculate_adaptive_ttl(key, L1_DEFAULT_TTL, cache_type)
                 ttl_l2 = self._calculate_adaptive_ttl(key, L2_DEFAULT_TTL, cache_type)
-                self.l1_cache.set(key, value, ttl_l1, cache_type)
-                if self.l2_enabled:
-                    CacheOperations.set_to_l2(self.redis_client, key, value, ttl_l2)
+                CacheOperations.promote_to_l1_l2(
+                    self.redis_client if self.l2_enabled else None, self.l1_cache,
+                    key, value, ttl_l1, ttl_l2, cache_type, raw_json=raw_json
+                )
                 
-                with self.stats_lock:
-                    self.stats.hits += 1
-                    self.stats.l3_hits += 1
+                self.stats.hits += 1
+                self.stats.l3_hits += 1
                 self._update_access_pattern(key, cache_type)
                 self._record_cache_hit("l3", cache_type)
                 return value
         
-        with self.stats_lock:
-            self.stats.misses += 1
-            self.stats.l3_misses += 1
+        self.stats.misses += 1
+        self.stats.l3_misses += 1
+        if self._neg_filter is not None and (self.l2_enabled or self.l3_enabled):
+            self._neg_filter.add(key)
         
         self._record_cache_miss(cache_type)
         return None
     
+    def get_many(self, keys: List[str], cache_type: str = "generic") -> Dict[str, Any]:
+        """
+        Get nhiều keys (L1 -> L2 -> L3) với một round trip Redis cho cả batch
+        Promote từ L3 lên L2 cũng gom thành một pipeline. Chỉ trả về keys có trong cache
+        """
+        found: Dict[str, Any] = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            value = self.l1_cache.get(key)
+            if value is not None:
+                found[key] = value
+                self._record_hit(key, cache_type, "l1")
+            else:
+                missing.append(key)
+        
+        self.stats.l1_misses += len(missing)
+        
+        if self._neg_filter is not None and missing:
+            known_misses = [key for key in missing if key in self._neg_filter]
+            if known_misses:
+                self.stats.misses += len(known_misses)
+                self.stats.negative_hits += len(known_misses)
+                self._record_cache_miss(cache_type, len(known_misses))
+                known = set(known_misses)
+                missing = [key for key in missing if key not in known]
+        
+        # L2: một pipeline GET cho mọi keys miss ở L1
+        if missing and self.l2_enabled:
+            l2_found = CacheOperations.get_from_l2_many(self.redis_client, missing)
+            for key, value in l2_found.items():
+                ttl = self._calculate_adaptive_ttl(key, L1_DEFAULT_TTL, cache_type)
+                self.l1_cache.set(key, value, ttl, cache_type)
+                found[key] = value
+                self._record_hit(key, cache_type, "l2")
+            missing = [key for key in missing if key not in l2_found]
+        
+        self.stats.l2_misses += len(missing)
+        
+        # L3: promote lên L1, L2 gom lại ghi bằng một pipeline chạy nền
+        if missing and self.l3_enabled:
+            l2_promotions = []
+            still_missing = []
+            for key in missing:
+                value, raw_json = CacheOperations.get_from_l3_with_raw(self.db_session, key)
+                if value is None:
+                    still_missing.append(key)
+                    continue
+                ttl_l1 = self._calculate_adaptive_ttl(key, L1_DEFAULT_TTL, cache_type)
+                self.l1_cache.set(key, value, ttl_l1, cache_type)
+                if self.l2_enabled:
+                    l2_promotions.append(
+                        (key, CacheOperations.l2_payload(value, raw_json, cache_type),
+                         self._calculate_adaptive_ttl(key, L2_DEFAULT_TTL, cache_type))
+                    )
+                found[key] = value
+                self._record_hit(key, cache_type, "l3")
+            if l2_promotions:
+                CacheOperations.promote_to_l2_async(self.redis_client, l2_promotions)
+            missing = still_missing
+        
+        if missing:
+            self.stats.misses += len(missing)
+            self.stats.l3_misses += len(missing)
+            if self._neg_filter is not None and (self.l2_enabled or self.l3_enabled):
+                for key in missing:
+                    self._neg_filter.add(key)
+            self._record_cache_miss(cache_type, len(missing))
+        
+        return found
+    
+    def _record_hit(self, key: str, cache_type: str, level: str):
+        """Cập nhật stats, access pattern và metric cho một hit ở level"""
+        self.stats.hits += 1
+        level_hits = f"{level}_hits"
+        setattr(self.stats, level_hits, getattr(self.stats, level_hits) + 1)
+        self._update_access_pattern(key, cache_type)
+        self._record_cache_hit(level, cache_type)
+    
+    def set_many(self, items: Dict[str, Any], ttl: Optional[int] = None,
+                 cache_type: str = "generic") -> bool:
+        """Set nhiều keys ở mọi level đang bật; L2 ghi bằng một pipeline"""
+        if not items:
+            return True
+        
+        base_ttl = ttl or L2_DEFAULT_TTL
+        success = True
+        l2_items = []
+        for key, value in items.items():
+            if self._neg_filter is not None:
+                self._neg_filter.discard(key)
+            adaptive_ttl = self._calculate_adaptive_ttl(key, base_ttl, cache_type)
+            l1_ttl = adaptive_ttl if adaptive_ttl < L1_DEFAULT_TTL * 2 else L1_DEFAULT_TTL
+            success = self.l1_cache.set(key, value, l1_ttl, cache_type) and success
+            if self.l2_enabled:
+                l2_items.append((key, value, adaptive_ttl))
+            if self.l3_enabled:
+                l3_ttl = adaptive_ttl if adaptive_ttl > L2_DEFAULT_TTL else L3_DEFAULT_TTL
+                success = CacheOperations.set_to_l3(self.db_session, key, value, l3_ttl, cache_type) and success
+        
+        if l2_items:
+            success = CacheOperations.set_to_l2_many(self.redis_client, l2_items, cache_type) and success
+        
+        if success:
+            self.stats.sets += len(items)
+        
+        return success
+    
     def set(self, key: str, value: Any, ttl: Optional[int] = None, 
             cache_type: str = "generic", levels: List[CacheLevel] = None) -> bool:
         """Set value in cache at specified levels"""
@@ -306,6 +496,15 @@ class AdvancedCacheService:
             if self.l3_enabled:
                 levels.append(CacheLevel.L3)
         
+        if self._neg_filter is not None:
+            self._neg_filter.discard(key)
+        
+        # Hot key mới vào cache -> đánh thức warming worker để tính lại deadline
+        if self.warming_enabled:
+            pattern = self.access_patterns.get(key)
+            if pattern is not None and pattern[0] > WARMING_HOT_ACCESS_COUNT:
+                self._warming_event.set()
+        
         # Calculate adaptive TTL
         base_ttl = ttl or L2_DEFAULT_TTL
         adaptive_ttl = self._calculate_adaptive_ttl(key, base_ttl, cache_type)
@@ -320,7 +519,7 @@ class AdvancedCacheService:
         # Set in L2
         if CacheLevel.L2 in levels and self.l2_enabled:
             l2_ttl = adaptive_ttl
-            success = CacheOperations.set_to_l2(self.redis_client, key, value, l2_ttl) and success
+            success = CacheOperations.set_to_l2(self.redis_client, key, value, l2_ttl, cache_type) and success
         
         # Set in L3
         if CacheLevel.L3 in levels and self.l3_enabled:
@@ -328,11 +527,46 @@ class AdvancedCacheService:
             success = CacheOperations.set_to_l3(self.db_session, key, value, l3_ttl, cache_type) and success
         
         if success:
-            with self.stats_lock:
-                self.stats.sets += 1
+            self.stats.sets += 1
         
         return success
     
+    def get_or_compute(self, key: str, loader: Callable[[], Any], ttl: Optional[int] = None,
+                       cache_type: str = "generic") -> Any:
+        """
+        Get value từ cache, miss thì gọi loader() và set kết quả
+        Nhiều threads cùng miss một key chỉ gọi loader một lần, các threads khác chờ kết quả
+        """
+        value = self.get(key, cache_type)
+        if value is not None:
+            return value
+        
+        with self._inflight_lock:
+            slot = self._inflight.get(key)
+            leader = slot is None
+            if leader:
+                slot = [threading.Event(), None, None]
+                self._inflight[key] = slot
+        
+        if not leader:
+            slot[0].wait()
+            if slot[2] is not None:
+                raise slot[2]
+            return slot[1]
+        
+        try:
+            value = loader()
+            if value is not None:
+                self.set(key, value, ttl, cache_type)
+            slot[1] = value
+            return value
+        except Exception as e:
+            slot[2] = e
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(key, None)
+            slot[0].set()
     
     def delete(self, key: str, levels: List[CacheLevel] = None) -> bool:
         """Delete key from cache at specified levels"""
@@ -364,14 +598,16 @@ class AdvancedCacheService:
         
         # L1: iterate through all keys
         if CacheLevel.L1 in levels:
-            keys_to_delete = [k for k in self.l1_cache.cache.keys() if pattern in k]
-            for key in keys_to_delete:
-                if self.l1_cache.delete(key):
-                    count += 1
+            if pattern == "*":
+                count += self.l1_cache.clear()
+            else:
+                count += self.l1_cache.delete_many(lambda key: pattern in key)
         
-        # L2: use Redis pattern matching
+        # L2: SCAN + UNLINK (hoặc FLUSHDB ASYNC cho "*" nếu được phép)
         if CacheLevel.L2 in levels and self.l2_enabled:
-            count += CacheOperations.invalidate_pattern_l2(self.redis_client, pattern)
+            count += CacheOperations.invalidate_pattern_l2(
+                self.redis_client, pattern, flushdb_allowed=L2_FLUSHDB_ON_CLEAR
+            )
         
         # L3: database query
         if CacheLevel.L3 in levels and self.l3_enabled:
@@ -382,63 +618,128 @@ class AdvancedCacheService:
         
         return count
     
-    def _record_cache_hit(self, level: str, cache_type: str):
-        """Record cache hit metric"""
+    def _record_cache_hit(self, level: str, cache_type: str, count: int = 1):
+        """Record cache hit metric (gom vào buffer)"""
         if METRICS_AVAILABLE and metrics_service:
-            metrics_service.record_cache_hit(f"{level}:{cache_type}")
+            self._buffer_metric(("hit", level, cache_type), count)
     
-    def _record_cache_miss(self, cache_type: str):
-        """Record cache miss metric"""
+    def _record_cache_miss(self, cache_type: str, count: int = 1):
+        """Record cache miss metric (gom vào buffer)"""
         if METRICS_AVAILABLE and metrics_service:
-            metrics_service.record_cache_miss(cache_type)
+            self._buffer_metric(("miss", None, cache_type), count)
+    
+    def _buffer_metric(self, metric_key: tuple, count: int):
+        """Cộng dồn metric trong buffer chung, flush khi đủ METRICS_FLUSH_EVERY events hoặc quá interval"""
+        with self._metric_lock:
+            counts = self._metric_counts
+            counts[metric_key] = counts.get(metric_key, 0) + count
+            self._metric_pending += count
+            if (self._metric_pending < METRICS_FLUSH_EVERY
+                    and time.monotonic() - self._metrics_flushed_at < METRICS_FLUSH_INTERVAL):
+                return
+            counts = self._take_metrics()
+        self._emit_metrics(counts)
+    
+    def _flush_metrics(self):
+        """Đẩy toàn bộ counts đang buffer sang metrics_service"""
+        with self._metric_lock:
+            counts = self._take_metrics()
+        self._emit_metrics(counts)
+    
+    def _take_metrics(self) -> Dict[tuple, int]:
+        """Lấy counts ra khỏi buffer (gọi khi đang giữ _metric_lock)"""
+        counts = self._metric_counts
+        self._metric_counts = {}
+        self._metric_pending = 0
+        self._metrics_flushed_at = time.monotonic()
+        return counts
+    
+    @staticmethod
+    def _emit_metrics(counts: Dict[tuple, int]):
+        """Gọi metrics_service ngoài lock (mỗi label một lần inc)"""
+        if not counts or not (METRICS_AVAILABLE and metrics_service):
+            return
+        for (kind, level, cache_type), count in counts.items():
+            if kind == "hit":
+                metrics_service.record_cache_hit(cache_type, level, count=count)
+            else:
+                metrics_service.record_cache_miss(cache_type, count=count)
     
     def get_stats(self) -> Dict[str, Any]:
-        """Get cache statistics"""
-        with self.stats_lock:
-            stats_dict = {
-                "hits": self.stats.hits,
-                "misses": self.stats.misses,
-                "sets": self.stats.sets,
-                "evictions": self.stats.evictions,
-                "hit_rate": self.stats.get_hit_rate(),
-                "l1": {
-                    "hits": self.stats.l1_hits,
-                    "misses": self.stats.l1_misses,
-                    "size": self.l1_cache.size(),
-                    "max_size": self.l1_cache.max_size
-                },
-                "l2": {
-                    "enabled": self.l2_enabled,
-                    "hits": self.stats.l2_hits,
-                    "misses": self.stats.l2_misses
-                },
-                "l3": {
-                    "enabled": self.l3_enabled,
-                    "hits": self.stats.l3_hits,
-                    "misses": self.stats.l3_misses
-                }
+        """Get cache statistics (memoized for STATS_MEMO_TTL seconds)"""
+        now = time.monotonic()
+        memo = self._stats_memo
+        if memo is not None and now - memo[0] < STATS_MEMO_TTL:
+            return memo[1]
+        
+        stats_dict = {
+            "hits": self.stats.hits,
+            "misses": self.stats.misses,
+            "sets": self.stats.sets,
+            "evictions": self.stats.evictions,
+            "negative_hits": self.stats.negative_hits,
+            "hit_rate": self.stats.get_hit_rate(),
+            "l1": {
+                "hits": self.stats.l1_hits,
+                "misses": self.stats.l1_misses,
+                "size": self.l1_cache.size(),
+                "max_size": self.l1_cache.max_size
+            },
+            "l2": {
+                "enabled": self.l2_enabled,
+                "hits": self.stats.l2_hits,
+                "misses": self.stats.l2_misses
+            },
+            "l3": {
+                "enabled": self.l3_enabled,
+                "hits": self.stats.l3_hits,
+                "misses": self.stats.l3_misses
             }
-            
-            if self.l2_enabled:
-                try:
-                    info = self.redis_client.info("memory")
-                    stats_dict["l2"]["memory_used"] = info.get("used_memory_human", "N/A")
-                except:
-                    pass
-            
-            return stats_dict
+        }
+        
+        if self.l2_enabled:
+            try:
+                # Một round trip cho tất cả Redis stats
+                pipe = self.redis_client.pipeline(transaction=False)
+                pipe.dbsize()
+                pipe.info("memory")
+                pipe.info("stats")
+                dbsize, memory_info, server_stats = pipe.execute()
+                stats_dict["l2"]["keys"] = dbsize
+                stats_dict["l2"]["memory_used"] = memory_info.get("used_memory_human", "N/A")
+                stats_dict["l2"]["keyspace_hits"] = server_stats.get("keyspace_hits")
+                stats_dict["l2"]["keyspace_misses"] = server_stats.get("keyspace_misses")
+            except Exception:
+                pass
+        
+        self._stats_memo = (now, stats_dict)
+        return stats_dict
+    
+    def _next_warming_delay(self) -> float:
+        """Số giây đến lần warming tiếp theo: ngay trước khi hot entry đầu tiên trong L1 hết hạn"""
+        expiry = self.l1_cache.next_expiry(WARMING_HOT_ACCESS_COUNT)
+        if expiry is None:
+            return WARMING_MAX_INTERVAL
+        delay = expiry - time.monotonic() - WARMING_PREFETCH_SECONDS
+        return max(WARMING_MIN_INTERVAL, min(WARMING_MAX_INTERVAL, delay))
     
     def _cache_warming_worker(self):
-        """Background worker for cache warming"""
-        import time
-        
+        """Background worker for cache warming (event-driven, không poll cố định)"""
+        last_warm = time.monotonic()
         while True:
             try:
-                time.sleep(300)  # Run every 5 minutes
+                self._warming_event.wait(timeout=self._next_warming_delay())
+                self._warming_event.clear()
+                # Giữ khoảng cách tối thiểu giữa hai lần warming khi bị đánh thức liên tục
+                remaining = last_warm + WARMING_MIN_INTERVAL - time.monotonic()
+                if remaining > 0:
+                    time.sleep(remaining)
                 if self.warming_enabled:
                     self._warm_cache()
+                last_warm = time.monotonic()
             except Exception as e:
                 logger.error(f"Cache warming worker error: {e}")
+                time.sleep(WARMING_MIN_INTERVAL)
     
     def _warm_cache(self):
         """Warm cache with frequently accessed items"""
@@ -483,9 +784,17 @@ class AdvancedCacheService:
         """Cache embedding result"""
         return self.convenience.cache_embedding(text, embedding, ttl)
     
-    def get_cached_embedding(self, text: str) -> Optional[list]:
-        """Get cached embedding"""
-        return self.convenience.get_cached_embedding(text)
+    def get_cached_embedding(self, text: str, as_array: bool = False) -> Optional[list]:
+        """Get cached embedding (as_array=True: ndarray float32)"""
+        return self.convenience.get_cached_embedding(text, as_array)
+    
+    def cache_embeddings(self, embeddings: Dict[str, list], ttl: Optional[int] = None) -> bool:
+        """Cache nhiều embeddings (text -> embedding)"""
+        return self.convenience.cache_embeddings(embeddings, ttl)
+    
+    def get_cached_embeddings(self, texts: List[str], as_array: bool = False) -> Dict[str, list]:
+        """Get cached embeddings cho nhiều texts (as_array=True: ndarray float32)"""
+        return self.convenience.get_cached_embeddings(texts, as_array)
     
     def cache_llm_response(self, user_message: str, response: str,
                           conversation_history: Optional[list] = None,
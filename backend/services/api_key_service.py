@@ -6,14 +6,19 @@ import hashlib
 import secrets
 import logging
 from datetime import datetime, timedelta
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Union
 from sqlalchemy.orm import Session
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, case, func
 from models import APIKey, APIKeyAuditLog
-import json
 
 logger = logging.getLogger(__name__)
 
+_sha256 = hashlib.sha256
+
+# Format key do generate_api_key tạo: "sk_live_" + 64 ký tự base64url
+API_KEY_PREFIX = "sk_live_"
+API_KEY_LENGTH = len(API_KEY_PREFIX) + 64
+
 
 class APIKeyService:
     """Service để quản lý API keys"""
@@ -28,15 +33,20 @@ class APIKeyService:
         Format: sk_live_<random_64_chars>
         """
         random_part = secrets.token_urlsafe(48)  # 48 bytes = 64 chars base64url
-        return f"sk_live_{random_part}"
+        return f"{API_KEY_PREFIX}{random_part}"
+    
+    @staticmethod
+    def is_well_formed_api_key(api_key: Optional[str]) -> bool:
+        """Kiểm tra nhanh format key (độ dài + prefix) trước khi hash/query DB"""
+        return bool(api_key) and len(api_key) == API_KEY_LENGTH and api_key.startswith(API_KEY_PREFIX)
     
     @staticmethod
-    def hash_api_key(api_key: str) -> str:
+    def hash_api_key(api_key: Union[str, bytes]) -> bytes:
         """
-        Hash API key bằng SHA-256
+        Hash API key bằng SHA-256, trả về digest 32 bytes (cột key_hash là BYTEA)
         Không bao giờ lưu plain text API key
         """
-        return hashlib.sha256(api_key.encode()).hexdigest()
+        return _sha256(api_key if isinstance(api_key, bytes) else api_key.encode()).digest()
     
     def create_api_key(
         self,
@@ -81,7 +91,7 @@ class APIKeyService:
                 key_hash=key_hash,
                 name=name,
                 user_id=user_id,
-                permissions=json.dumps(permissions) if permissions else None,
+                permissions=list(permissions) if permissions else None,
                 rate_limit=rate_limit,
                 expires_at=expires_at,
                 is_active=True
@@ -122,12 +132,22 @@ class APIKeyService:
         Args:
             api_key: Plain text API key
         
+        Returns:
+            APIKey object nếu valid, None nếu không hợp lệ
+        """
+        # Key sai format chắc chắn không có trong DB -> bỏ qua SHA-256 và query
+        if not self.is_well_formed_api_key(api_key):
+            return None
+        return self.verify_api_key_hash(self.hash_api_key(api_key))
+    
+    def verify_api_key_hash(self, key_hash: bytes) -> Optional[APIKey]:
+        """
+        Verify theo SHA-256 digest đã tính sẵn (caller đã hash key, không hash lại)
+        
         Returns:
             APIKey object nếu valid, None nếu không hợp lệ
         """
         try:
-            key_hash = self.hash_api_key(api_key)
-            
             # Find API key
             db_api_key = self.db.query(APIKey).filter(
                 and_(
@@ -153,6 +173,30 @@ class APIKeyService:
             logger.error(f"Error verifying API key: {e}")
             return None
     
+    def mark_api_keys_used(self, used_at: Dict[int, datetime]) -> int:
+        """
+        Ghi last_used_at cho nhiều API keys bằng một UPDATE (gom từ các lần verify qua cache)
+        
+        Args:
+            used_at: api_key_id -> thời điểm dùng gần nhất
+        
+        Returns:
+            Số rows được update
+        """
+        if not used_at:
+            return 0
+        try:
+            # Các lần dùng trong một lần flush gần nhau: ghi chung thời điểm muộn nhất
+            updated = self.db.query(APIKey).filter(APIKey.id.in_(list(used_at))).update(
+                {APIKey.last_used_at: max(used_at.values())}, synchronize_session=False
+            )
+            self.db.commit()
+            return updated
+        except Exception as e:
+            self.db.rollback()
+            logger.error(f"Error updating API key last_used_at: {e}")
+            return 0
+    
     def rotate_api_key(self, api_key_id: int, revoke_old: bool = True) -> Dict[str, Any]:
         """
         Rotate API key: tạo key mới và có thể revoke key cũ
@@ -174,7 +218,7 @@ class APIKeyService:
                 }
             
             # Create new API key với cùng settings
-            permissions = json.loads(old_key.permissions) if old_key.permissions else None
+            permissions = old_key.permissions or None
             expires_in_days = None
             if old_key.expires_at:
                 days_left = (old_key.expires_at - datetime.utcnow()).days
@@ -260,7 +304,8 @@ class APIKeyService:
             List các API key info (không bao gồm plain text key)
         """
         try:
-            query = self.db.query(APIKey)
+            # Một SELECT duy nhất, chỉ lấy các cột trả về cho client (không load key_hash)
+            query = self.db.query(*self._LIST_COLUMNS)
             
             if user_id is not None:
                 query = query.filter(APIKey.user_id == user_id)
@@ -270,27 +315,59 @@ class APIKeyService:
             
             api_keys = query.order_by(APIKey.created_at.desc()).all()
             
-            result = []
-            for key in api_keys:
-                permissions = json.loads(key.permissions) if key.permissions else []
-                result.append({
-                    "id": key.id,
-                    "name": key.name,
-                    "user_id": key.user_id,
-                    "permissions": permissions,
-                    "rate_limit": key.rate_limit,
-                    "created_at": key.created_at.isoformat(),
-                    "expires_at": key.expires_at.isoformat() if key.expires_at else None,
-                    "last_used_at": key.last_used_at.isoformat() if key.last_used_at else None,
-                    "is_active": key.is_active,
-                    "is_expired": key.expires_at is not None and key.expires_at < datetime.utcnow() if key.expires_at else False
-                })
-            
-            return result
+            return [self._api_key_to_dict(key) for key in api_keys]
         except Exception as e:
             logger.error(f"Error getting API keys: {e}")
             return []
     
+    def get_api_key_by_id(self, api_key_id: int) -> Optional[Dict[str, Any]]:
+        """
+        Lấy thông tin một API key theo ID (kể cả inactive)
+        
+        Args:
+            api_key_id: ID của API key
+        
+        Returns:
+            API key info (không bao gồm plain text key), None nếu không tồn tại
+        """
+        try:
+            key = self.db.query(APIKey).filter(APIKey.id == api_key_id).first()
+            if not key:
+                return None
+            return self._api_key_to_dict(key)
+        except Exception as e:
+            logger.error(f"Error getting API key {api_key_id}: {e}")
+            return None
+    
+    # Các cột cần cho _api_key_to_dict
+    _LIST_COLUMNS = (
+        APIKey.id,
+        APIKey.name,
+        APIKey.user_id,
+        APIKey.permissions,
+        APIKey.rate_limit,
+        APIKey.created_at,
+        APIKey.expires_at,
+        APIKey.last_used_at,
+        APIKey.is_active,
+    )
+    
+    @staticmethod
+    def _api_key_to_dict(key: APIKey) -> Dict[str, Any]:
+        """Convert APIKey record (hoặc row projection) sang dict trả về cho client"""
+        return {
+            "id": key.id,
+            "name": key.name,
+            "user_id": key.user_id,
+            "permissions": key.permissions or [],
+            "rate_limit": key.rate_limit,
+            "created_at": key.created_at.isoformat(),
+            "expires_at": key.expires_at.isoformat() if key.expires_at else None,
+            "last_used_at": key.last_used_at.isoformat() if key.last_used_at else None,
+            "is_active": key.is_active,
+            "is_expired": key.expires_at is not None and key.expires_at < datetime.utcnow() if key.expires_at else False
+        }
+    
     def log_api_key_usage(
         self,
         api_key_id: int,
@@ -303,6 +380,7 @@ class APIKeyService:
     ) -> None:
         """
         Log API key usage vào audit log
+        Đưa vào audit_log_buffer (ghi theo batch); buffer chưa chạy/đầy thì ghi trực tiếp
         
         Args:
             api_key_id: ID của API key
@@ -313,16 +391,21 @@ class APIKeyService:
             status_code: HTTP status code
             response_time_ms: Response time in milliseconds
         """
+        record = {
+            "api_key_id": api_key_id,
+            "endpoint": endpoint,
+            "method": method,
+            "ip_address": ip_address,
+            "user_agent": user_agent,
+            "status_code": status_code,
+            "response_time_ms": response_time_ms,
+        }
+        from services.audit_log_buffer import audit_log_buffer
+        if audit_log_buffer.enqueue(record):
+            return
+        
         try:
-            audit_log = APIKeyAuditLog(
-                api_key_id=api_key_id,
-                endpoint=endpoint,
-                method=method,
-                ip_address=ip_address,
-                user_agent=user_agent,
-                status_code=status_code,
-                response_time_ms=response_time_ms
-            )
+            audit_log = APIKeyAuditLog(**record)
             
             self.db.add(audit_log)
             self.db.commit()
@@ -348,25 +431,38 @@ class APIKeyService:
         try:
             since_date = datetime.utcnow() - timedelta(days=days)
             
-            logs = self.db.query(APIKeyAuditLog).filter(
+            # Một query GROUP BY endpoint: DB aggregate, chỉ trả về O(#endpoints) rows
+            # (response_time_ms = 0/NULL không tính vào average, NULLIF loại 0)
+            response_time = func.nullif(APIKeyAuditLog.response_time_ms, 0)
+            rows = self.db.query(
+                APIKeyAuditLog.endpoint,
+                func.count(),
+                func.sum(case((APIKeyAuditLog.status_code.between(200, 299), 1), else_=0)),
+                func.sum(case((APIKeyAuditLog.status_code >= 400, 1), else_=0)),
+                func.sum(response_time),
+                func.count(response_time),
+            ).filter(
                 and_(
                     APIKeyAuditLog.api_key_id == api_key_id,
                     APIKeyAuditLog.created_at >= since_date
                 )
-            ).all()
+            ).group_by(APIKeyAuditLog.endpoint).all()
             
-            total_requests = len(logs)
-            success_requests = len([l for l in logs if 200 <= l.status_code < 300])
-            error_requests = len([l for l in logs if l.status_code >= 400])
-            
-            # Group by endpoint
+            total_requests = 0
+            success_requests = 0
+            error_requests = 0
+            response_time_sum = 0
+            response_time_count = 0
             endpoint_counts = {}
-            for log in logs:
-                endpoint_counts[log.endpoint] = endpoint_counts.get(log.endpoint, 0) + 1
+            for endpoint, count, success, errors, rt_sum, rt_count in rows:
+                endpoint_counts[endpoint] = count
+                total_requests += count
+                success_requests += success or 0
+                error_requests += errors or 0
+                response_time_sum += rt_sum or 0
+                response_time_count += rt_count
             
-            # Average response time
-            response_times = [l.response_time_ms for l in logs if l.response_time_ms]
-            avg_response_time = sum(response_times) / len(response_times) if response_times else None
+            avg_response_time = response_time_sum / response_time_count if response_time_count else None
             
             return {
                 "api_key_id": api_key_id,
@@ -431,17 +527,8 @@ class APIKeyService:
         Returns:
             True nếu có permission, False nếu không
         """
-        try:
-            if not api_key.permissions:
-                return False
-            
-            permissions = json.loads(api_key.permissions) if isinstance(api_key.permissions, str) else api_key.permissions
-            
-            # Admin có tất cả permissions
-            if "admin" in permissions:
-                return True
-            
-            return required_permission in permissions
-        except Exception as e:
-            logger.error(f"Error checking permission: {e}")
-            return False
\ No newline at end of file
+        permissions = api_key.permissions
+        if not permissions:
+            return False
+        # Admin có tất cả permissions
+        return "admin" in permissions or required_permission in permissions
\ No newline at end of file
@@ -17,15 +17,8 @@ class AsyncCacheService:
         self.cache_service = AdvancedCacheService(db_session=db_session)
     
     async def get(self, key: str, cache_type: str = "generic") -> Optional[Any]:
-        """Async get từ cache"""
-        # Run sync operation in thread pool
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self.cache_service.get,
-            key,
-            cache_type
-        )
+        """Async get từ cache (chạy sync operation trên default thread pool)"""
+        return await asyncio.to_thread(self.cache_service.get, key, cache_type)
     
     async def set(
         self,
@@ -36,26 +29,11 @@ class AsyncCacheService:
         levels: List[CacheLevel] = None
     ) -> bool:
         """Async set vào cache"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self.cache_service.set,
-            key,
-            value,
-            ttl,
-            cache_type,
-            levels
-        )
+        return await asyncio.to_thread(self.cache_service.set, key, value, ttl, cache_type, levels)
     
     async def delete(self, key: str, levels: List[CacheLevel] = None) -> bool:
         """Async delete từ cache"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self.cache_service.delete,
-            key,
-            levels
-        )
+        return await asyncio.to_thread(self.cache_service.delete, key, levels)
     
     async def invalidate_pattern(
         self,
@@ -63,31 +41,16 @@ class AsyncCacheService:
         levels: List[CacheLevel] = None
     ) -> int:
         """Async invalidate pattern"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self.cache_service.invalidate_pattern,
-            pattern,
-            levels
-        )
+        return await asyncio.to_thread(self.cache_service.invalidate_pattern, pattern, levels)
     
     async def get_stats(self) -> Dict[str, Any]:
         """Async get cache statistics"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self.cache_service.get_stats
-        )
+        return await asyncio.to_thread(self.cache_service.get_stats)
     
     # Convenience methods
     async def get_cached_embedding(self, text: str) -> Optional[list]:
         """Async get cached embedding"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self.cache_service.get_cached_embedding,
-            text
-        )
+        return await asyncio.to_thread(self.cache_service.get_cached_embedding, text)
     
     async def cache_embedding(
         self,
@@ -96,14 +59,7 @@ class AsyncCacheService:
         ttl: Optional[int] = None
     ) -> bool:
         """Async cache embedding"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
-            self.cache_service.cache_embedding,
-            text,
-            embedding,
-            ttl
-        )
+        return await asyncio.to_thread(self.cache_service.cache_embedding, text, embedding, ttl)
     
     async def get_cached_llm_response(
         self,
@@ -113,14 +69,9 @@ class AsyncCacheService:
         temperature: float = 0.7
     ) -> Optional[str]:
         """Async get cached LLM response"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
+        return await asyncio.to_thread(
             self.cache_service.get_cached_llm_response,
-            user_message,
-            conversation_history,
-            system_prompt,
-            temperature
+            user_message, conversation_history, system_prompt, temperature
         )
     
     async def cache_llm_response(
@@ -133,16 +84,9 @@ class AsyncCacheService:
         ttl: Optional[int] = None
     ) -> bool:
         """Async cache LLM response"""
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(
-            None,
+        return await asyncio.to_thread(
             self.cache_service.cache_llm_response,
-            user_message,
-            response,
-            conversation_history,
-            system_prompt,
-            temperature,
-            ttl
+            user_message, response, conversation_history, system_prompt, temperature, ttl
         )
 
 
@@ -3,6 +3,7 @@ Async Database Configuration Module
 Cung cấp cấu hình async database với async SQLAlchemy và asyncpg driver
 """
 import os
+import asyncio
 import logging
 from typing import Optional, Dict, Any
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
@@ -32,7 +33,10 @@ class AsyncDatabaseConfig:
         self.pool_size = int(os.getenv("DB_POOL_SIZE", "10"))
         self.max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "20"))
         self.pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "3600"))
-        self.pool_timeout = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+        # Thời gian tối đa chờ lấy connection từ pool (fail fast thay vì treo request)
+        self.pool_timeout = float(os.getenv("DB_ASYNC_POOL_TIMEOUT", "2"))
+        # Số connections mở sẵn khi app start (mặc định = pool_size)
+        self.pool_warmup = int(os.getenv("DB_POOL_WARMUP", str(self.pool_size)))
         self.pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
         
         # Read replica configuration
@@ -50,11 +54,18 @@ class AsyncDatabaseConfig:
         
         # Application name
         self.application_name = os.getenv("DB_APPLICATION_NAME", "ai_agent_backend_async")
+        
+        # Statement caching
+        # query_cache_size: LRU compiled cache của SQLAlchemy (tránh compile lại select/where giống nhau)
+        self.query_cache_size = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+        # Prepared statement cache của asyncpg (set = 0 nếu đi qua pgbouncer transaction mode)
+        self.prepared_statement_cache_size = int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500"))
     
     def _build_connect_args(self) -> Dict[str, Any]:
         """Xây dựng connection arguments cho asyncpg"""
         connect_args = {
             "command_timeout": self.connect_timeout,
+            "statement_cache_size": self.prepared_statement_cache_size,
             "server_settings": {
                 "application_name": self.application_name,
             }
@@ -89,7 +100,11 @@ class AsyncDatabaseConfig:
         password = password or self.db_password
         
         # Use postgresql+asyncpg:// for async SQLAlchemy
-        return f"postgresql+asyncpg://{user}:{password}@{host}:{port}/{name}"
+        # prepared_statement_cache_size: cache prepared statements per connection ở dialect asyncpg
+        return (
+            f"postgresql+asyncpg://{user}:{password}@{host}:{port}/{name}"
+            f"?prepared_statement_cache_size={self.prepared_statement_cache_size}"
+        )
     
     def create_async_engine(self, use_read_replica: bool = False, **kwargs):
         """
@@ -117,6 +132,7 @@ class AsyncDatabaseConfig:
         pool_recycle = kwargs.get("pool_recycle", self.pool_recycle)
         pool_timeout = kwargs.get("pool_timeout", self.pool_timeout)
         pool_pre_ping = kwargs.get("pool_pre_ping", self.pool_pre_ping)
+        query_cache_size = kwargs.get("query_cache_size", self.query_cache_size)
         
         # Tạo async engine với connection pooling
         # Note: async engine tự động sử dụng AsyncAdaptedQueuePool, không cần chỉ định poolclass
@@ -125,18 +141,21 @@ class AsyncDatabaseConfig:
             pool_size=pool_size,
             max_overflow=max_overflow,
             pool_recycle=pool_recycle,
+            pool_timeout=pool_timeout,
             pool_pre_ping=pool_pre_ping,
+            query_cache_size=query_cache_size,
             echo=False,  # Set True để debug SQL queries
             connect_args=self._build_connect_args(),
             **{k: v for k, v in kwargs.items() if k not in [
                 "pool_size", "max_overflow", "pool_recycle", 
-                "pool_timeout", "pool_pre_ping"
+                "pool_timeout", "pool_pre_ping", "query_cache_size"
             ]}
         )
         
         logger.info(
             f"Created async engine with pool_size={pool_size}, "
-            f"max_overflow={max_overflow}, pool_recycle={pool_recycle}s"
+            f"max_overflow={max_overflow}, pool_recycle={pool_recycle}s, "
+            f"pool_timeout={pool_timeout}s"
         )
         
         return engine
@@ -151,6 +170,44 @@ class AsyncDatabaseConfig:
             autoflush=False
         )
     
+    async def warm_up_pool(self, engine, connections: Optional[int] = None) -> int:
+        """
+        Mở sẵn connections cho pool khi app start để các request đầu không phải
+        chịu TCP/TLS handshake và auth
+        
+        Args:
+            engine: Async engine cần warm up
+            connections: Số connections (mặc định DB_POOL_WARMUP, tối đa pool_size)
+        
+        Returns:
+            Số connections đã mở thành công
+        """
+        count = min(connections if connections is not None else self.pool_warmup, self.pool_size)
+        if count <= 0:
+            return 0
+        
+        async def checkout():
+            conn = await engine.connect()
+            try:
+                await conn.execute(text("SELECT 1"))
+            except Exception:
+                await conn.close()
+                raise
+            return conn
+        
+        # Giữ tất cả connections cùng lúc rồi mới trả về pool -> pool có đủ `count` connections
+        results = await asyncio.gather(*[checkout() for _ in range(count)], return_exceptions=True)
+        opened = 0
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning(f"Pool warm-up connection failed: {result!r}")
+                continue
+            await result.close()
+            opened += 1
+        
+        logger.info(f"Warmed up async pool with {opened}/{count} connections")
+        return opened
+    
     async def get_pool_stats(self, engine) -> Dict[str, Any]:
         """Lấy thống kê về connection pool"""
         pool = engine.pool
@@ -0,0 +1,137 @@
+"""
+Audit Log Buffer Service
+Gom các bản ghi API key audit log và ghi theo batch: một multi-row INSERT + một commit
+cho tối đa AUDIT_LOG_BATCH_SIZE requests thay vì một commit (fsync) cho mỗi request.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime
+from typing import Any, Dict, List
+
+from sqlalchemy.exc import DataError, IntegrityError
+
+from services.batching_queue import BatchingQueue
+
+try:
+    from services.metrics_service import metrics_service
+    METRICS_AVAILABLE = True
+except ImportError:
+    METRICS_AVAILABLE = False
+    metrics_service = None
+
+logger = logging.getLogger(__name__)
+
+# Số audit logs tối đa mỗi lần flush
+AUDIT_LOG_BATCH_SIZE = int(os.getenv("AUDIT_LOG_BATCH_SIZE", "1000"))
+# Thời gian chờ tối đa (giây) để gom thêm logs trước khi flush batch chưa đầy
+AUDIT_LOG_FLUSH_INTERVAL = float(os.getenv("AUDIT_LOG_FLUSH_INTERVAL", "0.5"))
+# Giới hạn queue để không giữ quá nhiều pending logs trong memory
+AUDIT_LOG_MAX_PENDING = int(os.getenv("AUDIT_LOG_MAX_PENDING", "50000"))
+# Số lần thử lại batch INSERT lỗi (backoff tăng gấp đôi) trước khi chuyển sang INSERT từng row
+AUDIT_LOG_FLUSH_RETRIES = int(os.getenv("AUDIT_LOG_FLUSH_RETRIES", "3"))
+AUDIT_LOG_RETRY_BACKOFF = float(os.getenv("AUDIT_LOG_RETRY_BACKOFF", "0.5"))  # Seconds
+
+
+class AuditLogBuffer(BatchingQueue):
+    """Buffer các audit log records và flush theo batch bằng một consumer coroutine"""
+    
+    def __init__(self):
+        super().__init__(
+            "Audit log buffer",
+            self._flush,
+            batch_size=AUDIT_LOG_BATCH_SIZE,
+            flush_interval=AUDIT_LOG_FLUSH_INTERVAL,
+            max_pending=AUDIT_LOG_MAX_PENDING
+        )
+    
+    def enqueue(self, record: Dict[str, Any]) -> bool:
+        """
+        Thêm audit log record (các cột của APIKeyAuditLog) vào buffer
+        
+        Returns:
+            False nếu buffer chưa chạy hoặc đã đầy (caller tự ghi trực tiếp)
+        """
+        # created_at lấy lúc request xảy ra, không phải lúc flush
+        record.setdefault("created_at", datetime.utcnow())
+        return self.put(record)
+    
+    async def _flush(self, batch: List[Dict[str, Any]]):
+        """
+        Ghi cả batch bằng một multi-row INSERT (chạy trên thread để không block event loop)
+        Lỗi: thử lại tối đa AUDIT_LOG_FLUSH_RETRIES lần, sau đó INSERT từng row và chỉ bỏ rows lỗi
+        """
+        if not batch:
+            return
+        cancelled = False
+        for attempt in range(AUDIT_LOG_FLUSH_RETRIES + 1):
+            try:
+                await asyncio.to_thread(self._insert_batch, batch)
+                return
+            except (IntegrityError, DataError) as e:
+                # Lỗi do dữ liệu của một vài rows: thử lại cả batch cũng lỗi y vậy
+                logger.warning(f"Audit log buffer flush failed ({len(batch)} records): {e}")
+                break
+            except Exception as e:
+                logger.warning(
+                    f"Audit log buffer flush failed ({len(batch)} records, attempt {attempt + 1}): {e}"
+                )
+            if attempt < AUDIT_LOG_FLUSH_RETRIES:
+                try:
+                    await asyncio.sleep(AUDIT_LOG_RETRY_BACKOFF * (2 ** attempt))
+                except asyncio.CancelledError:
+                    # Buffer đang dừng: không chờ retry nữa nhưng vẫn cố ghi batch
+                    cancelled = True
+                    break
+        
+        dropped = await asyncio.to_thread(self._insert_rows, batch)
+        if dropped:
+            logger.error(f"Audit log buffer dropped {dropped}/{len(batch)} records")
+            if METRICS_AVAILABLE and metrics_service:
+                metrics_service.record_error("audit_log_dropped", "audit_log_buffer", count=dropped)
+        if cancelled:
+            raise asyncio.CancelledError()
+    
+    @staticmethod
+    def _insert_batch(batch: List[Dict[str, Any]]):
+        """INSERT executemany (SQLAlchemy gộp thành multi-row VALUES) + một commit; lỗi thì raise"""
+        from sqlalchemy import insert
+        from config.app_config import SessionLocal
+        from models import APIKeyAuditLog
+
+        db = SessionLocal()
+        try:
+            db.execute(insert(APIKeyAuditLog), batch)
+            db.commit()
+            logger.debug(f"Audit log buffer flush: {len(batch)} records")
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    
+    @staticmethod
+    def _insert_rows(batch: List[Dict[str, Any]]) -> int:
+        """INSERT + commit từng row (một row lỗi không kéo theo cả batch); trả về số rows bị bỏ"""
+        from sqlalchemy import insert
+        from config.app_config import SessionLocal
+        from models import APIKeyAuditLog
+
+        dropped = 0
+        db = SessionLocal()
+        try:
+            for record in batch:
+                try:
+                    db.execute(insert(APIKeyAuditLog), record)
+                    db.commit()
+                except Exception as e:
+                    db.rollback()
+                    dropped += 1
+                    logger.debug(f"Audit log record dropped: {e}")
+        finally:
+            db.close()
+        return dropped
+
+
+# Global instance
+audit_log_buffer = AuditLogBuffer()
@@ -0,0 +1,126 @@
+"""
+Batching Queue
+Base class cho các buffers gom items vào asyncio.Queue và flush theo batch bằng một
+consumer coroutine (chờ item đầu tiên, gom thêm trong flush_interval hoặc tới batch_size)
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BatchingQueue:
+    """Queue + consumer coroutine gọi flush(batch) cho tối đa batch_size items mỗi lần"""
+    
+    def __init__(
+        self,
+        name: str,
+        flush: Callable[[List[Any]], Awaitable[None]],
+        batch_size: int,
+        flush_interval: float,
+        max_pending: int
+    ):
+        self.name = name
+        self.flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        # flush(batch) đang chạy: stop() chờ nó xong thay vì cancel giữa chừng
+        self.flushing: Optional[asyncio.Future] = None
+        self.running = False
+    
+    async def start(self):
+        """Bắt đầu consumer coroutine"""
+        if self.running:
+            logger.warning(f"{self.name} already running")
+            return
+        
+        self.queue = asyncio.Queue(maxsize=self.max_pending)
+        self.running = True
+        self.task = asyncio.create_task(self._run())
+        logger.info(f"{self.name} started")
+    
+    async def stop(self):
+        """Dừng consumer và flush các items còn lại"""
+        self.running = False
+        if self.task:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        
+        # Flush phần còn lại trong queue trước khi tắt
+        if self.queue is not None:
+            while not self.queue.empty():
+                await self.flush(self._drain(self.batch_size))
+        logger.info(f"{self.name} stopped")
+    
+    def put(self, item: Any) -> bool:
+        """
+        Thêm item vào queue (không chờ)
+        
+        Returns:
+            False nếu queue chưa chạy hoặc đã đầy (caller tự fallback)
+        """
+        if not self.running or self.queue is None:
+            return False
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except asyncio.QueueFull:
+            logger.warning(f"{self.name} full, item not buffered")
+            return False
+    
+    def _drain(self, max_items: int) -> List[Any]:
+        """Lấy tối đa max_items đang có trong queue (không chờ)"""
+        items = []
+        while len(items) < max_items:
+            try:
+                items.append(self.queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        return items
+    
+    async def _run(self):
+        """Chờ item đầu tiên, gom thêm trong flush_interval rồi flush cả batch"""
+        loop = asyncio.get_running_loop()
+        while self.running:
+            batch = []
+            try:
+                batch.append(await self.queue.get())
+                deadline = loop.time() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    # Lấy hết những gì đã có sẵn trước khi phải chờ
+                    batch.extend(self._drain(self.batch_size - len(batch)))
+                    if len(batch) >= self.batch_size:
+                        break
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self.queue.get(), timeout=timeout))
+                    except asyncio.TimeoutError:
+                        break
+                # Clear trước khi await: cancel trong lúc flush không flush lại cùng batch
+                items, batch = batch, []
+                self.flushing = asyncio.ensure_future(self.flush(items))
+                # Shield: cancel (stop) không cắt ngang batch đang ghi
+                await asyncio.shield(self.flushing)
+                self.flushing = None
+            except asyncio.CancelledError:
+                if self.flushing is not None:
+                    try:
+                        await self.flushing
+                    except Exception as e:
+                        logger.error(f"Error in {self.name}: {e}")
+                    self.flushing = None
+                # Items đã lấy khỏi queue nhưng chưa flush -> flush trước khi dừng
+                await self.flush(batch)
+                break
+            except Exception as e:
+                self.flushing = None
+                logger.error(f"Error in {self.name}: {e}")
@@ -3,14 +3,97 @@ Cache components and utilities.
 This module contains cache data structures, enums, and the LRU cache implementation
 used by the advanced cache service.
 """
+import hashlib
+import json
 import threading
-from typing import Optional, Any, List, Tuple
-from datetime import datetime, timedelta
+import time
+from typing import Optional, Any, Callable, List, Tuple
 from collections import OrderedDict
-from dataclasses import dataclass
 from enum import Enum
 
 
+# Keys dài hơn giới hạn này được thay bằng prefix + hash
+MAX_CACHE_KEY_LENGTH = 200
+
+# orjson serialize dict/list args nhanh hơn json stdlib nhiều lần (optional)
+try:
+    import orjson
+    
+    def _key_dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS).decode()
+except ImportError:
+    def _key_dumps(obj: Any) -> str:
+        return json.dumps(obj, sort_keys=True)
+
+
+def _hashed_key(prefix: str, key_parts: List[str]) -> str:
+    """prefix:<blake2b-128 hex> của ":".join(key_parts), hash từng phần không nối string"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(key_parts[0].encode())
+    for part in key_parts[1:]:
+        h.update(b":")
+        h.update(part.encode())
+    return f"{prefix}:{h.hexdigest()}"
+
+
+def build_cache_key(prefix: str, args: Tuple[Any, ...], kwargs: dict) -> str:
+    """
+    Cache key "prefix:arg1:arg2:..." (dict/list/kwargs serialize JSON sort_keys)
+    Key dài hơn MAX_CACHE_KEY_LENGTH thành "prefix:<blake2b-128 hex>", hash từng phần
+    bằng update() thay vì nối thành một string lớn trước
+    """
+    # Fast path: một string arg (embedding lookups), không tạo list / JSON
+    if not kwargs and len(args) == 1 and isinstance(args[0], str):
+        arg = args[0]
+        if len(prefix) + 1 + len(arg) > MAX_CACHE_KEY_LENGTH:
+            return _hashed_key(prefix, [prefix, arg])
+        return f"{prefix}:{arg}"
+    
+    key_parts = [prefix]
+    
+    for arg in args:
+        if isinstance(arg, (dict, list)):
+            key_parts.append(_key_dumps(arg))
+        else:
+            key_parts.append(str(arg))
+    
+    if kwargs:
+        sorted_kwargs = sorted(kwargs.items())
+        key_parts.append(_key_dumps(sorted_kwargs))
+    
+    # Độ dài của ":".join(key_parts) tính không cần tạo string
+    if sum(map(len, key_parts)) + len(key_parts) - 1 > MAX_CACHE_KEY_LENGTH:
+        return _hashed_key(prefix, key_parts)
+    
+    return ":".join(key_parts)
+
+
+def build_llm_response_key(prefix: str, user_message: str, conversation_history: Optional[list],
+                           system_prompt: Optional[str], temperature: float) -> str:
+    """
+    Key cho LLM response (gọi mỗi chatbot request), cùng kết quả với
+    build_cache_key(prefix, (user_message, conversation_history, system_prompt, temperature), {})
+    nhưng không qua vòng lặp/isinstance tổng quát; key dài thì hash thẳng các phần bằng blake2b
+    """
+    if isinstance(conversation_history, (dict, list)):
+        history_part = _key_dumps(conversation_history)
+    else:
+        history_part = str(conversation_history)
+    message_part = str(user_message)
+    prompt_part = str(system_prompt)
+    temperature_part = str(temperature)
+    
+    length = (len(prefix) + len(message_part) + len(history_part)
+              + len(prompt_part) + len(temperature_part) + 4)
+    if length > MAX_CACHE_KEY_LENGTH:
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{prefix}:{message_part}:".encode())
+        h.update(history_part.encode())
+        h.update(f":{prompt_part}:{temperature_part}".encode())
+        return f"{prefix}:{h.hexdigest()}"
+    return f"{prefix}:{message_part}:{history_part}:{prompt_part}:{temperature_part}"
+
+
 class CacheLevel(Enum):
     """Cache level enumeration"""
     L1 = "l1"  # In-memory
@@ -18,60 +101,126 @@ class CacheLevel(Enum):
     L3 = "l3"  # Database
 
 
-@dataclass
 class CacheEntry:
-    """Cache entry metadata"""
-    key: str
-    value: Any
-    created_at: datetime
-    expires_at: datetime
-    access_count: int = 0
-    last_accessed: datetime = None
-    cache_type: str = "generic"
-    ttl: int = None
-    
-    def __post_init__(self):
-        if self.last_accessed is None:
-            self.last_accessed = self.created_at
-
-
-@dataclass
+    """
+    Cache entry metadata (__slots__: không có __dict__ mỗi entry)
+    Thời điểm tính bằng time.monotonic() (float) để so sánh hết hạn rẻ hơn datetime
+    Value được giữ nguyên reference, không copy
+    """
+    __slots__ = ("key", "value", "created_at", "expires_at", "access_count",
+                 "last_accessed", "cache_type", "ttl")
+    
+    def __init__(self, key: str, value: Any, created_at: float, expires_at: float,
+                 access_count: int = 0, last_accessed: Optional[float] = None,
+                 cache_type: str = "generic", ttl: Optional[int] = None):
+        self.key = key
+        self.value = value
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.access_count = access_count
+        self.last_accessed = created_at if last_accessed is None else last_accessed
+        self.cache_type = cache_type
+        self.ttl = ttl
+
+
 class CacheStats:
-    """Cache statistics"""
-    hits: int = 0
-    misses: int = 0
-    sets: int = 0
-    evictions: int = 0
-    l1_hits: int = 0
-    l2_hits: int = 0
-    l3_hits: int = 0
-    l1_misses: int = 0
-    l2_misses: int = 0
-    l3_misses: int = 0
+    """
+    Cache statistics
+    Counters là int thường tăng bằng += không lock: thỉnh thoảng mất một increment khi
+    tranh chấp giữa các threads là chấp nhận được với số liệu thống kê
+    """
+    __slots__ = (
+        "hits", "misses", "sets", "evictions",
+        "l1_hits", "l2_hits", "l3_hits",
+        "l1_misses", "l2_misses", "l3_misses",
+        "negative_hits",
+    )
+    
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
     
     def get_hit_rate(self) -> float:
         total = self.hits + self.misses
         return self.hits / total if total > 0 else 0.0
 
 
+class NegativeLookupFilter:
+    """
+    Counting Bloom filter các keys vừa miss ở mọi level (không dependency ngoài)
+    Key có trong filter -> bỏ qua round trip L2/L3. False positive ~ error rate của filter,
+    chỉ làm một lookup trả về miss sớm; toàn bộ filter reset sau `ttl` giây để keys do
+    process khác ghi không bị coi là miss quá lâu
+    """
+    NUM_HASHES = 3
+    
+    def __init__(self, size: int = 1 << 17, ttl: float = 30.0):
+        self.size = size
+        self.ttl = ttl
+        self._counters = bytearray(size)
+        self._reset_at = time.monotonic() + ttl
+        self.lock = threading.Lock()
+    
+    def _indices(self, key: str) -> List[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=8 * self.NUM_HASHES).digest()
+        return [
+            int.from_bytes(digest[i * 8:(i + 1) * 8], "little") % self.size
+            for i in range(self.NUM_HASHES)
+        ]
+    
+    def _maybe_reset(self) -> None:
+        now = time.monotonic()
+        if now >= self._reset_at:
+            self._counters = bytearray(self.size)
+            self._reset_at = now + self.ttl
+    
+    def __contains__(self, key: str) -> bool:
+        indices = self._indices(key)
+        with self.lock:
+            self._maybe_reset()
+            counters = self._counters
+            return all(counters[i] for i in indices)
+    
+    def add(self, key: str) -> None:
+        """Ghi nhận key vừa miss"""
+        indices = self._indices(key)
+        with self.lock:
+            self._maybe_reset()
+            counters = self._counters
+            for i in indices:
+                if counters[i] < 255:
+                    counters[i] += 1
+    
+    def discard(self, key: str) -> None:
+        """Bỏ key khỏi filter (khi key được set)"""
+        indices = self._indices(key)
+        with self.lock:
+            counters = self._counters
+            if all(counters[i] for i in indices):
+                for i in indices:
+                    # Counter bão hòa (255) không giảm để không tạo false negative cho keys khác
+                    if counters[i] < 255:
+                        counters[i] -= 1
+
+
 class LRUCache:
     """LRU Cache implementation for L1"""
     
     def __init__(self, max_size: int = 1000):
         self.max_size = max_size
         self.cache: OrderedDict[str, CacheEntry] = OrderedDict()
-        self.lock = threading.RLock()
+        self.lock = threading.Lock()  # Không có method nào gọi lồng nhau khi giữ lock
     
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache"""
         with self.lock:
-            if key not in self.cache:
+            entry = self.cache.get(key)
+            if entry is None:
                 return None
             
-            entry = self.cache[key]
-            
             # Check expiration
-            if datetime.now() > entry.expires_at:
+            now = time.monotonic()
+            if now > entry.expires_at:
                 del self.cache[key]
                 return None
             
@@ -80,7 +229,7 @@ class LRUCache:
             
             # Update access stats
             entry.access_count += 1
-            entry.last_accessed = datetime.now()
+            entry.last_accessed = now
             
             return entry.value
     
@@ -98,12 +247,12 @@ class LRUCache:
                 del self.cache[oldest_key]
             
             # Add new entry
-            expires_at = datetime.now() + timedelta(seconds=ttl)
+            now = time.monotonic()
             entry = CacheEntry(
                 key=key,
                 value=value,
-                created_at=datetime.now(),
-                expires_at=expires_at,
+                created_at=now,
+                expires_at=now + ttl,
                 cache_type=cache_type,
                 ttl=ttl
             )
@@ -119,6 +268,15 @@ class LRUCache:
                 return True
             return False
     
+    def delete_many(self, predicate: Callable[[str], bool]) -> int:
+        """Delete mọi key thỏa predicate, giữ lock một lần cho cả lượt duyệt"""
+        with self.lock:
+            cache = self.cache
+            matched = [key for key in cache if predicate(key)]
+            for key in matched:
+                del cache[key]
+            return len(matched)
+    
     def clear(self) -> int:
         """Clear all entries"""
         with self.lock:
@@ -130,8 +288,70 @@ class LRUCache:
         """Get current cache size"""
         return len(self.cache)
     
+    def next_expiry(self, min_access_count: int) -> Optional[float]:
+        """Thời điểm hết hạn (monotonic) sớm nhất trong các entries có access_count >= min_access_count"""
+        with self.lock:
+            expiries = [
+                entry.expires_at for entry in self.cache.values()
+                if entry.access_count >= min_access_count
+            ]
+        return min(expiries) if expiries else None
+    
     def get_access_stats(self) -> List[Tuple[str, int]]:
         """Get access statistics sorted by access count"""
         with self.lock:
             stats = [(key, entry.access_count) for key, entry in self.cache.items()]
-            return sorted(stats, key=lambda x: x[1], reverse=True)
\ No newline at end of file
+            return sorted(stats, key=lambda x: x[1], reverse=True)
+
+class ShardedLRUCache:
+    """
+    L1 chia thành nhiều LRUCache shards theo hash(key), mỗi shard có lock riêng
+    nên các threads truy cập keys khác nhau ít tranh chấp lock; LRU eviction tính theo từng shard
+    """
+    
+    def __init__(self, max_size: int = 1000, num_shards: int = 16):
+        # Số shards làm tròn lên lũy thừa của 2 để chọn shard bằng bitmask
+        num_shards = 1 << max(0, (max(1, num_shards) - 1).bit_length())
+        self.max_size = max_size
+        self.shards = [LRUCache(max_size=max(1, -(-max_size // num_shards))) for _ in range(num_shards)]
+        self._mask = num_shards - 1
+    
+    def _shard(self, key: str) -> LRUCache:
+        return self.shards[hash(key) & self._mask]
+    
+    def get(self, key: str) -> Optional[Any]:
+        """Get value from cache"""
+        return self._shard(key).get(key)
+    
+    def set(self, key: str, value: Any, ttl: int, cache_type: str = "generic") -> bool:
+        """Set value in cache"""
+        return self._shard(key).set(key, value, ttl, cache_type)
+    
+    def delete(self, key: str) -> bool:
+        """Delete key from cache"""
+        return self._shard(key).delete(key)
+    
+    def delete_many(self, predicate: Callable[[str], bool]) -> int:
+        """Delete mọi key thỏa predicate (từng shard một)"""
+        return sum(shard.delete_many(predicate) for shard in self.shards)
+    
+    def clear(self) -> int:
+        """Clear all entries"""
+        return sum(shard.clear() for shard in self.shards)
+    
+    def size(self) -> int:
+        """Get current cache size"""
+        return sum(shard.size() for shard in self.shards)
+    
+    def next_expiry(self, min_access_count: int) -> Optional[float]:
+        """Thời điểm hết hạn (monotonic) sớm nhất của hot entries trên mọi shard"""
+        expiries = [
+            expiry for expiry in (shard.next_expiry(min_access_count) for shard in self.shards)
+            if expiry is not None
+        ]
+        return min(expiries) if expiries else None
+    
+    def get_access_stats(self) -> List[Tuple[str, int]]:
+        """Get access statistics sorted by access count"""
+        stats = [item for shard in self.shards for item in shard.get_access_stats()]
+        return sorted(stats, key=lambda x: x[1], reverse=True)
@@ -5,24 +5,123 @@ and convenience methods for specific cache types.
 """
 import json
 import logging
+import os
 import time
-from typing import Optional, Any, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Any, Dict, List, Tuple, Union
 from datetime import datetime, timedelta
 
-from .cache_components import CacheLevel
+import numpy as np
+
+from .cache_components import CacheLevel, build_llm_response_key
 
 logger = logging.getLogger(__name__)
 
+# L2 values: orjson parse thẳng từ raw bytes của Redis, không qua decode utf-8 (optional)
+try:
+    import orjson
+    
+    def _json_dumps(value: Any) -> bytes:
+        return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    
+    _json_loads = orjson.loads
+except ImportError:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+# msgpack nhỏ hơn JSON ~2x cho payload số (optional, không có thì ghi JSON)
+try:
+    import msgpack
+    MSGPACK_AVAILABLE = True
+except ImportError:
+    MSGPACK_AVAILABLE = False
+
+# Byte đầu của value trong L2 cho biết format; JSON cũ (không có prefix) vẫn đọc được
+_L2_FORMAT_MSGPACK = b"\x01"
+_L2_FORMAT_FLOAT32 = b"\x02"  # Vector float32 little-endian (embeddings), đọc ra list
+_L2_FORMAT_NDARRAY = b"\x03"  # np.ndarray float32 1-D, đọc ra ndarray (np.frombuffer, không copy)
+# Chỉ embeddings (list float dài ít nhất ngần này) được lưu dạng float32 bytes (nhỏ hơn JSON ~6x);
+# list float của cache type khác giữ nguyên độ chính xác (msgpack/JSON)
+_L2_VECTOR_CACHE_TYPE = "embedding"
+_L2_VECTOR_MIN_LENGTH = 16
+
+
+# Ghi L2 khi promote từ L3 chạy nền (fire-and-forget), request không chờ thêm một Redis RTT
+L2_PROMOTION_WORKERS = int(os.getenv("L2_PROMOTION_WORKERS", "2"))
+_l2_promotion_executor = (
+    ThreadPoolExecutor(max_workers=L2_PROMOTION_WORKERS, thread_name_prefix="l2-promote")
+    if L2_PROMOTION_WORKERS > 0 else None
+)
+
+
+class EncodedL2Value(bytes):
+    """Payload L2 đã serialize sẵn (ví dụ JSON text của L3), ghi thẳng không encode lại"""
+    __slots__ = ()
+
+
+def _is_float_vector(value: Any, cache_type: str) -> bool:
+    return (cache_type == _L2_VECTOR_CACHE_TYPE and type(value) is list
+            and len(value) >= _L2_VECTOR_MIN_LENGTH and all(type(x) is float for x in value))
+
+
+def _json_default(value: Any) -> Any:
+    """json.dumps hook: np.ndarray (embeddings trong L1) -> list cho L3"""
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _as_embedding_list(value: Any) -> Any:
+    """Embedding trong cache có thể là ndarray float32; API embedding trả về list"""
+    return value.tolist() if isinstance(value, np.ndarray) else value
+
+
+def _l2_payload(value: Any, raw_json: Optional[str], cache_type: str = "generic") -> EncodedL2Value:
+    """
+    Payload để ghi L2 khi promote từ L3 (đã encode theo cache_type): dùng lại JSON text của L3
+    (L2 vẫn đọc được JSON), trừ embeddings vì float32 bytes nhỏ hơn nhiều
+    """
+    if raw_json is None or _is_float_vector(value, cache_type):
+        return EncodedL2Value(_l2_dumps(value, cache_type))
+    return EncodedL2Value(raw_json.encode())
+
+
+def _l2_dumps(value: Any, cache_type: str = "generic") -> bytes:
+    """Serialize value cho L2: ndarray / embeddings -> float32 bytes, còn lại msgpack (hoặc JSON)"""
+    if type(value) is EncodedL2Value:
+        return value
+    if type(value) is np.ndarray and value.ndim == 1 and value.dtype == np.float32:
+        return _L2_FORMAT_NDARRAY + value.astype("<f4", copy=False).tobytes()
+    if _is_float_vector(value, cache_type):
+        return _L2_FORMAT_FLOAT32 + np.asarray(value, dtype="<f4").tobytes()
+    if MSGPACK_AVAILABLE:
+        try:
+            return _L2_FORMAT_MSGPACK + msgpack.packb(value, use_bin_type=True)
+        except (TypeError, ValueError, OverflowError):
+            pass
+    return _json_dumps(value)
+
+
+def _l2_loads(data: bytes) -> Any:
+    """Deserialize value từ L2 theo prefix format"""
+    prefix = data[:1]
+    if prefix == _L2_FORMAT_NDARRAY:
+        return np.frombuffer(data, dtype="<f4", offset=1)
+    if prefix == _L2_FORMAT_FLOAT32:
+        return np.frombuffer(data, dtype="<f4", offset=1).tolist()
+    if prefix == _L2_FORMAT_MSGPACK:
+        return msgpack.unpackb(data[1:], raw=False, strict_map_key=False)
+    return _json_loads(data)
+
 
 class CacheOperations:
     """Operations for L2 (Redis) and L3 (Database) cache levels"""
     
     @staticmethod
-    def set_to_l2(redis_client, key: str, value: Any, ttl: int) -> bool:
+    def set_to_l2(redis_client, key: str, value: Any, ttl: int, cache_type: str = "generic") -> bool:
         """Set value in L2 (Redis)"""
         try:
-            value_json = json.dumps(value)
-            redis_client.setex(key, ttl, value_json)
+            redis_client.setex(key, ttl, _l2_dumps(value, cache_type))
             return True
         except Exception as e:
             logger.warning(f"L2 cache set error for key {key}: {e}")
@@ -34,12 +133,78 @@ class CacheOperations:
         try:
             cached_data = redis_client.get(key)
             if cached_data:
-                return json.loads(cached_data)
+                return _l2_loads(cached_data)
             return None
         except Exception as e:
             logger.warning(f"L2 cache get error for key {key}: {e}")
             return None
     
+    @staticmethod
+    def get_from_l2_many(redis_client, keys: List[str]) -> Dict[str, Any]:
+        """Get nhiều keys từ L2 trong một round trip (pipeline); chỉ trả về keys có trong cache"""
+        if not keys:
+            return {}
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(key)
+            found = {}
+            for key, cached_data in zip(keys, pipe.execute()):
+                if cached_data:
+                    found[key] = _l2_loads(cached_data)
+            return found
+        except Exception as e:
+            logger.warning(f"L2 cache get_many error ({len(keys)} keys): {e}")
+            return {}
+    
+    @staticmethod
+    def set_to_l2_many(redis_client, items: List[Tuple[str, Any, int]], cache_type: str = "generic") -> bool:
+        """Set nhiều (key, value, ttl) cùng cache_type vào L2 trong một round trip (pipeline)"""
+        if not items:
+            return True
+        try:
+            pipe = redis_client.pipeline(transaction=False)
+            for key, value, ttl in items:
+                pipe.setex(key, ttl, _l2_dumps(value, cache_type))
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.warning(f"L2 cache set_many error ({len(items)} keys): {e}")
+            return False
+    
+    @staticmethod
+    def l2_payload(value: Any, raw_json: Optional[str], cache_type: str = "generic") -> EncodedL2Value:
+        """Payload ghi L2 khi promote từ L3 (JSON text của L3 nếu dùng lại được)"""
+        return _l2_payload(value, raw_json, cache_type)
+    
+    @staticmethod
+    def promote_to_l2_async(redis_client, items: List[Tuple[str, EncodedL2Value, int]]) -> None:
+        """Ghi (key, payload l2_payload, ttl) lên L2 bằng pipeline trên thread nền; không có executor thì ghi đồng bộ"""
+        if not items:
+            return
+        if _l2_promotion_executor is None:
+            CacheOperations.set_to_l2_many(redis_client, items)
+            return
+        try:
+            _l2_promotion_executor.submit(CacheOperations.set_to_l2_many, redis_client, items)
+        except RuntimeError:
+            # Executor đã shutdown (process đang tắt)
+            CacheOperations.set_to_l2_many(redis_client, items)
+    
+    @staticmethod
+    def promote_to_l1_l2(redis_client, l1_cache, key: str, value: Any,
+                         ttl_l1: int, ttl_l2: int, cache_type: str,
+                         raw_json: Optional[str] = None) -> None:
+        """
+        Promote value vừa đọc từ L3: set L1 đồng bộ, L2 ghi nền (redis_client None -> bỏ qua L2)
+        raw_json: JSON text gốc của L3, ghi thẳng lên L2 không serialize lại
+        """
+        l1_cache.set(key, value, ttl_l1, cache_type)
+        if redis_client is not None:
+            CacheOperations.promote_to_l2_async(
+                redis_client, [(key, _l2_payload(value, raw_json, cache_type), ttl_l2)]
+            )
+    
     @staticmethod
     def delete_from_l2(redis_client, key: str) -> bool:
         """Delete key from L2 (Redis)"""
@@ -51,14 +216,34 @@ class CacheOperations:
             return False
     
     @staticmethod
-    def invalidate_pattern_l2(redis_client, pattern: str) -> int:
-        """Invalidate cache entries matching pattern in L2"""
+    def invalidate_pattern_l2(redis_client, pattern: str, flushdb_allowed: bool = False,
+                              batch_size: int = 500) -> int:
+        """
+        Invalidate cache entries matching pattern in L2
+        Dùng SCAN + UNLINK theo batch (không dùng KEYS, không block Redis).
+        Pattern "*" dùng FLUSHDB ASYNC nếu Redis DB chỉ dành cho cache (flushdb_allowed).
+        """
         try:
-            keys = redis_client.keys(f"*{pattern}*")
-            if keys:
-                deleted = redis_client.delete(*keys)
+            if pattern == "*" and flushdb_allowed:
+                pipe = redis_client.pipeline(transaction=False)
+                pipe.dbsize()
+                pipe.flushdb(asynchronous=True)
+                deleted, _ = pipe.execute()
                 return deleted
-            return 0
+            
+            match = "*" if pattern == "*" else f"*{pattern}*"
+            deleted = 0
+            pipe = redis_client.pipeline(transaction=False)
+            pending = 0
+            for key in redis_client.scan_iter(match=match, count=batch_size):
+                pipe.unlink(key)
+                pending += 1
+                if pending >= batch_size:
+                    deleted += sum(pipe.execute())
+                    pending = 0
+            if pending:
+                deleted += sum(pipe.execute())
+            return deleted
         except Exception as e:
             logger.warning(f"L2 cache invalidate_pattern error: {e}")
             return 0
@@ -70,7 +255,7 @@ class CacheOperations:
             from models import CacheEntry as CacheEntryModel
             
             expires_at = datetime.now() + timedelta(seconds=ttl)
-            value_json = json.dumps(value)
+            value_json = json.dumps(value, default=_json_default)
             
             # Check if entry exists
             existing = db_session.query(CacheEntryModel).filter(
@@ -107,6 +292,11 @@ class CacheOperations:
     @staticmethod
     def get_from_l3(db_session, key: str) -> Optional[Any]:
         """Get value from L3 (Database)"""
+        return CacheOperations.get_from_l3_with_raw(db_session, key)[0]
+    
+    @staticmethod
+    def get_from_l3_with_raw(db_session, key: str) -> Tuple[Optional[Any], Optional[str]]:
+        """Get (value, JSON text gốc) from L3; miss -> (None, None)"""
         try:
             from models import CacheEntry as CacheEntryModel
             
@@ -121,15 +311,15 @@ class CacheOperations:
                 entry.last_accessed = datetime.now()
                 db_session.commit()
                 
-                return json.loads(entry.cache_value)
+                return json.loads(entry.cache_value), entry.cache_value
             
-            return None
+            return None, None
         except ImportError:
             logger.warning("CacheEntry model not found. L3 cache disabled. Run migration to enable.")
-            return None
+            return None, None
         except Exception as e:
             logger.error(f"L3 cache get error for key {key}: {e}")
-            return None
+            return None, None
     
     @staticmethod
     def delete_from_l3(db_session, key: str) -> bool:
@@ -154,9 +344,10 @@ class CacheOperations:
         try:
             from models import CacheEntry as CacheEntryModel
             
-            deleted = db_session.query(CacheEntryModel).filter(
-                CacheEntryModel.cache_key.like(f"%{pattern}%")
-            ).delete(synchronize_session=False)
+            query = db_session.query(CacheEntryModel)
+            if pattern != "*":
+                query = query.filter(CacheEntryModel.cache_key.like(f"%{pattern}%"))
+            deleted = query.delete(synchronize_session=False)
             db_session.commit()
             return deleted
         except ImportError:
@@ -185,18 +376,25 @@ class CacheOperations:
             ).limit(warming_top_n).all()
             
             warmed_count = 0
+            l2_items = []
             for item in top_items:
                 try:
                     value = json.loads(item.cache_value)
-                    # Promote to L1 and L2
+                    # Promote to L1; L2 gom lại ghi một lần bằng pipeline
                     l1_cache.set(item.cache_key, value, l1_default_ttl, item.cache_type)
                     if l2_enabled:
-                        CacheOperations.set_to_l2(redis_client, item.cache_key, value, l2_default_ttl)
+                        l2_items.append(
+                            (item.cache_key, _l2_payload(value, item.cache_value, item.cache_type),
+                             l2_default_ttl)
+                        )
                     
                     warmed_count += 1
                 except Exception as e:
                     logger.warning(f"Error warming cache for key {item.cache_key}: {e}")
             
+            if l2_items:
+                CacheOperations.set_to_l2_many(redis_client, l2_items)
+            
             if warmed_count > 0:
                 logger.info(f"Cache warmed: {warmed_count} items promoted to L1/L2")
             
@@ -223,23 +421,45 @@ class CacheConvenienceMethods:
     
     def get_llm_response_key(self, user_message: str, conversation_history: Optional[list] = None,
                              system_prompt: Optional[str] = None, temperature: float = 0.7) -> str:
-        """Generate cache key for LLM response"""
-        return self.cache_service._generate_key("llm_response", user_message, conversation_history,
-                                                 system_prompt, temperature)
+        """Generate cache key for LLM response (giống _generate_key, đường riêng cho hot path)"""
+        return build_llm_response_key("llm_response", user_message, conversation_history,
+                                      system_prompt, temperature)
     
     def get_pattern_analysis_key(self, session_id: str, limit: int = 10) -> str:
         """Generate cache key for pattern analysis"""
         return self.cache_service._generate_key("pattern_analysis", session_id, limit)
     
-    def cache_embedding(self, text: str, embedding: list, ttl: Optional[int] = None) -> bool:
-        """Cache embedding result"""
+    def cache_embedding(self, text: str, embedding: Union[list, np.ndarray],
+                        ttl: Optional[int] = None) -> bool:
+        """Cache embedding result (lưu ndarray float32: ~6x nhỏ hơn list trong L1, L2 ghi raw bytes)"""
         key = self.get_embedding_key(text)
-        return self.cache_service.set(key, embedding, ttl, cache_type="embedding")
+        return self.cache_service.set(key, np.asarray(embedding, dtype=np.float32), ttl,
+                                      cache_type="embedding")
     
-    def get_cached_embedding(self, text: str) -> Optional[list]:
-        """Get cached embedding"""
+    def get_cached_embedding(self, text: str, as_array: bool = False) -> Optional[Union[list, np.ndarray]]:
+        """Get cached embedding (as_array=True: ndarray float32 read-only, không tạo list)"""
         key = self.get_embedding_key(text)
-        return self.cache_service.get(key, cache_type="embedding")
+        value = self.cache_service.get(key, cache_type="embedding")
+        if value is None:
+            return None
+        return np.asarray(value, dtype=np.float32) if as_array else _as_embedding_list(value)
+    
+    def cache_embeddings(self, embeddings: Dict[str, Union[list, np.ndarray]],
+                         ttl: Optional[int] = None) -> bool:
+        """Cache nhiều embeddings (text -> embedding) trong một lần ghi"""
+        items = {
+            self.get_embedding_key(text): np.asarray(embedding, dtype=np.float32)
+            for text, embedding in embeddings.items()
+        }
+        return self.cache_service.set_many(items, ttl, cache_type="embedding")
+    
+    def get_cached_embeddings(self, texts: List[str],
+                              as_array: bool = False) -> Dict[str, Union[list, np.ndarray]]:
+        """Get cached embeddings cho nhiều texts; chỉ trả về texts có trong cache"""
+        keys = {text: self.get_embedding_key(text) for text in texts}
+        found = self.cache_service.get_many(list(keys.values()), cache_type="embedding")
+        convert = (lambda v: np.asarray(v, dtype=np.float32)) if as_array else _as_embedding_list
+        return {text: convert(found[key]) for text, key in keys.items() if key in found}
     
     def cache_llm_response(self, user_message: str, response: str,
                           conversation_history: Optional[list] = None,
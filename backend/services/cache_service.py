@@ -5,11 +5,12 @@ Backward compatible wrapper around AdvancedCacheService
 """
 import os
 import json
-import hashlib
 import logging
-from typing import Optional, Any, Dict
+from typing import Optional, Any, Dict, List
 from dotenv import load_dotenv
 
+from .cache_components import build_cache_key, build_llm_response_key
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -132,28 +133,7 @@ class CacheService:
     
     def _generate_key(self, prefix: str, *args, **kwargs) -> str:
         """Generate cache key từ prefix và arguments"""
-        # Combine all arguments into a string
-        key_parts = [prefix]
-        
-        # Add positional arguments
-        for arg in args:
-            if isinstance(arg, (dict, list)):
-                key_parts.append(json.dumps(arg, sort_keys=True))
-            else:
-                key_parts.append(str(arg))
-        
-        # Add keyword arguments
-        if kwargs:
-            sorted_kwargs = sorted(kwargs.items())
-            key_parts.append(json.dumps(sorted_kwargs, sort_keys=True))
-        
-        # Create hash for long keys
-        key_string = ":".join(key_parts)
-        if len(key_string) > 200:  # Redis key length limit
-            key_hash = hashlib.md5(key_string.encode()).hexdigest()
-            return f"{prefix}:{key_hash}"
-        
-        return key_string
+        return build_cache_key(prefix, args, kwargs)
     
     def get(self, key: str) -> Optional[Any]:
         """Get value from cache"""
@@ -189,6 +169,40 @@ class CacheService:
             logger.warning(f"Cache set error for key {key}: {e}")
             return False
     
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """Get nhiều keys trong một round trip; chỉ trả về keys có trong cache"""
+        if not self.enabled or not keys:
+            return {}
+        
+        if self._use_advanced:
+            return self.advanced_cache.get_many(keys)
+        
+        try:
+            values = self.redis_client.mget(keys)
+            return {key: json.loads(value) for key, value in zip(keys, values) if value}
+        except Exception as e:
+            logger.warning(f"Cache get_many error ({len(keys)} keys): {e}")
+            return {}
+    
+    def set_many(self, items: Dict[str, Any], ttl: Optional[int] = None) -> bool:
+        """Set nhiều keys trong một round trip (pipeline)"""
+        if not self.enabled:
+            return False
+        
+        if self._use_advanced:
+            return self.advanced_cache.set_many(items, ttl)
+        
+        try:
+            ttl = ttl or REDIS_DEFAULT_TTL
+            pipe = self.redis_client.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.setex(key, ttl, json.dumps(value))
+            pipe.execute()
+            return True
+        except Exception as e:
+            logger.warning(f"Cache set_many error ({len(items)} keys): {e}")
+            return False
+    
     def delete(self, key: str) -> bool:
         """Delete key from cache"""
         if not self.enabled:
@@ -211,8 +225,8 @@ class CacheService:
     def get_llm_response_key(self, user_message: str, conversation_history: Optional[list] = None, 
                              system_prompt: Optional[str] = None, temperature: float = 0.7) -> str:
         """Generate cache key for LLM response"""
-        return self._generate_key("llm_response", user_message, conversation_history, 
-                                  system_prompt, temperature)
+        return build_llm_response_key("llm_response", user_message, conversation_history,
+                                      system_prompt, temperature)
     
     def get_pattern_analysis_key(self, session_id: str, limit: int = 10) -> str:
         """Generate cache key for pattern analysis"""
@@ -225,13 +239,27 @@ class CacheService:
         key = self.get_embedding_key(text)
         return self.set(key, embedding, ttl)
     
-    def get_cached_embedding(self, text: str) -> Optional[list]:
-        """Get cached embedding"""
+    def get_cached_embedding(self, text: str, as_array: bool = False) -> Optional[list]:
+        """Get cached embedding (as_array=True: ndarray float32 khi dùng advanced cache)"""
         if self._use_advanced:
-            return self.advanced_cache.get_cached_embedding(text)
+            return self.advanced_cache.get_cached_embedding(text, as_array)
         key = self.get_embedding_key(text)
         return self.get(key)
     
+    def cache_embeddings(self, embeddings: Dict[str, list], ttl: Optional[int] = None) -> bool:
+        """Cache nhiều embeddings (text -> embedding) trong một round trip"""
+        if self._use_advanced:
+            return self.advanced_cache.cache_embeddings(embeddings, ttl)
+        return self.set_many({self.get_embedding_key(text): emb for text, emb in embeddings.items()}, ttl)
+    
+    def get_cached_embeddings(self, texts: List[str], as_array: bool = False) -> Dict[str, list]:
+        """Get cached embeddings cho nhiều texts; chỉ trả về texts có trong cache"""
+        if self._use_advanced:
+            return self.advanced_cache.get_cached_embeddings(texts, as_array)
+        keys = {text: self.get_embedding_key(text) for text in texts}
+        found = self.get_many(list(keys.values()))
+        return {text: found[key] for text, key in keys.items() if key in found}
+    
     def cache_llm_response(self, user_message: str, response: str, 
                           conversation_history: Optional[list] = None,
                           system_prompt: Optional[str] = None,
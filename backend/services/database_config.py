@@ -4,7 +4,7 @@ Cung cấp cấu hình tối ưu cho database connection pooling, read replicas,
 """
 import os
 from typing import Optional, Dict, Any
-from sqlalchemy import create_engine, Engine
+from sqlalchemy import create_engine, Engine, event
 from sqlalchemy.pool import QueuePool
 import logging
 
@@ -31,15 +31,15 @@ class DatabaseConfig:
         # Connection pooling configuration
         # Pool size: số lượng connections giữ trong pool
         # Nên set = (2 * số CPU cores) + số disk spindles
-        self.pool_size = int(os.getenv("DB_POOL_SIZE", "10"))
+        self.pool_size = int(os.getenv("DB_POOL_SIZE", "20"))
         
         # Max overflow: số connections có thể vượt quá pool_size
         # Tổng max connections = pool_size + max_overflow
-        self.max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+        self.max_overflow = int(os.getenv("DB_MAX_OVERFLOW", "40"))
         
         # Pool recycle: thời gian (seconds) trước khi recycle connection
-        # Tránh stale connections, PostgreSQL thường timeout sau 1 giờ
-        self.pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+        # Tránh stale connections (firewall/pgbouncer thường cắt idle connection trước 1 giờ)
+        self.pool_recycle = int(os.getenv("DB_POOL_RECYCLE", "1800"))
         
         # Pool timeout: thời gian chờ khi lấy connection từ pool
         self.pool_timeout = int(os.getenv("DB_POOL_TIMEOUT", "30"))
@@ -47,6 +47,13 @@ class DatabaseConfig:
         # Pool pre ping: kiểm tra connection trước khi sử dụng
         self.pool_pre_ping = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
         
+        # Pool LIFO: tái sử dụng connection vừa trả về, giữ một nhóm nhỏ connections "nóng"
+        # khi tải dao động, để các connection thừa idle và được recycle
+        self.pool_use_lifo = os.getenv("DB_POOL_USE_LIFO", "true").lower() == "true"
+        
+        # Ngưỡng utilization (checked_out / (pool_size + max_overflow)) để health check cảnh báo
+        self.pool_utilization_warn = float(os.getenv("DB_POOL_UTILIZATION_WARN", "0.8"))
+        
         # Read replica configuration
         self.read_replica_host = os.getenv("DB_READ_REPLICA_HOST", None)
         self.read_replica_port = os.getenv("DB_READ_REPLICA_PORT", self.db_port)
@@ -62,6 +69,23 @@ class DatabaseConfig:
         
         # Application name cho PostgreSQL logging
         self.application_name = os.getenv("DB_APPLICATION_NAME", "ai_agent_backend")
+        
+        # auto_explain: PostgreSQL tự log execution plan của các query chậm hơn ngưỡng
+        # (không cần chạy lại query qua EXPLAIN ANALYZE). Cần quyền LOAD trên server.
+        self.auto_explain = os.getenv("DB_AUTO_EXPLAIN", "false").lower() == "true"
+        self.auto_explain_min_duration = int(os.getenv("DB_AUTO_EXPLAIN_MIN_DURATION_MS", "200"))
+        self.auto_explain_analyze = os.getenv("DB_AUTO_EXPLAIN_ANALYZE", "true").lower() == "true"
+        
+        # Driver: psycopg2 (mặc định) hoặc psycopg (psycopg3, hỗ trợ server-side prepared statements)
+        self.db_driver = os.getenv("DB_DRIVER", "psycopg2").lower()
+        
+        # Statement caching
+        # query_cache_size: LRU compiled cache của SQLAlchemy (tránh compile lại select/where giống nhau)
+        self.query_cache_size = int(os.getenv("DB_QUERY_CACHE_SIZE", "1200"))
+        # psycopg3: số lần chạy một query trước khi PREPARE trên server (bỏ trống = tắt,
+        # nên tắt nếu đi qua pgbouncer transaction mode). psycopg2 không hỗ trợ.
+        prepare_threshold = os.getenv("DB_PREPARE_THRESHOLD", "1")
+        self.prepare_threshold = int(prepare_threshold) if prepare_threshold.strip() else None
     
     def _build_connect_args(self) -> Dict[str, Any]:
         """Xây dựng connection arguments"""
@@ -83,6 +107,10 @@ class DatabaseConfig:
         if self.statement_timeout:
             connect_args["options"] = f"-c statement_timeout={self.statement_timeout}"
         
+        # Server-side prepared statements (PREPARE + EXECUTE) cho các query chạy lặp lại
+        if self.db_driver == "psycopg":
+            connect_args["prepare_threshold"] = self.prepare_threshold
+        
         return connect_args
     
     def _build_database_url(self, host: Optional[str] = None, port: Optional[str] = None,
@@ -95,7 +123,8 @@ class DatabaseConfig:
         user = user or self.db_user
         password = password or self.db_password
         
-        return f"postgresql://{user}:{password}@{host}:{port}/{name}"
+        driver = "postgresql+psycopg" if self.db_driver == "psycopg" else "postgresql"
+        return f"{driver}://{user}:{password}@{host}:{port}/{name}"
     
     def create_engine(self, use_read_replica: bool = False, **kwargs) -> Engine:
         """
@@ -125,6 +154,8 @@ class DatabaseConfig:
         pool_recycle = kwargs.get("pool_recycle", self.pool_recycle)
         pool_timeout = kwargs.get("pool_timeout", self.pool_timeout)
         pool_pre_ping = kwargs.get("pool_pre_ping", self.pool_pre_ping)
+        pool_use_lifo = kwargs.get("pool_use_lifo", self.pool_use_lifo)
+        query_cache_size = kwargs.get("query_cache_size", self.query_cache_size)
         
         # Tạo engine với connection pooling
         engine = create_engine(
@@ -135,14 +166,19 @@ class DatabaseConfig:
             pool_recycle=pool_recycle,
             pool_timeout=pool_timeout,
             pool_pre_ping=pool_pre_ping,
+            pool_use_lifo=pool_use_lifo,
+            query_cache_size=query_cache_size,
             echo=False,  # Set True để debug SQL queries
             connect_args=self._build_connect_args(),
             **{k: v for k, v in kwargs.items() if k not in [
                 "pool_size", "max_overflow", "pool_recycle", 
-                "pool_timeout", "pool_pre_ping"
+                "pool_timeout", "pool_pre_ping", "pool_use_lifo", "query_cache_size"
             ]}
         )
         
+        if self.auto_explain:
+            self._register_auto_explain(engine)
+        
         logger.debug(
             f"Created engine with pool_size={pool_size}, "
             f"max_overflow={max_overflow}, pool_recycle={pool_recycle}s"
@@ -150,6 +186,28 @@ class DatabaseConfig:
         
         return engine
     
+    def _register_auto_explain(self, engine: Engine) -> None:
+        """Load auto_explain cho mỗi connection mới (một lần/connection, không phải mỗi query)"""
+        settings = (
+            "LOAD 'auto_explain'; "
+            f"SET auto_explain.log_min_duration = {self.auto_explain_min_duration}; "
+            f"SET auto_explain.log_analyze = {'on' if self.auto_explain_analyze else 'off'}; "
+            f"SET auto_explain.log_buffers = {'on' if self.auto_explain_analyze else 'off'}; "
+            "SET auto_explain.log_format = 'json'"
+        )
+        
+        @event.listens_for(engine, "connect")
+        def set_auto_explain(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                cursor.execute(settings)
+                dbapi_connection.commit()
+            except Exception as e:
+                dbapi_connection.rollback()
+                logger.warning(f"Could not enable auto_explain: {e}")
+            finally:
+                cursor.close()
+    
     def get_pool_stats(self, engine: Engine) -> Dict[str, Any]:
         """Lấy thống kê về connection pool"""
         pool = engine.pool
@@ -160,6 +218,10 @@ class DatabaseConfig:
             "overflow": pool.overflow()
         }
         
+        # Utilization = connections đang dùng / tổng số connections tối đa
+        capacity = stats["size"] + self.max_overflow
+        stats["utilization"] = round(stats["checked_out"] / capacity, 3) if capacity > 0 else 0.0
+        
         # Thử lấy invalid count nếu có (không phải tất cả pool types đều có)
         try:
             if hasattr(pool, 'invalid'):
@@ -13,6 +13,7 @@ import os
 import logging
 import asyncio
 import time
+import unicodedata
 from typing import List, Optional, Dict, Any
 import numpy as np
 from dotenv import load_dotenv
@@ -44,6 +45,14 @@ except ImportError:
 from .embedding_precompute import EmbeddingPrecomputeManager
 from .embedding_model_loader import EmbeddingModelLoader
 
+def normalize_cache_text(text: str) -> str:
+    """
+    Chuẩn hóa text làm cache key: NFKC, casefold, gộp whitespace.
+    Các message chỉ khác hoa/thường hoặc khoảng trắng dùng chung một cache entry.
+    """
+    return " ".join(unicodedata.normalize("NFKC", text).casefold().split())
+
+
 class EmbeddingService:
     """Service để generate embeddings cho text với batch, parallel, và quantization support"""
     
@@ -111,8 +120,9 @@ class EmbeddingService:
         start_time = time.time()
         
         # Try to get from cache first
+        cache_text = normalize_cache_text(text)
         if use_cache and CACHE_AVAILABLE and cache_service and cache_service.enabled:
-            cached_embedding = cache_service.get_cached_embedding(text)
+            cached_embedding = cache_service.get_cached_embedding(cache_text)
             if cached_embedding:
                 logger.debug(f"Cache hit for embedding: {text[:50]}...")
                 if METRICS_AVAILABLE and metrics_service and metrics_service.enabled:
@@ -140,7 +150,7 @@ class EmbeddingService:
             
             # Cache the result
             if embedding and use_cache and CACHE_AVAILABLE and cache_service and cache_service.enabled:
-                cache_service.cache_embedding(text, embedding)
+                cache_service.cache_embedding(cache_text, embedding)
                 logger.debug(f"Cached embedding: {text[:50]}...")
             
             return embedding
@@ -313,8 +323,12 @@ class EmbeddingService:
         texts_to_generate_indices = []
         
         if use_cache and CACHE_AVAILABLE and cache_service and cache_service.enabled:
+            # Một lần get_many (một round trip Redis) cho cả batch
+            cached_by_text = cache_service.get_cached_embeddings(
+                [normalize_cache_text(text) for text in valid_texts]
+            )
             for idx, text in zip(valid_indices, valid_texts):
-                cached_embedding = cache_service.get_cached_embedding(text)
+                cached_embedding = cached_by_text.get(normalize_cache_text(text))
                 if cached_embedding:
                     cached_results[idx] = cached_embedding
                     if METRICS_AVAILABLE and metrics_service and metrics_service.enabled:
@@ -347,13 +361,15 @@ class EmbeddingService:
                     generated_embeddings = self._generate_sentence_embeddings_batch(texts_to_generate)
                 
                 # Map results to indices
+                to_cache = {}
                 for i, (idx, embedding) in enumerate(zip(texts_to_generate_indices, generated_embeddings)):
                     generated_results[idx] = embedding
-                    
-                    # Cache the result
-                    if embedding and use_cache and CACHE_AVAILABLE and cache_service and cache_service.enabled:
-                        text = texts_to_generate[i]
-                        cache_service.cache_embedding(text, embedding)
+                    if embedding:
+                        to_cache[normalize_cache_text(texts_to_generate[i])] = embedding
+                
+                # Cache các kết quả mới bằng một lần set_many (pipeline)
+                if to_cache and use_cache and CACHE_AVAILABLE and cache_service and cache_service.enabled:
+                    cache_service.cache_embeddings(to_cache)
                 
             except Exception as e:
                 logger.error(f"Error generating batch embeddings: {e}")
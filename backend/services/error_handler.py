@@ -16,6 +16,7 @@ from typing import Optional, Callable, TypeVar, Any
 from enum import Enum
 from fastapi import HTTPException
 from datetime import datetime
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 
 logger = logging.getLogger(__name__)
 
@@ -308,6 +309,16 @@ def handle_network_error(error: Exception, context: Optional[str] = None) -> HTT
 
 def handle_database_error(error: Exception, context: Optional[str] = None) -> HTTPException:
     """Handle database-related errors"""
+    # Hết connection trong pool (quá pool_timeout) -> 503 để client retry
+    if isinstance(error, PoolTimeoutError):
+        return handle_error(
+            error,
+            category=ErrorCategory.DATABASE,
+            severity=ErrorSeverity.WARNING,
+            context=context,
+            user_message="Database đang quá tải. Vui lòng thử lại sau.",
+            status_code=503
+        )
     return handle_error(
         error,
         category=ErrorCategory.DATABASE,
@@ -91,6 +91,10 @@ class FeedbackService:
                 is_helpful=is_helpful
             )
             
+            # Rating filter của semantic search đọc ratings từ matrix cached -> cập nhật slot
+            from services.semantic_search_service import SemanticSearchService
+            SemanticSearchService.update_cached_rating(conversation_id, feedback.rating)
+            
             return {
                 "success": True,
                 "message": "Feedback submitted",
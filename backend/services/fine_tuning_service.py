@@ -5,17 +5,22 @@ Hỗ trợ tạo training data và fine-tune model
 import os
 import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterator, Tuple
 from datetime import datetime
 from sqlalchemy.orm import Session
 from sqlalchemy import text
 
+from services.encryption_service import encryption_service
+
 logger = logging.getLogger(__name__)
 
+# Số rows lấy mỗi lần từ server-side cursor khi stream export
+EXPORT_STREAM_YIELD_PER = int(os.getenv("EXPORT_STREAM_YIELD_PER", "500"))
+
 class FineTuningService:
     """Service để quản lý fine-tuning từ conversations"""
     
-    def __init__(self, db: Session):
+    def __init__(self, db: Optional[Session] = None):
         self.db = db
         self.training_data_dir = os.getenv("TRAINING_DATA_DIR", "./training_data")
         os.makedirs(self.training_data_dir, exist_ok=True)
@@ -24,7 +29,8 @@ class FineTuningService:
         self, 
         session_id: Optional[str] = None,
         min_conversations: int = 10,
-        output_format: str = "jsonl"  # jsonl, json, txt
+        output_format: str = "jsonl",  # jsonl, json, txt
+        db: Optional[Session] = None
     ) -> Dict[str, Any]:
         """
         Export conversations từ database để tạo training data
@@ -33,13 +39,15 @@ class FineTuningService:
             session_id: Filter theo session (None = tất cả)
             min_conversations: Số lượng conversations tối thiểu
             output_format: Format output (jsonl, json, txt)
+            db: Database session (mặc định dùng session của instance)
             
         Returns:
             Dict với thông tin về exported data
         """
+        db = db or self.db
         try:
             # Query conversations
-            query = self.db.query(
+            query = db.query(
                 text("""
                     SELECT user_message, ai_response, session_id, created_at
                     FROM agent_conversations
@@ -48,7 +56,7 @@ class FineTuningService:
             )
             
             if session_id:
-                query = self.db.execute(
+                query = db.execute(
                     text("""
                         SELECT user_message, ai_response, session_id, created_at
                         FROM agent_conversations
@@ -59,7 +67,7 @@ class FineTuningService:
                     {"session_id": session_id}
                 )
             else:
-                query = self.db.execute(
+                query = db.execute(
                     text("""
                         SELECT user_message, ai_response, session_id, created_at
                         FROM agent_conversations
@@ -124,7 +132,8 @@ class FineTuningService:
     def create_ollama_finetune_data(
         self,
         session_id: Optional[str] = None,
-        min_conversations: int = 10
+        min_conversations: int = 10,
+        db: Optional[Session] = None
     ) -> Dict[str, Any]:
         """
         Tạo training data format cho Ollama fine-tuning
@@ -138,8 +147,9 @@ class FineTuningService:
             ]
         }
         """
+        db = db or self.db
         try:
-            query = self.db.execute(
+            query = db.execute(
                 text("""
                     SELECT user_message, ai_response, session_id, created_at
                     FROM agent_conversations
@@ -201,17 +211,144 @@ class FineTuningService:
                 "error": str(e)
             }
     
-    def get_training_stats(self) -> Dict[str, Any]:
+    @staticmethod
+    def _export_filter_sql(
+        use_feedback: bool,
+        min_rating: Optional[int],
+        include_corrections: bool
+    ) -> Tuple[str, str]:
+        """
+        (JOIN, điều kiện WHERE) cho export: không dùng feedback -> mọi conversation có ai_response;
+        dùng feedback -> giống get_feedback_for_training (rating >= min_rating HOẶC có user correction)
+        """
+        if not use_feedback:
+            return "", ""
+        join = """
+            JOIN (
+                SELECT conversation_id, MAX(rating) AS rating, MAX(user_correction) AS user_correction
+                FROM conversation_feedback
+                GROUP BY conversation_id
+            ) cf ON cf.conversation_id = ac.id
+        """
+        conditions = []
+        if min_rating:
+            conditions.append("cf.rating >= :min_rating")
+        if include_corrections:
+            conditions.append("cf.user_correction IS NOT NULL")
+        where = f" AND ({' OR '.join(conditions)})" if conditions else ""
+        return join, where
+    
+    def count_exportable_conversations(
+        self,
+        session_id: Optional[str] = None,
+        db: Optional[Session] = None,
+        use_feedback: bool = False,
+        min_rating: Optional[int] = None,
+        include_corrections: bool = False
+    ) -> int:
+        """Đếm số conversations có thể export với cùng filters (dùng cho header count khi stream)"""
+        db = db or self.db
+        join, where = self._export_filter_sql(use_feedback, min_rating, include_corrections)
+        return db.execute(
+            text(f"""
+                SELECT COUNT(*)
+                FROM agent_conversations ac
+                {join}
+                WHERE (CAST(:session_id AS VARCHAR) IS NULL OR ac.session_id = :session_id)
+                AND ac.ai_response IS NOT NULL AND ac.ai_response != ''
+                {where}
+            """),
+            {"session_id": session_id, "min_rating": min_rating}
+        ).scalar() or 0
+    
+    def iter_export_jsonl(
+        self,
+        session_id: Optional[str] = None,
+        output_format: str = "jsonl",  # jsonl hoặc ollama
+        db: Optional[Session] = None,
+        use_feedback: bool = False,
+        min_rating: Optional[int] = None,
+        include_corrections: bool = False
+    ) -> Iterator[str]:
+        """
+        Stream training data dạng JSONL trực tiếp từ server-side cursor
+        
+        Mỗi conversation (jsonl) hoặc mỗi session (ollama) được yield thành một dòng,
+        không giữ toàn bộ dữ liệu trong memory và không ghi file.
+        use_feedback: chỉ export conversations có feedback đạt min_rating hoặc có user correction;
+        include_corrections: dùng user correction (nếu có) làm output
+        """
+        db = db or self.db
+        join, where = self._export_filter_sql(use_feedback, min_rating, include_corrections)
+        correction = "cf.user_correction" if use_feedback and include_corrections else "NULL"
+        result = db.execute(
+            text(f"""
+                SELECT ac.user_message, ac.ai_response, ac.session_id, ac.created_at, {correction}
+                FROM agent_conversations ac
+                {join}
+                WHERE (CAST(:session_id AS VARCHAR) IS NULL OR ac.session_id = :session_id)
+                AND ac.ai_response IS NOT NULL AND ac.ai_response != ''
+                {where}
+                ORDER BY ac.created_at
+            """),
+            {"session_id": session_id, "min_rating": min_rating},
+            execution_options={"stream_results": True, "yield_per": EXPORT_STREAM_YIELD_PER}
+        )
+        rows = (
+            (user_msg, self._decrypt_correction(corrected) or ai_resp, sess_id, created_at)
+            for user_msg, ai_resp, sess_id, created_at, corrected in result
+        )
+        try:
+            if output_format != "ollama":
+                for user_msg, ai_resp, sess_id, created_at in rows:
+                    yield json.dumps({
+                        "instruction": user_msg,
+                        "input": "",
+                        "output": ai_resp,
+                        "session_id": sess_id,
+                        "created_at": created_at.isoformat() if created_at else None
+                    }, ensure_ascii=False) + "\n"
+                return
+            
+            # Ollama: gom các conversations liên tiếp cùng session thành một messages array
+            current_session = None
+            messages = []
+            for user_msg, ai_resp, sess_id, created_at in rows:
+                if current_session and current_session != sess_id and messages:
+                    yield json.dumps({"messages": messages}, ensure_ascii=False) + "\n"
+                    messages = []
+                current_session = sess_id
+                messages.append({"role": "user", "content": user_msg})
+                messages.append({"role": "assistant", "content": ai_resp})
+            
+            if messages:
+                yield json.dumps({"messages": messages}, ensure_ascii=False) + "\n"
+        finally:
+            result.close()
+    
+    @staticmethod
+    def _decrypt_correction(correction: Optional[str]) -> Optional[str]:
+        """User correction được lưu encrypted; data cũ chưa encrypt thì dùng nguyên văn"""
+        if not correction:
+            return None
+        try:
+            return encryption_service.decrypt(correction)
+        except Exception as e:
+            logger.warning(f"Error decrypting user correction for export: {e}")
+            return correction
+    
+    def get_training_stats(self, db: Optional[Session] = None) -> Dict[str, Any]:
         """Lấy thống kê về dữ liệu training"""
+        db = db or self.db
         try:
             # Count total conversations
-            total_query = self.db.execute(
+            total_query = db.execute(
                 text("SELECT COUNT(*) FROM agent_conversations WHERE ai_response IS NOT NULL")
             )
             total = total_query.scalar() or 0
             
             # Count by session
-            sessions_query = self.db.execute(
+            sessions_query = db.execute(
                 text("""
                     SELECT session_id, COUNT(*) as count
                     FROM agent_conversations
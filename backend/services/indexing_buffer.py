@@ -0,0 +1,70 @@
+"""
+Indexing Buffer Service
+Gom các yêu cầu index conversation (tạo embeddings) và ghi theo batch:
+một batch embedding call + một multi-row INSERT cho tối đa INDEX_BUFFER_BATCH_SIZE
+conversations thay vì một transaction cho mỗi conversation.
+"""
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from services.batching_queue import BatchingQueue
+
+logger = logging.getLogger(__name__)
+
+# Số conversations tối đa mỗi lần flush
+INDEX_BUFFER_BATCH_SIZE = int(os.getenv("INDEX_BUFFER_BATCH_SIZE", "100"))
+# Thời gian chờ tối đa (giây) để gom thêm conversations trước khi flush batch chưa đầy
+INDEX_BUFFER_FLUSH_INTERVAL = float(os.getenv("INDEX_BUFFER_FLUSH_INTERVAL", "0.5"))
+# Giới hạn queue để không giữ quá nhiều pending items trong memory
+INDEX_BUFFER_MAX_PENDING = int(os.getenv("INDEX_BUFFER_MAX_PENDING", "10000"))
+
+
+class IndexingBuffer(BatchingQueue):
+    """Buffer các conversation cần index và flush theo batch bằng một consumer coroutine"""
+    
+    def __init__(self):
+        super().__init__(
+            "Indexing buffer",
+            self._flush,
+            batch_size=INDEX_BUFFER_BATCH_SIZE,
+            flush_interval=INDEX_BUFFER_FLUSH_INTERVAL,
+            max_pending=INDEX_BUFFER_MAX_PENDING
+        )
+    
+    def enqueue(self, conversation_id: int, user_message: str, ai_response: Optional[str]) -> bool:
+        """
+        Thêm conversation vào buffer
+        
+        Returns:
+            False nếu buffer chưa chạy hoặc đã đầy (caller tự fallback)
+        """
+        return self.put((conversation_id, user_message, ai_response))
+    
+    async def _flush(self, batch: List[Tuple[int, str, Optional[str]]]):
+        """Index cả batch bằng một batch embedding call và một INSERT"""
+        if not batch:
+            return
+        from config.app_config import SessionLocal
+        from services.semantic_search_service import SemanticSearchService
+        
+        db = SessionLocal()
+        try:
+            semantic_service = SemanticSearchService()
+            result = await semantic_service.index_conversations_bulk(batch, db=db)
+            if result.get("errors"):
+                logger.warning(f"Indexing buffer flush: {result['indexed']} indexed, {result['errors']} errors")
+            else:
+                logger.debug(f"Indexing buffer flush: {result['indexed']} conversations indexed")
+            
+            # Tính sẵn best response cho các user messages trong batch
+            for _, user_message, _ in batch:
+                await semantic_service.precompute_best_response(user_message, db=db)
+        except Exception as e:
+            logger.error(f"Error flushing indexing buffer ({len(batch)} conversations): {e}")
+        finally:
+            db.close()
+
+
+# Global instance
+indexing_buffer = IndexingBuffer()
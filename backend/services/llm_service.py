@@ -6,6 +6,7 @@ Có tích hợp Redis caching để tăng hiệu năng
 import os
 import httpx
 import logging
+from functools import lru_cache
 from typing import Optional, List, Dict, Any
 from dotenv import load_dotenv
 
@@ -39,6 +40,25 @@ except ImportError:
     metrics_service = None
     logger.warning("Metrics service not available.")
 
+
+_HIGH_RATED_HINT = "\nHãy tham khảo phong cách từ các responses được đánh giá cao."
+
+
+@lru_cache(maxsize=8)
+def _base_system_prompt(use_fine_tuned: bool = False) -> str:
+    """Phần cố định của system prompt (tính một lần, dùng lại cho mọi request)"""
+    base_prompt = """Bạn là một AI assistant thông minh và hữu ích. 
+Hãy trả lời câu hỏi một cách chính xác, thân thiện và hữu ích.
+Nếu bạn không biết câu trả lời, hãy thành thật nói rằng bạn không biết."""
+    
+    # TODO: Load fine-tuned prompt từ database nếu có
+    if use_fine_tuned:
+        # Có thể load từ database hoặc file
+        pass
+    
+    return base_prompt
+
+
 class LLMService:
     """Service để tương tác với LLM (llama3.1 qua Ollama)"""
     
@@ -484,29 +504,30 @@ class LLMService:
             use_fine_tuned: Có sử dụng fine-tuned prompt không
             pattern_insights: Insights từ pattern analysis
         """
-        base_prompt = """Bạn là một AI assistant thông minh và hữu ích. 
-Hãy trả lời câu hỏi một cách chính xác, thân thiện và hữu ích.
-Nếu bạn không biết câu trả lời, hãy thành thật nói rằng bạn không biết."""
-        
-        # Thêm pattern insights nếu có
+        insights = []
+        recommend_high_rated = False
         if pattern_insights:
-            insights = pattern_insights.get("insights", [])
-            if insights:
-                base_prompt += "\n\nLưu ý từ phân tích patterns:\n"
-                for insight in insights[:3]:  # Top 3 insights
-                    base_prompt += f"- {insight}\n"
-            
-            # Thêm recommended approach
+            # Routes có thể truyền dict (common_patterns) -> chỉ dùng insights dạng list
+            raw_insights = pattern_insights.get("insights")
+            insights = list(raw_insights)[:3] if isinstance(raw_insights, (list, tuple)) else []  # Top 3 insights
             recommended = pattern_insights.get("recommended_approach")
-            if recommended and recommended.get("style") == "similar_to_high_rated":
-                base_prompt += "\nHãy tham khảo phong cách từ các responses được đánh giá cao."
+            recommend_high_rated = bool(
+                recommended and recommended.get("style") == "similar_to_high_rated"
+            )
         
-        # TODO: Load fine-tuned prompt từ database nếu có
-        if use_fine_tuned:
-            # Có thể load từ database hoặc file
-            pass
+        if not insights and not recommend_high_rated:
+            return _base_system_prompt(use_fine_tuned)
         
-        return base_prompt
+        parts = [_base_system_prompt(use_fine_tuned)]
+        # Thêm pattern insights nếu có
+        if insights:
+            parts.append("\n\nLưu ý từ phân tích patterns:\n")
+            parts.extend(f"- {insight}\n" for insight in insights)
+        # Thêm recommended approach
+        if recommend_high_rated:
+            parts.append(_HIGH_RATED_HINT)
+        
+        return "".join(parts)
     
     async def generate_batch(
         self,
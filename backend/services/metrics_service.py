@@ -270,8 +270,8 @@ class MetricsService:
         except Exception as e:
             logger.warning(f"Failed to record DB metrics: {e}")
     
-    def record_cache_hit(self, cache_type: str, level: str = "unknown"):
-        """Record cache hit"""
+    def record_cache_hit(self, cache_type: str, level: str = "unknown", count: int = 1):
+        """Record cache hit (count > 1 khi caller gom nhiều hits)"""
         if not self.enabled:
             return
         
@@ -283,17 +283,17 @@ class MetricsService:
             self.metrics['cache_hits_total'].labels(
                 cache_type=cache_type,
                 level=level
-            ).inc()
+            ).inc(count)
         except Exception as e:
             logger.warning(f"Failed to record cache hit: {e}")
     
-    def record_cache_miss(self, cache_type: str):
-        """Record cache miss"""
+    def record_cache_miss(self, cache_type: str, count: int = 1):
+        """Record cache miss (count > 1 khi caller gom nhiều misses)"""
         if not self.enabled:
             return
         
         try:
-            self.metrics['cache_misses_total'].labels(cache_type=cache_type).inc()
+            self.metrics['cache_misses_total'].labels(cache_type=cache_type).inc(count)
         except Exception as e:
             logger.warning(f"Failed to record cache miss: {e}")
     
@@ -343,7 +343,7 @@ class MetricsService:
         except Exception as e:
             logger.warning(f"Failed to record cache TTL: {e}")
     
-    def record_error(self, error_type: str, service: str):
+    def record_error(self, error_type: str, service: str, count: int = 1):
         """Record error"""
         if not self.enabled:
             return
@@ -352,7 +352,7 @@ class MetricsService:
             self.metrics['errors_total'].labels(
                 error_type=error_type,
                 service=service
-            ).inc()
+            ).inc(count)
         except Exception as e:
             logger.warning(f"Failed to record error: {e}")
     
@@ -3,6 +3,7 @@ Pattern Analysis Service để phân tích patterns từ conversations
 Phát hiện common questions, topics, intent và cải thiện responses
 Có tích hợp Redis caching để tăng hiệu năng
 """
+import heapq
 import logging
 import re
 from typing import List, Dict, Any, Optional, Tuple
@@ -23,15 +24,21 @@ except ImportError:
     logger.warning("Cache service not available. Install redis package for caching support.")
 
 class PatternAnalysisService:
-    """Service để phân tích patterns từ conversations"""
+    """
+    Service để phân tích patterns từ conversations
     
-    def __init__(self, db: Session):
+    Có thể dùng như singleton (khởi tạo không có db, truyền db vào từng method)
+    hoặc gắn với một session cố định như trước: PatternAnalysisService(db).
+    """
+    
+    def __init__(self, db: Optional[Session] = None):
         self.db = db
     
     def analyze_common_questions(
         self,
         min_frequency: int = 2,
-        limit: int = 20
+        limit: int = 20,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Phân tích các câu hỏi thường gặp
@@ -43,9 +50,10 @@ class PatternAnalysisService:
         Returns:
             List các câu hỏi thường gặp với frequency
         """
+        db = db or self.db
         try:
             # Lấy tất cả user messages
-            conversations = self.db.execute(
+            conversations = db.execute(
                 text("""
                     SELECT user_message, COUNT(*) as frequency
                     FROM agent_conversations
@@ -76,7 +84,8 @@ class PatternAnalysisService:
     def analyze_topics(
         self,
         min_occurrences: int = 3,
-        limit: int = 15
+        limit: int = 15,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Phân tích topics phổ biến từ conversations
@@ -88,9 +97,10 @@ class PatternAnalysisService:
         Returns:
             List các topics với số lần xuất hiện
         """
+        db = db or self.db
         try:
             # Lấy tất cả conversations
-            conversations = self.db.execute(
+            conversations = db.execute(
                 text("""
                     SELECT user_message, ai_response
                     FROM agent_conversations
@@ -129,7 +139,8 @@ class PatternAnalysisService:
     def analyze_response_patterns(
         self,
         min_rating: int = 4,
-        min_frequency: int = 2
+        min_frequency: int = 2,
+        db: Optional[Session] = None
     ) -> Dict[str, Any]:
         """
         Phân tích patterns của responses tốt và xấu
@@ -141,6 +152,7 @@ class PatternAnalysisService:
         Returns:
             Dict với patterns tốt và xấu
         """
+        db = db or self.db
         try:
             # Import models (lazy import để tránh circular import)
             from models import AgentConversation, ConversationFeedback
@@ -155,7 +167,7 @@ class PatternAnalysisService:
                 }
             
             # Lấy conversations với feedback
-            good_responses = self.db.query(
+            good_responses = db.query(
                 AgentConversation.user_message,
                 AgentConversation.ai_response,
                 ConversationFeedback.rating
@@ -166,7 +178,7 @@ class PatternAnalysisService:
                 ConversationFeedback.rating >= min_rating
             ).all()
             
-            bad_responses = self.db.query(
+            bad_responses = db.query(
                 AgentConversation.user_message,
                 AgentConversation.ai_response,
                 ConversationFeedback.rating
@@ -200,7 +212,8 @@ class PatternAnalysisService:
     
     def analyze_user_intents(
         self,
-        limit: int = 10
+        limit: int = 10,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Phân tích user intents từ conversations
@@ -208,8 +221,9 @@ class PatternAnalysisService:
         Returns:
             List các intent patterns
         """
+        db = db or self.db
         try:
-            conversations = self.db.execute(
+            conversations = db.execute(
                 text("""
                     SELECT user_message
                     FROM agent_conversations
@@ -256,7 +270,8 @@ class PatternAnalysisService:
         self,
         user_message: str,
         limit: int = 5,
-        min_rating: Optional[int] = None
+        min_rating: Optional[int] = None,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Tìm conversations tương tự để học từ responses tốt
@@ -269,6 +284,7 @@ class PatternAnalysisService:
         Returns:
             List conversations tương tự
         """
+        db = db or self.db
         try:
             from models import AgentConversation, ConversationFeedback
             
@@ -276,7 +292,7 @@ class PatternAnalysisService:
             query_keywords = set(self._extract_keywords(user_message.lower()))
             
             # Lấy conversations
-            query = self.db.query(AgentConversation)
+            query = db.query(AgentConversation)
             
             # Filter by rating nếu có
             if min_rating:
@@ -287,33 +303,40 @@ class PatternAnalysisService:
             
             conversations = query.order_by(
                 AgentConversation.created_at.desc()
-            ).limit(100).all()
+            ).limit(100)
             
-            # Tính similarity
-            similar_convs = []
-            for conv in conversations:
+            # Online top-k: min-heap kích thước `limit`, chỉ tạo dict cho rows còn lại trong heap
+            top: List[Tuple[float, int, Any]] = []
+            for seq, conv in enumerate(conversations):
                 conv_keywords = set(self._extract_keywords(conv.user_message.lower()))
                 
                 # Simple Jaccard similarity
-                if query_keywords and conv_keywords:
-                    intersection = len(query_keywords & conv_keywords)
-                    union = len(query_keywords | conv_keywords)
-                    similarity = intersection / union if union > 0 else 0
-                    
-                    if similarity > 0.2:  # Threshold
-                        similar_convs.append({
-                            "conversation_id": conv.id,
-                            "user_message": conv.user_message,
-                            "ai_response": conv.ai_response,
-                            "similarity": round(similarity, 3),
-                            "session_id": conv.session_id,
-                            "created_at": conv.created_at.isoformat()
-                        })
-            
-            # Sort by similarity
-            similar_convs.sort(key=lambda x: x["similarity"], reverse=True)
-            
-            return similar_convs[:limit]
+                if not query_keywords or not conv_keywords:
+                    continue
+                intersection = len(query_keywords & conv_keywords)
+                union = len(query_keywords | conv_keywords)
+                similarity = intersection / union if union > 0 else 0
+                if similarity <= 0.2:  # Threshold
+                    continue
+                
+                # seq âm: cùng similarity thì giữ conversation mới hơn (đứng trước trong ORDER BY)
+                item = (similarity, -seq, conv)
+                if len(top) < limit:
+                    heapq.heappush(top, item)
+                elif limit > 0:
+                    heapq.heappushpop(top, item)
+            
+            return [
+                {
+                    "conversation_id": conv.id,
+                    "user_message": conv.user_message,
+                    "ai_response": conv.ai_response,
+                    "similarity": round(similarity, 3),
+                    "session_id": conv.session_id,
+                    "created_at": conv.created_at.isoformat()
+                }
+                for similarity, _, conv in sorted(top, key=lambda x: (x[0], x[1]), reverse=True)
+            ]
         except Exception as e:
             logger.error(f"Error finding similar conversations: {e}")
             return []
@@ -321,7 +344,8 @@ class PatternAnalysisService:
     def get_response_suggestions(
         self,
         user_message: str,
-        use_patterns: bool = True
+        use_patterns: bool = True,
+        db: Optional[Session] = None
     ) -> Dict[str, Any]:
         """
         Đề xuất response dựa trên patterns đã học
@@ -333,6 +357,7 @@ class PatternAnalysisService:
         Returns:
             Dict với suggestions và insights
         """
+        db = db or self.db
         try:
             suggestions = {
                 "similar_conversations": [],
@@ -344,13 +369,14 @@ class PatternAnalysisService:
             similar = self.find_similar_conversations(
                 user_message,
                 limit=3,
-                min_rating=4
+                min_rating=4,
+                db=db
             )
             suggestions["similar_conversations"] = similar
             
             if use_patterns:
                 # Phân tích patterns
-                response_patterns = self.analyze_response_patterns(min_rating=4)
+                response_patterns = self.analyze_response_patterns(min_rating=4, db=db)
                 
                 if response_patterns.get("good_patterns"):
                     suggestions["common_patterns"] = {
@@ -381,7 +407,12 @@ class PatternAnalysisService:
                 "recommended_approach": None
             }
     
-    def get_pattern_insights(self, session_id: Optional[str] = None, use_cache: bool = True) -> Dict[str, Any]:
+    def get_pattern_insights(
+        self,
+        session_id: Optional[str] = None,
+        use_cache: bool = True,
+        db: Optional[Session] = None
+    ) -> Dict[str, Any]:
         """
         Tổng hợp insights từ tất cả patterns với caching support
         
@@ -392,6 +423,7 @@ class PatternAnalysisService:
         Returns:
             Dict với tổng hợp insights
         """
+        db = db or self.db
         # Try to get from cache first
         if use_cache and session_id and CACHE_AVAILABLE and cache_service and cache_service.enabled:
             cached_insights = cache_service.get_cached_pattern_analysis(session_id, limit=10)
@@ -401,13 +433,13 @@ class PatternAnalysisService:
         
         try:
             # Analyze all patterns
-            common_questions = self.analyze_common_questions(min_frequency=2, limit=10)
-            topics = self.analyze_topics(min_occurrences=2, limit=10)
-            intents = self.analyze_user_intents(limit=10)
-            response_patterns = self.analyze_response_patterns(min_rating=4)
+            common_questions = self.analyze_common_questions(min_frequency=2, limit=10, db=db)
+            topics = self.analyze_topics(min_occurrences=2, limit=10, db=db)
+            intents = self.analyze_user_intents(limit=10, db=db)
+            response_patterns = self.analyze_response_patterns(min_rating=4, db=db)
             
             # Get stats
-            total_convs = self.db.execute(
+            total_convs = db.execute(
                 text("SELECT COUNT(*) FROM agent_conversations")
             ).scalar() or 0
             
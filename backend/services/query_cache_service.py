@@ -5,7 +5,8 @@ Cung cấp caching layer cho database queries để giảm load và tăng perfor
 import hashlib
 import json
 import logging
-from typing import Any, Optional, Callable, Dict
+import time
+from typing import Any, Optional, Callable, Dict, Tuple
 from datetime import datetime, timedelta
 from functools import wraps
 import os
@@ -28,6 +29,23 @@ _cache_stats = {
     "sets": 0,
     "evictions": 0
 }
+# Hits/misses theo namespace: {namespace: {"hits": n, "misses": n}}
+_namespace_stats: Dict[str, Dict[str, int]] = {}
+
+# Version của mỗi namespace nằm trong cache key: bump version = invalidate cả namespace
+# bằng một INCR (keys cũ tự hết hạn theo TTL), không cần SCAN keyspace
+# Version đọc từ Redis được giữ local tối đa QUERY_CACHE_VERSION_REFRESH giây
+QUERY_CACHE_VERSION_REFRESH = float(os.getenv("QUERY_CACHE_VERSION_REFRESH", "1"))
+_namespace_versions: Dict[str, Tuple[int, float]] = {}
+
+
+def _record_lookup(namespace: Optional[str], hit: bool) -> None:
+    """Cập nhật hit/miss counters (tổng và theo namespace)"""
+    field = "hits" if hit else "misses"
+    _cache_stats[field] += 1
+    if namespace:
+        ns_stats = _namespace_stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        ns_stats[field] += 1
 
 
 class QueryCacheService:
@@ -80,8 +98,9 @@ class QueryCacheService:
         else:
             logger.info("ℹ️  Redis không được cài đặt, sử dụng in-memory cache")
     
-    def _generate_cache_key(self, query: str, params: Optional[Dict[str, Any]] = None) -> str:
-        """Generate cache key từ query và parameters"""
+    def _generate_cache_key(self, query: str, params: Optional[Dict[str, Any]] = None,
+                            namespace: Optional[str] = None) -> str:
+        """Generate cache key từ query và parameters (namespace để invalidate theo nhóm)"""
         # Normalize query (remove extra whitespace)
         normalized_query = " ".join(query.split())
         
@@ -94,30 +113,71 @@ class QueryCacheService:
         
         # Hash để tạo key ngắn gọn
         key_hash = hashlib.sha256(key_data.encode()).hexdigest()
+        if namespace:
+            return f"query_cache:{namespace}:v{self._namespace_version(namespace)}:{key_hash}"
         return f"query_cache:{key_hash}"
     
-    def get(self, query: str, params: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+    @staticmethod
+    def _version_key(namespace: str) -> str:
+        """Redis key chứa version của namespace (ngoài prefix query_cache: nên invalidate() không xóa)"""
+        return f"query_cache_version:{namespace}"
+    
+    def _namespace_version(self, namespace: str) -> int:
+        """Version hiện tại của namespace (Redis: đọc lại sau QUERY_CACHE_VERSION_REFRESH giây)"""
+        entry = _namespace_versions.get(namespace)
+        now = time.monotonic()
+        if entry is not None and (not self.use_redis or now - entry[1] < QUERY_CACHE_VERSION_REFRESH):
+            return entry[0]
+        version = entry[0] if entry is not None else 0
+        if self.use_redis and self.redis_client:
+            try:
+                version = int(self.redis_client.get(self._version_key(namespace)) or 0)
+            except Exception as e:
+                logger.warning(f"Error reading cache version of {namespace}: {e}")
+        _namespace_versions[namespace] = (version, now)
+        return version
+    
+    def bump_namespace(self, namespace: str) -> int:
+        """
+        Invalidate toàn bộ namespace bằng cách tăng version (O(1), không SCAN)
+        
+        Returns:
+            Version mới của namespace
+        """
+        entry = _namespace_versions.get(namespace)
+        version = (entry[0] if entry is not None else 0) + 1
+        if self.use_redis and self.redis_client:
+            try:
+                version = int(self.redis_client.incr(self._version_key(namespace)))
+            except Exception as e:
+                logger.error(f"Error bumping cache version of {namespace}: {e}")
+        _namespace_versions[namespace] = (version, time.monotonic())
+        return version
+    
+    def get(self, query: str, params: Optional[Dict[str, Any]] = None,
+            namespace: Optional[str] = None) -> Optional[Any]:
         """
         Lấy kết quả từ cache
         
         Args:
             query: SQL query string
             params: Query parameters
+            namespace: Nhóm cache key (optional)
         
         Returns:
             Cached result hoặc None nếu không có trong cache
         """
-        cache_key = self._generate_cache_key(query, params)
+        cache_key = self._generate_cache_key(query, params, namespace)
         
         try:
             if self.use_redis and self.redis_client:
                 # Try Redis first
                 cached_data = self.redis_client.get(cache_key)
                 if cached_data:
-                    _cache_stats["hits"] += 1
+                    _record_lookup(namespace, True)
                     return json.loads(cached_data)
                 else:
-                    _cache_stats["misses"] += 1
+                    _record_lookup(namespace, False)
                     return None
             else:
                 # Use in-memory cache
@@ -125,23 +185,23 @@ class QueryCacheService:
                     cache_entry = _memory_cache[cache_key]
                     # Check expiration
                     if datetime.now() < cache_entry["expires_at"]:
-                        _cache_stats["hits"] += 1
+                        _record_lookup(namespace, True)
                         return cache_entry["data"]
                     else:
                         # Expired, remove it
                         del _memory_cache[cache_key]
                         _cache_stats["evictions"] += 1
                 
-                _cache_stats["misses"] += 1
+                _record_lookup(namespace, False)
                 return None
         
         except Exception as e:
             logger.error(f"Error getting from cache: {e}")
-            _cache_stats["misses"] += 1
+            _record_lookup(namespace, False)
             return None
     
     def set(self, query: str, result: Any, ttl: Optional[int] = None,
-            params: Optional[Dict[str, Any]] = None) -> bool:
+            params: Optional[Dict[str, Any]] = None, namespace: Optional[str] = None) -> bool:
         """
         Lưu kết quả vào cache
         
@@ -150,11 +210,12 @@ class QueryCacheService:
             result: Query result to cache
             ttl: Time to live in seconds (None = use default)
             params: Query parameters
+            namespace: Nhóm cache key (optional)
         
         Returns:
             True nếu thành công, False nếu có lỗi
         """
-        cache_key = self._generate_cache_key(query, params)
+        cache_key = self._generate_cache_key(query, params, namespace)
         ttl = ttl or self.default_ttl
         
         try:
@@ -205,16 +266,11 @@ class QueryCacheService:
         
         try:
             if self.use_redis and self.redis_client:
-                if pattern:
-                    # Find keys matching pattern
-                    keys = self.redis_client.keys(f"query_cache:{pattern}*")
-                    if keys:
-                        count = self.redis_client.delete(*keys)
-                else:
-                    # Clear all query cache keys
-                    keys = self.redis_client.keys("query_cache:*")
-                    if keys:
-                        count = self.redis_client.delete(*keys)
+                # SCAN thay vì KEYS để không block Redis
+                match = f"query_cache:{pattern}*" if pattern else "query_cache:*"
+                keys = list(self.redis_client.scan_iter(match=match, count=500))
+                if keys:
+                    count = self.redis_client.unlink(*keys)
             else:
                 # In-memory cache
                 if pattern:
@@ -251,6 +307,15 @@ class QueryCacheService:
         if total_requests > 0:
             stats["hit_rate"] = stats["hits"] / total_requests
         
+        stats["namespaces"] = {
+            namespace: {
+                **ns_stats,
+                "hit_rate": ns_stats["hits"] / (ns_stats["hits"] + ns_stats["misses"])
+                if ns_stats["hits"] + ns_stats["misses"] > 0 else 0.0
+            }
+            for namespace, ns_stats in _namespace_stats.items()
+        }
+        
         if not self.use_redis:
             stats["memory_entries"] = len(_memory_cache)
         
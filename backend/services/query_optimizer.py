@@ -6,10 +6,29 @@ from sqlalchemy import text, Engine
 from typing import Dict, Any, Optional, List
 import logging
 import json
+import os
 import re
+import time
 
 logger = logging.getLogger(__name__)
 
+# Cache kết quả pg_stat_statements: {(min_time, limit): (expires_at, rows)}
+# Key do user truyền vào -> clamp limit và giới hạn số entries để cache không tăng vô hạn
+SLOW_QUERIES_CACHE_TTL = float(os.getenv("SLOW_QUERIES_CACHE_TTL", "10"))
+SLOW_QUERIES_CACHE_MAX_ENTRIES = int(os.getenv("SLOW_QUERIES_CACHE_MAX_ENTRIES", "32"))
+SLOW_QUERIES_MAX_LIMIT = int(os.getenv("SLOW_QUERIES_MAX_LIMIT", "500"))
+_slow_queries_cache: Dict[tuple, tuple] = {}
+
+
+def _store_slow_queries(cache_key: tuple, rows: List[Dict[str, Any]]) -> None:
+    """Lưu kết quả vào cache, bỏ entries hết hạn (và entry cũ nhất nếu vẫn đầy)"""
+    now = time.monotonic()
+    for key in [key for key, (expires_at, _) in _slow_queries_cache.items() if expires_at <= now]:
+        _slow_queries_cache.pop(key, None)
+    while len(_slow_queries_cache) >= SLOW_QUERIES_CACHE_MAX_ENTRIES:
+        _slow_queries_cache.pop(next(iter(_slow_queries_cache)), None)
+    _slow_queries_cache[cache_key] = (now + SLOW_QUERIES_CACHE_TTL, rows)
+
 
 class QueryOptimizer:
     """Utility class để optimize và analyze database queries"""
@@ -17,28 +36,45 @@ class QueryOptimizer:
     def __init__(self, engine: Engine):
         self.engine = engine
     
-    def explain_analyze(self, query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def explain_analyze(
+        self,
+        query: str,
+        params: Optional[Dict[str, Any]] = None,
+        analyze: bool = False
+    ) -> Dict[str, Any]:
         """
-        Chạy EXPLAIN ANALYZE cho query và trả về kết quả
+        Chạy EXPLAIN cho query và trả về kết quả
+        
+        Mặc định chỉ lấy plan ước lượng (query KHÔNG được thực thi). Với analyze=True,
+        query được thực thi thật (EXPLAIN ANALYZE) trong transaction bị rollback ngay
+        sau đó để không để lại side effects. Plan của các query chậm trên production
+        nên lấy từ auto_explain (DB_AUTO_EXPLAIN) thay vì chạy lại.
         
         Args:
             query: SQL query string
             params: Query parameters (optional)
+            analyze: Thực thi query để lấy actual time/rows
         
         Returns:
             Dict chứa execution plan và statistics
         """
-        explain_query = f"EXPLAIN (ANALYZE, BUFFERS, VERBOSE, FORMAT JSON) {query}"
+        options = "ANALYZE, BUFFERS, VERBOSE, FORMAT JSON" if analyze else "VERBOSE, FORMAT JSON"
+        explain_query = f"EXPLAIN ({options}) {query}"
         
         try:
             with self.engine.connect() as conn:
-                if params:
-                    result = conn.execute(text(explain_query), params)
-                else:
-                    result = conn.execute(text(explain_query))
+                trans = conn.begin()
+                try:
+                    if params:
+                        result = conn.execute(text(explain_query), params)
+                    else:
+                        result = conn.execute(text(explain_query))
+                    
+                    # EXPLAIN với FORMAT JSON trả về một row với một column chứa JSON
+                    row = result.fetchone()
+                finally:
+                    trans.rollback()
                 
-                # EXPLAIN ANALYZE với FORMAT JSON trả về một row với một column chứa JSON
-                row = result.fetchone()
                 if row:
                     plan_json = row[0]
                     if isinstance(plan_json, str):
@@ -51,7 +87,7 @@ class QueryOptimizer:
                     return {"error": "No execution plan returned"}
         
         except Exception as e:
-            logger.error(f"Error running EXPLAIN ANALYZE: {e}")
+            logger.error(f"Error running EXPLAIN: {e}")
             return {"error": str(e)}
     
     def _parse_explain_result(self, plan_data: List[Dict[str, Any]]) -> Dict[str, Any]:
@@ -108,14 +144,19 @@ class QueryOptimizer:
         
         return details
     
-    def check_index_usage(self, query: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    def check_index_usage(
+        self,
+        query: str,
+        params: Optional[Dict[str, Any]] = None,
+        analyze: bool = False
+    ) -> Dict[str, Any]:
         """
         Kiểm tra xem query có sử dụng indexes không
         
         Returns:
             Dict với thông tin về index usage
         """
-        explain_result = self.explain_analyze(query, params)
+        explain_result = self.explain_analyze(query, params, analyze=analyze)
         
         if "error" in explain_result:
             return explain_result
@@ -140,9 +181,13 @@ class QueryOptimizer:
             if node_type == "Seq Scan":
                 relation_name = plan.get("relation_name")
                 if relation_name:
+                    # Không ANALYZE thì dùng số rows ước lượng
+                    rows = plan.get("actual_rows")
+                    if rows is None:
+                        rows = plan.get("plan_rows") or 0
                     seq_scans.append({
                         "table": relation_name,
-                        "rows": plan.get("actual_rows", 0)
+                        "rows": rows
                     })
             
             # Traverse children
@@ -179,7 +224,7 @@ class QueryOptimizer:
                 "thường được query."
             )
         
-        execution_time = explain_result.get("execution_time", 0)
+        execution_time = explain_result.get("execution_time") or 0
         if execution_time > 100:  # > 100ms
             recommendations.append(
                 f"⚠️  Query execution time ({execution_time:.2f}ms) khá chậm. "
@@ -228,16 +273,30 @@ class QueryOptimizer:
         
         return suggestions
     
-    def analyze_slow_queries(self, min_execution_time: float = 100.0) -> List[Dict[str, Any]]:
+    def analyze_slow_queries(
+        self,
+        min_execution_time: float = 100.0,
+        limit: int = 50
+    ) -> List[Dict[str, Any]]:
         """
         Analyze slow queries từ pg_stat_statements (nếu available)
         
+        Filter, sort, LIMIT và cắt query text đều làm trong SQL; kết quả được cache
+        SLOW_QUERIES_CACHE_TTL giây để dashboard poll liên tục không query lại mỗi lần.
+        
         Args:
-            min_execution_time: Minimum execution time in milliseconds
+            min_execution_time: Minimum mean execution time in milliseconds
+            limit: Số queries tối đa trả về
         
         Returns:
             List of slow queries với statistics
         """
+        limit = max(1, min(limit, SLOW_QUERIES_MAX_LIMIT))
+        cache_key = (min_execution_time, limit)
+        cached = _slow_queries_cache.get(cache_key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        
         try:
             # Kiểm tra xem pg_stat_statements extension có được enable không
             check_ext_query = """
@@ -253,37 +312,49 @@ class QueryOptimizer:
                                  "Không thể analyze slow queries.")
                     return []
                 
-                # Query slow queries
+                # Chỉ lấy queries của database hiện tại, xếp theo tổng thời gian (tải thực tế)
                 slow_queries_query = text("""
                     SELECT 
-                        query,
+                        queryid,
+                        left(query, 200) AS query,
                         calls,
                         total_exec_time,
                         mean_exec_time,
                         max_exec_time,
                         min_exec_time,
-                        stddev_exec_time
+                        stddev_exec_time,
+                        shared_blks_hit,
+                        shared_blks_read
                     FROM pg_stat_statements
                     WHERE mean_exec_time >= :min_time
-                    ORDER BY mean_exec_time DESC
-                    LIMIT 20
+                      AND dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+                    ORDER BY total_exec_time DESC
+                    LIMIT :limit
                 """)
                 
-                result = conn.execute(slow_queries_query, {"min_time": min_execution_time})
-                
-                slow_queries = []
-                for row in result:
-                    slow_queries.append({
-                        "query": row[0][:200] + "..." if len(row[0]) > 200 else row[0],
-                        "calls": row[1],
-                        "total_exec_time": float(row[2]),
-                        "mean_exec_time": float(row[3]),
-                        "max_exec_time": float(row[4]),
-                        "min_exec_time": float(row[5]),
-                        "stddev_exec_time": float(row[6]) if row[6] else None
-                    })
+                result = conn.execute(
+                    slow_queries_query,
+                    {"min_time": min_execution_time, "limit": limit}
+                )
                 
-                return slow_queries
+                slow_queries = [
+                    {
+                        "queryid": row.queryid,
+                        "query": row.query,
+                        "calls": row.calls,
+                        "total_exec_time": round(float(row.total_exec_time), 1),
+                        "mean_exec_time": round(float(row.mean_exec_time), 2),
+                        "max_exec_time": round(float(row.max_exec_time), 2),
+                        "min_exec_time": round(float(row.min_exec_time), 2),
+                        "stddev_exec_time": round(float(row.stddev_exec_time), 2) if row.stddev_exec_time else None,
+                        "shared_blks_hit": row.shared_blks_hit,
+                        "shared_blks_read": row.shared_blks_read
+                    }
+                    for row in result
+                ]
+            
+            _store_slow_queries(cache_key, slow_queries)
+            return slow_queries
         
         except Exception as e:
             logger.error(f"Error analyzing slow queries: {e}")
@@ -3,27 +3,891 @@ Semantic Search Service để tìm kiếm ngữ nghĩa
 Sử dụng embeddings để tìm conversations tương tự
 Hỗ trợ cả JSON text storage và pgvector
 """
+import asyncio
+import hashlib
 import json
 import logging
+import math
 import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from typing import List, Dict, Any, Optional, Tuple
 import numpy as np
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, insert, bindparam, func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .embedding_service import embedding_service, normalize_cache_text
+from .query_cache_service import get_query_cache_service
 
-from .embedding_service import embedding_service
+# orjson parse nhanh hơn json stdlib nhiều lần (optional)
+try:
+    import orjson
+    _json_loads = orjson.loads
+    
+    def _json_dumps(obj: Any) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+# SimSIMD: kernel cosine SIMD (AVX-512/NEON) cho cả corpus trong một lời gọi (optional)
+try:
+    import simsimd
+    SIMSIMD_AVAILABLE = True
+except ImportError:
+    simsimd = None
+    SIMSIMD_AVAILABLE = False
+
+# Numba: JIT kernels cho cosine (optional)
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def _cosine_kernel(q, v):
+        """Cosine của 2 vectors trong một vòng lặp (dot + 2 norms)"""
+        d = 0.0
+        na = 0.0
+        nb = 0.0
+        for i in range(q.shape[0]):
+            a = q[i]
+            b = v[i]
+            d += a * b
+            na += a * a
+            nb += b * b
+        return d / (math.sqrt(na * nb) + 1e-8)
+    
+    def _make_cosine_kernels(dim):
+        """
+        Tạo kernels với dimension D là hằng số lúc compile: LLVM unroll/vector hóa
+        hoàn toàn vòng dot product (không cache được vì là closure)
+        """
+        @njit(fastmath=True, parallel=True)
+        def _cosine_batch_kernel(matrix, q, norms):
+            """Cosine của query (đã normalize) với mọi row (norms tính sẵn), không tạo bản float32 tạm của matrix"""
+            n = matrix.shape[0]
+            out = np.empty(n, dtype=np.float32)
+            for i in prange(n):
+                d = 0.0
+                for j in range(dim):
+                    d += q[j] * np.float32(matrix[i, j])
+                out[i] = d / norms[i]
+            return out
+        
+        @njit(fastmath=True)
+        def _cosine_topk_kernel(matrix, q, norms, allowed, threshold, k):
+            """
+            Một lượt qua matrix: dot + chia norm + threshold + min-heap top-k
+            Không tạo mảng scores N phần tử; norms/allowed rỗng = không dùng
+        
+            Returns:
+                (row indices, scores) sắp xếp giảm dần, số rows >= threshold
+            """
+            heap_s = np.empty(k, dtype=np.float32)
+            heap_i = np.empty(k, dtype=np.int64)
+            size = 0
+            matched = 0
+            for i in range(matrix.shape[0]):
+                if allowed.shape[0] and not allowed[i]:
+                    continue
+                d = np.float32(0.0)
+                for j in range(dim):
+                    d += q[j] * np.float32(matrix[i, j])
+                if norms.shape[0]:
+                    d /= norms[i]
+                s = d
+                if s < threshold:
+                    continue
+                matched += 1
+                if size < k:
+                    # Sift up
+                    pos = size
+                    size += 1
+                    while pos > 0:
+                        parent = (pos - 1) // 2
+                        if heap_s[parent] <= s:
+                            break
+                        heap_s[pos] = heap_s[parent]
+                        heap_i[pos] = heap_i[parent]
+                        pos = parent
+                    heap_s[pos] = s
+                    heap_i[pos] = i
+                elif s > heap_s[0]:
+                    # Thay root (nhỏ nhất) rồi sift down
+                    pos = 0
+                    while True:
+                        child = 2 * pos + 1
+                        if child >= size:
+                            break
+                        if child + 1 < size and heap_s[child + 1] < heap_s[child]:
+                            child += 1
+                        if heap_s[child] >= s:
+                            break
+                        heap_s[pos] = heap_s[child]
+                        heap_i[pos] = heap_i[child]
+                        pos = child
+                    heap_s[pos] = s
+                    heap_i[pos] = i
+            order = np.argsort(-heap_s[:size])
+            return heap_i[:size][order], heap_s[:size][order], matched
+        
+        return _cosine_batch_kernel, _cosine_topk_kernel
+
+
+_dim_kernels: Dict[int, Tuple[Any, Any]] = {}
+_dim_kernels_lock = threading.Lock()
+
+
+def _get_cosine_kernels(dim: int) -> Tuple[Any, Any]:
+    """(batch kernel, top-k kernel) numba đã specialize cho dimension `dim`"""
+    kernels = _dim_kernels.get(dim)
+    if kernels is None:
+        with _dim_kernels_lock:
+            kernels = _dim_kernels.get(dim)
+            if kernels is None:
+                kernels = _make_cosine_kernels(dim)
+                _dim_kernels[dim] = kernels
+    return kernels
+
+
+def _warm_cosine_kernels(matrix: np.ndarray, norms: Optional[np.ndarray]) -> None:
+    """Gọi mỗi kernel một lần trên 1 row để numba compile ngay lúc build ma trận (không phải trong request đầu)"""
+    batch_kernel, topk_kernel = _get_cosine_kernels(matrix.shape[1])
+    sample = np.ascontiguousarray(matrix[:1])
+    query = np.zeros(matrix.shape[1], dtype=np.float32)
+    sample_norms = np.ones(1, dtype=np.float32)
+    if matrix.dtype == np.int8:
+        batch_kernel(sample, query, sample_norms)
+    if SEMANTIC_FUSED_TOPK and matrix.dtype != np.float16:
+        topk_kernel(
+            sample, query, sample_norms if norms is not None else np.empty(0, dtype=np.float32),
+            np.empty(0, dtype=np.bool_), np.float32(-np.inf), 1
+        )
 
 logger = logging.getLogger(__name__)
 
 # Check if pgvector is enabled
 USE_PGVECTOR = os.getenv("USE_PGVECTOR", "false").lower() == "true"
 
+# Cache kết quả semantic search theo query đã chuẩn hóa (invalidate khi index conversation mới)
+SEMANTIC_CACHE_NAMESPACE = "semantic"
+SEMANTIC_SEARCH_CACHE_TTL = int(os.getenv("SEMANTIC_SEARCH_CACHE_TTL", "300"))
+
+# Best response tính sẵn lúc index: user_message đã chuẩn hóa -> conversation_id của response tốt nhất
+BEST_RESPONSE_CACHE_NAMESPACE = "best_response"
+BEST_RESPONSE_CACHE_TTL = int(os.getenv("BEST_RESPONSE_CACHE_TTL", "3600"))
+
+# Kết quả kiểm tra vector columns (schema không đổi khi app đang chạy -> chỉ check một lần)
+_vector_columns_available: Optional[bool] = None
+
+
+# Ma trận embeddings trong memory: append rows mới khi dirty hoặc mỗi REFRESH_INTERVAL giây
+# (để thấy embeddings do worker process khác index), full rebuild sau TTL
+EMBEDDING_MATRIX_TTL = int(os.getenv("EMBEDDING_MATRIX_TTL", "300"))
+EMBEDDING_MATRIX_REFRESH_INTERVAL = float(os.getenv("EMBEDDING_MATRIX_REFRESH_INTERVAL", "5"))
+EMBEDDING_MATRIX_LOAD_BATCH = int(os.getenv("EMBEDDING_MATRIX_LOAD_BATCH", "1000"))
+# Numba: gộp dot + threshold + top-k vào một lượt quét (bỏ qua score memo / query batching)
+SEMANTIC_FUSED_TOPK = os.getenv("SEMANTIC_FUSED_TOPK", "false").lower() == "true"
+# Threads decode JSON/bytes của từng batch rows trong khi cursor fetch batch tiếp theo; 0 = decode inline
+EMBEDDING_PARSE_WORKERS = int(os.getenv("EMBEDDING_PARSE_WORKERS", "2"))
+# Ma trận không lượng tử hóa giữ ở float16 (nửa bộ nhớ / bandwidth so với float32)
+EMBEDDING_MATRIX_FP16 = os.getenv("EMBEDDING_MATRIX_FP16", "true").lower() == "true"
+# Số rows mỗi tile khi upcast float16 -> float32 để tính matvec (tile nằm gọn trong L2)
+EMBEDDING_MATRIX_TILE_ROWS = int(os.getenv("EMBEDDING_MATRIX_TILE_ROWS", "4096"))
+# Gom các queries đến trong cùng cửa sổ (ms) thành một GEMM M @ Q.T; 0 = tắt (mặc định,
+# bật khi tải cao: mỗi query phải chờ thêm tối đa window ms)
+SEMANTIC_BATCH_WINDOW_MS = float(os.getenv("SEMANTIC_BATCH_WINDOW_MS", "0"))
+SEMANTIC_BATCH_MAX_QUERIES = int(os.getenv("SEMANTIC_BATCH_MAX_QUERIES", "32"))
+
+
+# LRU embeddings của query trong process (key = blake2b của query đã chuẩn hóa)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+_query_embedding_cache: "OrderedDict[bytes, List[float]]" = OrderedDict()
+_query_embedding_lock = threading.Lock()
+
+# Semantic cache: dùng lại kết quả của query trước nếu cosine giữa 2 query >= threshold
+SEMANTIC_QUERY_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_QUERY_CACHE_THRESHOLD", "0.97"))
+SEMANTIC_QUERY_CACHE_SIZE = int(os.getenv("SEMANTIC_QUERY_CACHE_SIZE", "256"))
+
+
+class SemanticResultCache:
+    """LRU kết quả search theo query vector; lookup bằng một matvec trên các query vectors đã cache"""
+    
+    def __init__(self, max_entries: int, threshold: float, ttl: int):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self._entries: "OrderedDict[int, Tuple[str, np.ndarray, List[Dict[str, Any]], float]]" = OrderedDict()
+        self._next_key = 0
+        self._lock = threading.Lock()
+    
+    def lookup(self, query: np.ndarray, params_key: str) -> Optional[List[Dict[str, Any]]]:
+        """Trả về kết quả đã cache của query (unit vector) đủ giống (cùng search params), hoặc None"""
+        if self.max_entries <= 0:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                (key, vec, results)
+                for key, (p_key, vec, results, expires_at) in self._entries.items()
+                if p_key == params_key and expires_at > now and vec.shape == query.shape
+            ]
+            if not candidates:
+                return None
+            sims = np.stack([vec for _, vec, _ in candidates]) @ query
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            key, _, results = candidates[best]
+            self._entries.move_to_end(key)
+            return results
+    
+    def store(self, query: np.ndarray, params_key: str, results: List[Dict[str, Any]]) -> None:
+        """Lưu kết quả search của query vector (unit vector)"""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[self._next_key] = (params_key, query, results, time.monotonic() + self.ttl)
+            self._next_key += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        """Xóa toàn bộ (khi có embeddings mới)"""
+        with self._lock:
+            self._entries.clear()
+
+
+_semantic_result_cache = SemanticResultCache(
+    SEMANTIC_QUERY_CACHE_SIZE, SEMANTIC_QUERY_CACHE_THRESHOLD, SEMANTIC_SEARCH_CACHE_TTL
+)
+
+
+def to_f32_bytes(vec: Any) -> Optional[bytes]:
+    """Vector -> float32 bytes (BYTEA), đọc lại bằng np.frombuffer(..., dtype=np.float32)"""
+    if vec is None:
+        return None
+    return np.asarray(vec, dtype=np.float32).tobytes()
+
+
+def unit_query_vector(vec: Any) -> np.ndarray:
+    """Query embedding dạng float32 đã L2-normalize (tính một lần cho mọi bước scoring)"""
+    q = np.asarray(vec, dtype=np.float32)
+    q /= (np.linalg.norm(q) + 1e-8)
+    return q
+
+
+def quantize_int8(vec: Any) -> Tuple[np.ndarray, float]:
+    """
+    Lượng tử hóa absmax một vector sang int8
+    
+    Returns:
+        (vector int8, scale) với vector gốc ≈ int8 * scale
+    """
+    v = np.asarray(vec, dtype=np.float32)
+    max_abs = float(np.max(np.abs(v))) if v.size else 0.0
+    if max_abs == 0.0:
+        return np.zeros(v.shape, dtype=np.int8), 1.0
+    c = 127.0 / max_abs
+    return np.round(v * c).astype(np.int8), 1.0 / c
+
+
+# Binary prescreen (1 bit/dimension): với corpus >= BINARY_PRESCREEN_MIN_ROWS rows, chỉ tính
+# cosine cho BINARY_PRESCREEN_FACTOR * limit rows có Hamming distance nhỏ nhất
+BINARY_PRESCREEN_MIN_ROWS = int(os.getenv("BINARY_PRESCREEN_MIN_ROWS", "20000"))
+BINARY_PRESCREEN_FACTOR = int(os.getenv("BINARY_PRESCREEN_FACTOR", "5"))
+SCORE_MEMO_SIZE = int(os.getenv("SEMANTIC_SCORE_MEMO_SIZE", "32"))
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+_embedding_parse_executor = (
+    ThreadPoolExecutor(max_workers=EMBEDDING_PARSE_WORKERS, thread_name_prefix="embedding-parse")
+    if EMBEDDING_PARSE_WORKERS > 0 else None
+)
+
+
+def _decode_embedding_rows(
+    rows: List[Any],
+    quantized: bool
+) -> Tuple[List[Tuple[int, np.ndarray, Optional[int]]], int]:
+    """
+    Decode một batch rows (conversation_id, i8, f32, json, rating) thành vectors
+    
+    Returns:
+        ([(conversation_id, vector, rating)], số rows lỗi)
+    """
+    decoded = []
+    skipped = 0
+    for conv_id, emb_i8, emb_f32, emb_str, rating in rows:
+        try:
+            if emb_i8 is not None:
+                vec = np.frombuffer(emb_i8, dtype=np.int8)
+            else:
+                if emb_f32 is not None:
+                    vec = np.frombuffer(emb_f32, dtype=np.float32)
+                else:
+                    vec = np.asarray(_json_loads(emb_str), dtype=np.float32)
+                if vec.ndim != 1 or not np.isfinite(vec).all():
+                    # Validate một lần khi build, kernels scoring không cần kiểm tra từng row
+                    skipped += 1
+                    continue
+                if quantized:
+                    vec, _ = quantize_int8(vec)
+        except Exception:
+            skipped += 1
+            continue
+        decoded.append((conv_id, vec, rating))
+    return decoded, skipped
+
+
+class EmbeddingMatrixCache:
+    """
+    Embeddings của một cột (combined/user_message) dạng ma trận (N, D) liên tục
+    Parse JSON một lần khi build; mỗi query chỉ còn một matvec thay vì json.loads từng row
+    
+    quantized=True: ma trận int8 từ cột {column}_i8 (rows chưa có cột int8 thì
+    lượng tử hóa từ JSON khi load), nhỏ hơn 4 lần so với float32
+    quantized=False: rows L2-normalized, lưu float16 nếu EMBEDDING_MATRIX_FP16
+    
+    Embeddings mới được append theo high-water mark conversation_id (chỉ load rows mới);
+    full rebuild sau EMBEDDING_MATRIX_TTL để thấy rows bị xóa/re-index ở process khác
+    """
+    
+    def __init__(self, column: str, quantized: bool = False):
+        self.column = column
+        self.quantized = quantized
+        # Views [:n] của các buffers bên dưới (buffers có capacity dư để append không copy)
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: Optional[np.ndarray] = None
+        self._norms: Optional[np.ndarray] = None
+        self._bits: Optional[np.ndarray] = None
+        # Rating (max) của mỗi row, -1 = chưa có feedback; filter rating không cần JOIN lúc query
+        self._ratings: Optional[np.ndarray] = None
+        self._buffers: Dict[str, Optional[np.ndarray]] = {}
+        self._n = 0
+        # conversation_id lớn nhất đã load; conversation_ids <= mốc này được index lại -> _reindexed
+        self._last_id = 0
+        self._reindexed: set = set()
+        # SQL của build cố định theo cột -> tạo statements một lần
+        i8_column = f"ce.{column}_i8" if quantized else "NULL"
+        where = f"WHERE ce.{column} IS NOT NULL"
+        # Ưu tiên cột binary (int8 / float32 bytes), chỉ đọc JSON của rows chưa có bản binary
+        select = f"""
+            SELECT ce.conversation_id, {i8_column}, ce.{column}_f32,
+                   CASE WHEN {i8_column} IS NULL AND ce.{column}_f32 IS NULL THEN ce.{column} END,
+                   cf.rating
+            FROM conversation_embeddings ce
+            LEFT JOIN (
+                SELECT conversation_id, MAX(rating) AS rating
+                FROM conversation_feedback
+                GROUP BY conversation_id
+            ) cf ON cf.conversation_id = ce.conversation_id
+            {where}
+        """
+        # Count trả về cả MAX(conversation_id): select chỉ đọc rows <= mốc này (rows insert sau COUNT
+        # để dành cho lần refresh sau, không bị cắt mất giữa chừng)
+        count = f"SELECT COUNT(*), MAX(ce.conversation_id) FROM conversation_embeddings ce {where}"
+        bounded = " AND ce.conversation_id <= :max_id ORDER BY ce.conversation_id"
+        self._count_sql = text(count)
+        self._select_sql = text(select + bounded)
+        new_rows = " AND ce.conversation_id > :last_id"
+        self._count_new_sql = text(count + new_rows)
+        self._select_new_sql = text(select + new_rows + bounded)
+        by_ids = " AND ce.conversation_id IN :ids"
+        self._count_ids_sql = text(count + by_ids).bindparams(bindparam("ids", expanding=True))
+        self._select_ids_sql = text(select + by_ids + bounded).bindparams(bindparam("ids", expanding=True))
+        self._dirty = True
+        self._built_at = 0.0
+        self._refreshed_at = 0.0
+        # Scores theo query vector gần đây: find_best_response và get_semantic_context của cùng
+        # một lượt chat dùng chung một lần tính trên toàn corpus
+        self._score_memo: "OrderedDict[bytes, Tuple[np.ndarray, np.ndarray]]" = OrderedDict()
+        # _lock: state nhỏ (memo, dirty, reindexed), giữ rất ngắn vì rank_all chạy trên event loop
+        # _build_lock: serialize build/refresh (query DB) chạy trên worker thread
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+    
+    async def rank_all(self, matrix: np.ndarray, norms: Optional[np.ndarray], query_vec: np.ndarray) -> np.ndarray:
+        """Cosine scores của query với toàn bộ matrix, memo theo query vector (read-only array)"""
+        key = hashlib.blake2b(query_vec.tobytes(), digest_size=16).digest()
+        with self._lock:
+            hit = self._score_memo.get(key)
+            if hit is not None and hit[0] is matrix:
+                self._score_memo.move_to_end(key)
+                return hit[1]
+        
+        scores = await _score_batcher.score(matrix, norms, query_vec)
+        scores.setflags(write=False)
+        with self._lock:
+            self._score_memo[key] = (matrix, scores)
+            while len(self._score_memo) > SCORE_MEMO_SIZE:
+                self._score_memo.popitem(last=False)
+        return scores
+    
+    def mark_dirty(self, conversation_ids: Optional[List[int]] = None) -> None:
+        """
+        Đánh dấu có embeddings mới: query tiếp theo chỉ load rows mới (không rebuild)
+        conversation_ids: ids vừa index; ids <= high-water mark (re-index) được load lại theo id
+        """
+        with self._lock:
+            if conversation_ids:
+                self._reindexed.update(i for i in conversation_ids if i <= self._last_id)
+            self._dirty = True
+    
+    def set_rating(self, conversation_id: int, rating: int) -> None:
+        """
+        Cập nhật rating slot của conversation sau khi có feedback (không cần rebuild ma trận)
+        Giống lúc load (MAX(rating) theo conversation): chỉ nâng slot lên, không ghi đè rating cao hơn
+        """
+        with self._lock:
+            if self._ids is None:
+                return
+            rows = np.flatnonzero(self._ids == conversation_id)
+            if rows.size:
+                self._ratings[rows] = np.maximum(self._ratings[rows], np.clip(rating, -128, 127))
+    
+    def get(self, db: Session) -> Tuple[np.ndarray, np.ndarray, Optional[np.ndarray], np.ndarray, np.ndarray]:
+        """
+        Trả về (matrix, ids, norms, bits, ratings): full build lần đầu / sau TTL,
+        append rows mới nếu dirty hoặc sau EMBEDDING_MATRIX_REFRESH_INTERVAL (rows do process khác index)
+        norms = None với ma trận float32 (rows đã được L2-normalize)
+        bits: sign bits (N, D/8) uint8 cho Hamming prescreen
+        ratings: int8 song song với rows (-1 = chưa có feedback)
+        Sync + có thể query DB -> caller async chạy qua asyncio.to_thread
+        """
+        with self._build_lock:
+            now = time.monotonic()
+            if self._matrix is None or now - self._built_at > EMBEDDING_MATRIX_TTL:
+                self._build(db)
+            elif self._dirty or now - self._refreshed_at > EMBEDDING_MATRIX_REFRESH_INTERVAL:
+                self._refresh(db)
+            return self._matrix, self._ids, self._norms, self._bits, self._ratings
+    
+    def _load(
+        self,
+        db: Session,
+        count_sql: Any,
+        select_sql: Any,
+        params: Dict[str, Any],
+        dim: Optional[int] = None
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Stream rows của select_sql (server-side cursor, theo thứ tự conversation_id) vào mảng preallocated
+        Chỉ đọc rows có conversation_id <= MAX lúc COUNT; COUNT chỉ để preallocate (thiếu chỗ thì grow)
+        
+        Returns:
+            (matrix đã chuẩn bị cho scoring, ids, ratings)
+        """
+        dtype = np.int8 if self.quantized else np.float32
+        count, max_id = db.execute(count_sql, params).one()
+        count = count or 0
+        matrix = np.empty((count, dim), dtype=dtype) if dim else None
+        ids = np.empty(count, dtype=np.int64)
+        ratings = np.full(count, -1, dtype=np.int8)
+        n = 0
+        skipped = 0
+        pending = deque()
+        
+        def consume(decoded: Tuple[List[Tuple[int, np.ndarray, Optional[int]]], int]) -> None:
+            """Copy một batch đã decode vào ma trận preallocated"""
+            nonlocal matrix, ids, ratings, n, skipped
+            rows, batch_skipped = decoded
+            skipped += batch_skipped
+            for conv_id, vec, rating in rows:
+                if n >= ids.shape[0]:
+                    # Có rows (id <= max_id) commit sau COUNT -> grow thay vì bỏ
+                    capacity = max(n + 1, int(n * 1.5))
+                    ids = np.resize(ids, capacity)
+                    ratings = np.resize(ratings, capacity)
+                    ratings[n:] = -1
+                    if matrix is not None:
+                        grown = np.empty((capacity, matrix.shape[1]), dtype=dtype)
+                        grown[:n] = matrix[:n]
+                        matrix = grown
+                if matrix is None:
+                    matrix = np.empty((ids.shape[0], vec.shape[0]), dtype=dtype)
+                if vec.shape[0] != matrix.shape[1]:
+                    # Embedding của model khác dimension -> không so sánh được
+                    skipped += 1
+                    continue
+                matrix[n] = vec
+                ids[n] = conv_id
+                if rating is not None:
+                    ratings[n] = max(-128, min(127, rating))
+                n += 1
+        
+        if count:
+            result = db.execute(
+                select_sql,
+                {**params, "max_id": max_id},
+                execution_options={"stream_results": True, "yield_per": EMBEDDING_MATRIX_LOAD_BATCH}
+            )
+            # Pipeline: thread pool decode batch k trong khi cursor fetch batch k+1 từ DB
+            for partition in result.partitions():
+                if _embedding_parse_executor is None:
+                    consume(_decode_embedding_rows(partition, self.quantized))
+                    continue
+                pending.append(_embedding_parse_executor.submit(_decode_embedding_rows, partition, self.quantized))
+                while len(pending) > EMBEDDING_PARSE_WORKERS:
+                    consume(pending.popleft().result())
+            while pending:
+                consume(pending.popleft().result())
+            result.close()
+        
+        if skipped:
+            logger.warning(f"Embedding matrix ({self.column}): skipped {skipped} invalid/mismatched embeddings")
+        if matrix is None:
+            matrix = np.empty((0, 0), dtype=dtype)
+        matrix = matrix[:n]
+        if not self.quantized:
+            # L2-normalize rows một lần -> cosine = một GEMV M @ q, không cần norms lúc query
+            matrix /= (np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-8)
+            if EMBEDDING_MATRIX_FP16:
+                matrix = matrix.astype(np.float16)
+        return matrix, ids[:n], ratings[:n]
+    
+    def _derived(self, matrix: np.ndarray) -> Tuple[Optional[np.ndarray], np.ndarray]:
+        """(norms, sign bits) của các rows (norms chỉ cần cho ma trận int8)"""
+        norms = np.linalg.norm(matrix.astype(np.float32), axis=1) + 1e-8 if self.quantized else None
+        # Sign bits tính từ ma trận đã load (không cần lưu thêm cột trong DB)
+        return norms, np.packbits(matrix > 0, axis=1)
+    
+    def _publish(self) -> None:
+        """Cập nhật views [:n] (object mới -> score memo theo identity của matrix tự hết hiệu lực)"""
+        n = self._n
+        buffers = self._buffers
+        self._matrix = buffers["matrix"][:n]
+        self._ids = buffers["ids"][:n]
+        self._ratings = buffers["ratings"][:n]
+        self._bits = buffers["bits"][:n]
+        self._norms = buffers["norms"][:n] if buffers["norms"] is not None else None
+        if NUMBA_AVAILABLE and n:
+            # Compile sẵn kernels specialize theo dimension/dtype của corpus (đang ở worker thread)
+            _warm_cosine_kernels(self._matrix, self._norms)
+    
+    def _build(self, db: Session) -> None:
+        """Full load embeddings từ DB vào ma trận mới"""
+        with self._lock:
+            self._dirty = False
+            self._reindexed.clear()
+        matrix, ids, ratings = self._load(db, self._count_sql, self._select_sql, {})
+        norms, bits = self._derived(matrix)
+        self._buffers = {"matrix": matrix, "ids": ids, "ratings": ratings, "bits": bits, "norms": norms}
+        self._n = matrix.shape[0]
+        self._last_id = int(ids.max()) if ids.size else 0
+        self._publish()
+        self._built_at = self._refreshed_at = time.monotonic()
+        with self._lock:
+            self._score_memo.clear()
+        logger.debug(f"Built embedding matrix ({self.column}): {self._matrix.shape}")
+    
+    def _refresh(self, db: Session) -> None:
+        """Load rows có conversation_id > high-water mark (+ rows re-index) và append vào buffers"""
+        dim = self._matrix.shape[1] if self._n else None
+        # Clear trước khi query: mark_dirty xảy ra trong lúc load vẫn được refresh lần sau
+        with self._lock:
+            reindexed, self._reindexed = self._reindexed, set()
+            self._dirty = False
+        if reindexed:
+            matrix, ids, ratings = self._load(
+                db, self._count_ids_sql, self._select_ids_sql, {"ids": list(reindexed)}, dim
+            )
+            if ids.size:
+                # Rows đã có trong ma trận -> ghi đè tại chỗ, còn lại append
+                hit = np.flatnonzero(np.isin(self._ids, ids))
+                positions = {int(self._ids[row]): row for row in hit}
+                rows = np.array([positions.get(int(conv_id), -1) for conv_id in ids], dtype=np.int64)
+                existing = rows >= 0
+                if existing.any():
+                    # Copy-on-write: request đang giữ views đã publish không thấy rows bị ghi giữa chừng
+                    norms, bits = self._derived(matrix[existing])
+                    buffers = {
+                        name: buffer.copy() if buffer is not None and name != "ids" else buffer
+                        for name, buffer in self._buffers.items()
+                    }
+                    buffers["matrix"][rows[existing]] = matrix[existing]
+                    buffers["ratings"][rows[existing]] = ratings[existing]
+                    buffers["bits"][rows[existing]] = bits
+                    if norms is not None:
+                        buffers["norms"][rows[existing]] = norms
+                    self._buffers = buffers
+                    self._publish()
+                    with self._lock:
+                        self._score_memo.clear()
+                self._append(matrix[~existing], ids[~existing], ratings[~existing])
+                dim = dim or (self._matrix.shape[1] if self._n else None)
+        
+        matrix, ids, ratings = self._load(
+            db, self._count_new_sql, self._select_new_sql, {"last_id": self._last_id}, dim
+        )
+        self._append(matrix, ids, ratings)
+        self._refreshed_at = time.monotonic()
+    
+    def _append(self, matrix: np.ndarray, ids: np.ndarray, ratings: np.ndarray) -> None:
+        """Append rows vào buffers (grow x1.5 khi hết capacity) rồi publish views mới"""
+        if not ids.size:
+            return
+        if not self._n:
+            # Ma trận đang rỗng (chưa biết dimension) -> thay buffers
+            self._buffers = {}
+        norms, bits = self._derived(matrix)
+        new_rows = {"matrix": matrix, "ids": ids, "ratings": ratings, "bits": bits, "norms": norms}
+        n, end = self._n, self._n + ids.size
+        for name, rows in new_rows.items():
+            buffer = self._buffers.get(name)
+            if rows is None:
+                self._buffers[name] = None
+                continue
+            if buffer is None or buffer.shape[0] < end:
+                grown = np.empty((max(end, int(n * 1.5)),) + rows.shape[1:], dtype=rows.dtype)
+                if buffer is not None:
+                    grown[:n] = buffer[:n]
+                buffer = self._buffers[name] = grown
+            buffer[n:end] = rows
+        self._n = end
+        self._last_id = max(self._last_id, int(ids.max()))
+        self._publish()
+        logger.debug(f"Appended {ids.size} rows to embedding matrix ({self.column}): {self._matrix.shape}")
+
+
+_embedding_matrices = {
+    "combined_embedding": EmbeddingMatrixCache("combined_embedding", quantized=True),
+    "user_message_embedding": EmbeddingMatrixCache("user_message_embedding"),
+}
+
+
+def _cosine_scores(matrix: np.ndarray, norms: Optional[np.ndarray], query_vec: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity của query với mọi row trong matrix (SimSIMD nếu có, fallback numpy)
+    query_vec: float32 đã normalize (unit_query_vector); scores thô [-1, 1], chỉ clamp top-k
+    Matrix int8: query được lượng tử hóa cùng cách để dùng kernel int8 của SimSIMD
+    Matrix float16: SimSIMD có kernel f16 native; numpy fallback upcast theo tile
+    """
+    if SIMSIMD_AVAILABLE:
+        try:
+            if matrix.dtype == np.int8:
+                query = quantize_int8(query_vec)[0]
+            else:
+                query = query_vec.astype(matrix.dtype, copy=False)
+            distances = simsimd.cdist(query.reshape(1, -1), matrix, metric="cosine")
+            return 1.0 - np.asarray(distances).ravel()
+        except Exception as e:
+            logger.warning(f"SimSIMD cdist failed, falling back to numpy: {e}")
+    # Query và matrix float đã normalize -> sims = M @ q (một SGEMV)
+    if NUMBA_AVAILABLE and matrix.dtype == np.int8:
+        # matrix @ query sẽ upcast cả ma trận int8 sang float32 tạm -> dùng kernel JIT
+        return _get_cosine_kernels(matrix.shape[1])[0](matrix, query_vec, norms)
+    return _tiled_scores(matrix, norms, query_vec.reshape(1, -1))[0]
+
+
+def _tiled_scores(matrix: np.ndarray, norms: Optional[np.ndarray], queries: np.ndarray) -> np.ndarray:
+    """
+    Scores (B, N) của các queries đã normalize, duyệt matrix theo tile EMBEDDING_MATRIX_TILE_ROWS rows
+    Mỗi tile (upcast float32 nếu là int8/float16) nằm trong L2 và được dùng cho cả B queries
+    """
+    sims = np.empty((queries.shape[0], matrix.shape[0]), dtype=np.float32)
+    for start in range(0, matrix.shape[0], EMBEDDING_MATRIX_TILE_ROWS):
+        tile = matrix[start:start + EMBEDDING_MATRIX_TILE_ROWS]
+        if tile.dtype != np.float32:
+            # BLAS không có GEMM int8/float16 -> upcast từng tile thay vì cả ma trận
+            tile = tile.astype(np.float32)
+        sims[:, start:start + tile.shape[0]] = queries @ tile.T
+    if norms is not None:
+        sims /= norms
+    return sims
+
+
+def _cosine_scores_batch(matrix: np.ndarray, norms: Optional[np.ndarray], queries: np.ndarray) -> np.ndarray:
+    """Cosine scores (B, N) của nhiều queries (đã normalize) trong một lần quét matrix"""
+    if queries.shape[0] == 1:
+        return _cosine_scores(matrix, norms, queries[0])[None]
+    if SIMSIMD_AVAILABLE:
+        try:
+            if matrix.dtype == np.int8:
+                batch = np.stack([quantize_int8(q)[0] for q in queries])
+            else:
+                batch = queries.astype(matrix.dtype, copy=False)
+            distances = simsimd.cdist(batch, matrix, metric="cosine")
+            return 1.0 - np.asarray(distances)
+        except Exception as e:
+            logger.warning(f"SimSIMD cdist failed, falling back to numpy: {e}")
+    return _tiled_scores(matrix, norms, queries)
+
+
+class QueryScoreBatcher:
+    """
+    Gom các queries đồng thời trên cùng một ma trận (trong SEMANTIC_BATCH_WINDOW_MS) thành
+    một lần quét: mỗi tile của matrix đọc từ DRAM một lần cho cả batch thay vì một lần/query
+    Scoring luôn chạy trên thread pool, không block event loop
+    """
+    
+    def __init__(self):
+        # (loop, id(matrix)) -> (matrix, norms, [(query, future)])
+        self._pending: Dict[Tuple[int, int], Tuple[np.ndarray, Optional[np.ndarray], list]] = {}
+    
+    async def score(self, matrix: np.ndarray, norms: Optional[np.ndarray], query_vec: np.ndarray) -> np.ndarray:
+        """Scores của query với toàn bộ matrix, tính chung batch với các queries đến cùng lúc"""
+        if SEMANTIC_BATCH_WINDOW_MS <= 0:
+            return await asyncio.to_thread(_cosine_scores, matrix, norms, query_vec)
+        
+        loop = asyncio.get_running_loop()
+        key = (id(loop), id(matrix))
+        future = loop.create_future()
+        entry = self._pending.get(key)
+        if entry is None:
+            entry = (matrix, norms, [])
+            self._pending[key] = entry
+            loop.call_later(SEMANTIC_BATCH_WINDOW_MS / 1000.0, self._flush, key)
+        entry[2].append((query_vec, future))
+        if len(entry[2]) >= SEMANTIC_BATCH_MAX_QUERIES:
+            self._flush(key)
+        return await future
+    
+    def _flush(self, key: Tuple[int, int]) -> None:
+        """Gửi batch đang chờ sang thread pool (gọi trên event loop)"""
+        entry = self._pending.pop(key, None)
+        if entry is None:
+            return
+        loop = asyncio.get_running_loop()
+        loop.run_in_executor(None, self._score_batch, loop, *entry)
+    
+    @staticmethod
+    def _score_batch(
+        loop: asyncio.AbstractEventLoop,
+        matrix: np.ndarray,
+        norms: Optional[np.ndarray],
+        waiters: list
+    ) -> None:
+        """Tính scores cho cả batch (worker thread), trả kết quả về futures qua call_soon_threadsafe"""
+        try:
+            scores = _cosine_scores_batch(matrix, norms, np.stack([q for q, _ in waiters]))
+            error = None
+        except Exception as e:
+            scores, error = None, e
+        loop.call_soon_threadsafe(QueryScoreBatcher._resolve, waiters, scores, error)
+    
+    @staticmethod
+    def _resolve(waiters: list, scores: Optional[np.ndarray], error: Optional[Exception]) -> None:
+        """Set kết quả/lỗi cho từng future (chạy trên event loop)"""
+        for i, (_, future) in enumerate(waiters):
+            if future.done():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(scores[i])
+
+
+_score_batcher = QueryScoreBatcher()
+
+
+def _hamming_shortlist(
+    bits: np.ndarray,
+    query_vec: np.ndarray,
+    k: int,
+    allowed: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """Index của k rows có Hamming distance nhỏ nhất giữa sign bits của row và của query"""
+    query_bits = np.packbits(query_vec > 0)
+    xor = np.bitwise_xor(bits, query_bits)
+    if hasattr(np, "bitwise_count"):
+        distances = np.bitwise_count(xor).sum(axis=1, dtype=np.int32)
+    else:
+        distances = _POPCOUNT_TABLE[xor].sum(axis=1, dtype=np.int32)
+    if allowed is not None:
+        # Rows bị filter (rating) không được chiếm chỗ trong shortlist
+        distances[~allowed] = np.iinfo(np.int32).max
+    if k >= distances.shape[0]:
+        return np.arange(distances.shape[0])
+    return np.argpartition(distances, k - 1)[:k]
+
+
+@lru_cache(maxsize=8)
+def _pgvector_search_statement(vector_column: str, filter_by_rating: bool):
+    """Statement top-k theo pgvector cosine distance cho một cột vector (có/không rating filter)"""
+    distance = f"ce.{vector_column} <=> CAST(:query_vec AS vector)"
+    
+    # ORDER BY distance LIMIT k dùng được HNSW index (idx_conversation_embeddings_*_hnsw),
+    # DB trả về đúng top-k thay vì Python quét embeddings
+    query_sql = f"""
+        SELECT 
+            ce.conversation_id,
+            ac.user_message,
+            ac.ai_response,
+            ac.session_id,
+            ac.created_at,
+            1 - ({distance}) as similarity
+        FROM conversation_embeddings ce
+        JOIN agent_conversations ac ON ce.conversation_id = ac.id
+        WHERE ce.{vector_column} IS NOT NULL
+          AND {distance} <= :max_distance
+    """
+    
+    # Rating filter (EXISTS để không nhân bản rows khi có nhiều feedback)
+    if filter_by_rating:
+        query_sql += """
+          AND EXISTS (
+              SELECT 1 FROM conversation_feedback cf
+              WHERE cf.conversation_id = ce.conversation_id AND cf.rating >= :min_rating
+          )
+        """
+    
+    # Order by distance ASC (= similarity DESC) và limit
+    query_sql += f" ORDER BY {distance} LIMIT :result_limit"
+    return text(query_sql)
+
+
+def has_vector_columns(db: Session) -> bool:
+    """Kiểm tra (và cache) xem conversation_embeddings có pgvector columns không"""
+    global _vector_columns_available
+    if _vector_columns_available is None:
+        check_sql = """
+            SELECT column_name 
+            FROM information_schema.columns 
+            WHERE table_name = 'conversation_embeddings' 
+            AND column_name = 'combined_embedding_vector'
+        """
+        _vector_columns_available = db.execute(text(check_sql)).fetchone() is not None
+    return _vector_columns_available
+
 class SemanticSearchService:
-    """Service để tìm kiếm ngữ nghĩa sử dụng embeddings"""
+    """
+    Service để tìm kiếm ngữ nghĩa sử dụng embeddings
     
-    def __init__(self, db: Session):
+    Có thể dùng như singleton (khởi tạo không có db, truyền db vào từng method)
+    hoặc gắn với một session cố định như trước: SemanticSearchService(db).
+    """
+    
+    def __init__(self, db: Optional[Session] = None):
         self.db = db
     
+    async def embed_query(self, query_text: str) -> Optional[List[float]]:
+        """
+        Generate embedding cho query (dùng lại được cho nhiều lần search trong một request)
+        Query lặp lại lấy từ LRU trong process, không gọi embedding service
+        """
+        key = hashlib.blake2b(normalize_cache_text(query_text).encode(), digest_size=16).digest()
+        with _query_embedding_lock:
+            cached = _query_embedding_cache.get(key)
+            if cached is not None:
+                _query_embedding_cache.move_to_end(key)
+                return cached
+        
+        embedding = await embedding_service.generate_embedding(query_text)
+        if embedding:
+            with _query_embedding_lock:
+                _query_embedding_cache[key] = embedding
+                while len(_query_embedding_cache) > QUERY_EMBEDDING_CACHE_SIZE:
+                    _query_embedding_cache.popitem(last=False)
+        return embedding
+    
     async def search_similar_conversations(
         self,
         query_text: str,
@@ -31,7 +895,9 @@ class SemanticSearchService:
         min_similarity: float = 0.5,
         use_combined: bool = True,
         filter_by_rating: Optional[int] = None,
-        max_candidates: int = 1000  # Giới hạn số lượng embeddings được so sánh
+        max_candidates: int = 1000,  # Giới hạn số lượng embeddings được so sánh
+        query_embedding: Optional[List[float]] = None,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Tìm conversations tương tự bằng semantic search
@@ -44,57 +910,85 @@ class SemanticSearchService:
             use_combined: Sử dụng combined embedding không
             filter_by_rating: Filter theo rating tối thiểu (nếu có feedback)
             max_candidates: Số lượng embeddings tối đa để so sánh (để tránh load quá nhiều vào memory)
+            query_embedding: Embedding đã tính sẵn của query_text (bỏ qua bước embed lại)
+            db: Database session (mặc định dùng session của instance)
             
         Returns:
             List conversations tương tự với similarity scores
         """
+        db = db or self.db
+        
+        query_cache = get_query_cache_service()
+        cache_query = normalize_cache_text(query_text)
+        cache_params = {
+            "limit": limit,
+            "min_similarity": min_similarity,
+            "use_combined": use_combined,
+            "filter_by_rating": filter_by_rating,
+            "max_candidates": max_candidates
+        }
+        cached = query_cache.get(cache_query, cache_params, namespace=SEMANTIC_CACHE_NAMESPACE)
+        if cached is not None:
+            return cached
+        
         try:
-            # Generate query embedding
-            query_embedding = await embedding_service.generate_embedding(query_text)
+            # Generate query embedding (nếu caller chưa tính sẵn)
+            if query_embedding is None:
+                query_embedding = await self.embed_query(query_text)
             if not query_embedding:
                 logger.error("Failed to generate query embedding")
                 return []
             
-            query_vec = np.array(query_embedding)
+            # float32 + normalize một lần; cache lookup, scoring và rank đều dùng trực tiếp
+            query_vec = unit_query_vector(query_embedding)
+            if query_vec.ndim != 1 or not np.isfinite(query_vec).all():
+                logger.error("Invalid query embedding (not a finite 1-D vector)")
+                return []
+            
+            # Semantic cache: query gần như trùng (cosine >= threshold) với query đã search -> dùng lại kết quả
+            params_key = json.dumps(cache_params, sort_keys=True)
+            similar_cached = _semantic_result_cache.lookup(query_vec, params_key)
+            if similar_cached is not None:
+                return similar_cached
             
+            results = None
             # Kiểm tra xem có thể sử dụng pgvector không
             if USE_PGVECTOR:
                 try:
-                    # Kiểm tra xem vector columns có tồn tại không
-                    check_sql = """
-                        SELECT column_name 
-                        FROM information_schema.columns 
-                        WHERE table_name = 'conversation_embeddings' 
-                        AND column_name = 'combined_embedding_vector'
-                    """
-                    result = self.db.execute(text(check_sql)).fetchone()
-                    
-                    if result:
+                    if has_vector_columns(db):
                         # Sử dụng pgvector với cosine similarity
-                        return await self._search_with_pgvector(
-                            query_vec, limit, min_similarity, use_combined, 
+                        results = await self._search_with_pgvector(
+                            db, query_vec, limit, min_similarity, use_combined, 
                             filter_by_rating, max_candidates
                         )
                 except Exception as e:
                     logger.warning(f"pgvector search failed, falling back to JSON: {e}")
             
-            # Fallback: Sử dụng JSON text storage với batch processing
-            return await self._search_with_json(
-                query_vec, limit, min_similarity, use_combined, 
-                filter_by_rating, max_candidates
+            if results is None:
+                # Fallback: Sử dụng JSON text storage qua ma trận embeddings cached
+                results = await self._search_with_json(
+                    db, query_vec, limit, min_similarity, use_combined, 
+                    filter_by_rating, max_candidates
+                )
+            query_cache.set(
+                cache_query, results, ttl=SEMANTIC_SEARCH_CACHE_TTL,
+                params=cache_params, namespace=SEMANTIC_CACHE_NAMESPACE
             )
+            _semantic_result_cache.store(query_vec, params_key, results)
+            return results
             
         except Exception as e:
             logger.error(f"Error in semantic search: {e}", exc_info=True)
             # Rollback transaction nếu có lỗi
             try:
-                self.db.rollback()
+                db.rollback()
             except Exception:
                 pass
             return []
     
     async def _search_with_pgvector(
         self,
+        db: Session,
         query_vec: np.ndarray,
         limit: int,
         min_similarity: float,
@@ -104,50 +998,24 @@ class SemanticSearchService:
     ) -> List[Dict[str, Any]]:
         """Search sử dụng pgvector với native vector operations"""
         try:
-            # Convert query vector to PostgreSQL array format
-            # Vector format is safe: [1,2,3,...] contains no quotes
+            # Query vector dạng text '[1,2,3,...]', bind qua CAST(:query_vec AS vector)
             query_vec_str = "[" + ",".join(map(str, query_vec)) + "]"
             
-            # Chọn cột vector để search
+            # Statement dựng sẵn theo (cột, có rating filter), không build lại SQL mỗi query
             vector_column = "combined_embedding_vector" if use_combined else "user_message_embedding_vector"
-            
-            # Build query với pgvector cosine similarity
-            # Note: Vector phải được embed trực tiếp vào SQL string, không thể dùng parameter binding cho ::vector
-            query_sql = f"""
-                SELECT 
-                    ce.conversation_id,
-                    ac.user_message,
-                    ac.ai_response,
-                    ac.session_id,
-                    ac.created_at,
-                    1 - (ce.{vector_column} <=> '{query_vec_str}'::vector) as similarity
-                FROM conversation_embeddings ce
-                JOIN agent_conversations ac ON ce.conversation_id = ac.id
-            """
-            
-            # Add rating filter nếu có
-            if filter_by_rating:
-                query_sql += f"""
-                    JOIN conversation_feedback cf ON ce.conversation_id = cf.conversation_id
-                    WHERE ce.{vector_column} IS NOT NULL AND cf.rating >= :min_rating
-                """
-            else:
-                query_sql += f" WHERE ce.{vector_column} IS NOT NULL"
-            
-            # Order by similarity DESC và limit
-            query_sql += f" ORDER BY ce.{vector_column} <=> '{query_vec_str}'::vector LIMIT :result_limit"
+            statement = _pgvector_search_statement(vector_column, bool(filter_by_rating))
             
             params = {
+                "query_vec": query_vec_str,
                 "result_limit": limit,
-                "min_similarity": min_similarity
+                "max_distance": 1 - min_similarity
             }
             if filter_by_rating:
                 params["min_rating"] = filter_by_rating
             
-            results = self.db.execute(text(query_sql), params).fetchall()
-            
+            # Duyệt trực tiếp result (tối đa `limit` rows), không materialize qua fetchall()
             similarities = []
-            for row in results:
+            for row in db.execute(statement, params):
                 conv_id, user_msg, ai_resp, session_id, created_at, similarity = row
                 
                 if similarity >= min_similarity:
@@ -166,13 +1034,14 @@ class SemanticSearchService:
             logger.error(f"Error in pgvector search: {e}", exc_info=True)
             # Rollback transaction nếu có lỗi
             try:
-                self.db.rollback()
+                db.rollback()
             except Exception:
                 pass
             raise
     
     async def _search_with_json(
         self,
+        db: Session,
         query_vec: np.ndarray,
         limit: int,
         min_similarity: float,
@@ -180,109 +1049,124 @@ class SemanticSearchService:
         filter_by_rating: Optional[int],
         max_candidates: int
     ) -> List[Dict[str, Any]]:
-        """Search sử dụng JSON text storage với batch processing"""
-        # Xây dựng query với limit để không load tất cả embeddings
-        query_sql = """
-            SELECT 
-                ce.conversation_id,
-                ce.user_message_embedding,
-                ce.ai_response_embedding,
-                ce.combined_embedding,
-                ce.embedding_dimension,
-                ac.user_message,
-                ac.ai_response,
-                ac.session_id,
-                ac.created_at
-            FROM conversation_embeddings ce
-            JOIN agent_conversations ac ON ce.conversation_id = ac.id
         """
+        Search sử dụng JSON text storage qua ma trận embeddings cached (một matvec cho cả corpus)
+        query_vec: float32 đã normalize (unit_query_vector)
+        """
+        column = "combined_embedding" if use_combined else "user_message_embedding"
+        matrix_cache = _embedding_matrices[column]
+        # Build/refresh query DB và decode rows -> chạy ngoài event loop
+        matrix, ids, norms, bits, ratings = await asyncio.to_thread(matrix_cache.get, db)
+        if matrix.shape[0] == 0:
+            return []
         
-        # Add rating filter nếu có
-        if filter_by_rating:
-            query_sql += """
-                JOIN conversation_feedback cf ON ce.conversation_id = cf.conversation_id
-                WHERE cf.rating >= :min_rating
-            """
-        else:
-            query_sql += " WHERE 1=1"
+        if query_vec.shape[0] != matrix.shape[1]:
+            logger.warning(
+                f"Query embedding dimension {query_vec.shape[0]} != indexed dimension {matrix.shape[1]}"
+            )
+            return []
         
-        # Order by created_at DESC để ưu tiên conversations mới nhất
-        query_sql += f" ORDER BY ac.created_at DESC LIMIT :max_candidates"
+        # Rating filter trên mảng ratings cached (không JOIN conversation_feedback mỗi query)
+        allowed = ratings >= filter_by_rating if filter_by_rating else None
         
-        params = {"max_candidates": max_candidates}
-        if filter_by_rating:
-            params["min_rating"] = filter_by_rating
+        # Scores không clamp từng row: score âm coi như 0 -> min_similarity <= 0 nhận mọi row
+        threshold = min_similarity if min_similarity > 0 else -np.inf
         
-        # Batch processing: xử lý từng batch nhỏ để tiết kiệm memory
-        batch_size = 100
-        similarities = []
-        processed = 0
+        shortlist_size = BINARY_PRESCREEN_FACTOR * limit
+        if matrix.shape[0] >= BINARY_PRESCREEN_MIN_ROWS and 0 < shortlist_size < matrix.shape[0]:
+            # Corpus lớn: lọc shortlist bằng Hamming distance trên sign bits, chỉ tính cosine cho shortlist
+            shortlist = _hamming_shortlist(bits, query_vec, shortlist_size, allowed)
+            shortlist_scores = _cosine_scores(
+                matrix[shortlist], norms[shortlist] if norms is not None else None, query_vec
+            )
+            # Chỉ xếp hạng trong shortlist: rows ngoài shortlist chưa có score
+            keep = shortlist_scores >= threshold
+            if allowed is not None:
+                keep &= allowed[shortlist]
+            candidates, candidate_scores = shortlist[keep], shortlist_scores[keep]
+        elif SEMANTIC_FUSED_TOPK and NUMBA_AVAILABLE and limit > 0 and matrix.dtype != np.float16:
+            # Kernel JIT một lượt: rows dưới threshold không bao giờ ghi ra mảng scores
+            empty = np.empty(0, dtype=np.float32)
+            top, top_scores, matched = _get_cosine_kernels(matrix.shape[1])[1](
+                matrix, query_vec, norms if norms is not None else empty,
+                allowed if allowed is not None else np.empty(0, dtype=np.bool_),
+                np.float32(threshold), limit
+            )
+            if top.size == 0:
+                return []
+            return self._load_ranked_conversations(db, ids, top, top_scores, matrix.shape[0], matched)
+        else:
+            # Cosine similarity với toàn bộ corpus (dùng lại nếu query này vừa được tính)
+            scores = await matrix_cache.rank_all(matrix, norms, query_vec)
+            mask = scores >= threshold
+            if allowed is not None:
+                mask &= allowed
+            candidates = np.flatnonzero(mask)
+            candidate_scores = scores[candidates]
         
-        # Lấy embeddings theo batch
-        for offset in range(0, max_candidates, batch_size):
-            batch_query = query_sql.replace("LIMIT :max_candidates", f"LIMIT {batch_size} OFFSET {offset}")
-            batch_params = {k: v for k, v in params.items() if k != "max_candidates"}
-            
-            embeddings_batch = self.db.execute(text(batch_query), batch_params).fetchall()
-            
-            if not embeddings_batch:
-                break
-            
-            # Xử lý batch này
-            for row in embeddings_batch:
-                conv_id, user_emb_str, ai_emb_str, combined_emb_str, dim, user_msg, ai_resp, session_id, created_at = row
-                
-                # Chọn embedding để so sánh
-                if use_combined and combined_emb_str:
-                    target_embedding_str = combined_emb_str
-                elif user_emb_str:
-                    target_embedding_str = user_emb_str
-                else:
-                    continue
-                
-                try:
-                    # Parse embedding từ JSON
-                    target_embedding = json.loads(target_embedding_str)
-                    target_vec = np.array(target_embedding)
-                    
-                    # Tính cosine similarity
-                    similarity = self._cosine_similarity(query_vec, target_vec)
-                    
-                    if similarity >= min_similarity:
-                        similarities.append({
-                            "conversation_id": conv_id,
-                            "user_message": user_msg,
-                            "ai_response": ai_resp,
-                            "similarity": round(float(similarity), 4),
-                            "session_id": session_id,
-                            "created_at": created_at.isoformat() if created_at else None
-                        })
-                        
-                        # Early termination: nếu đã có đủ kết quả với similarity cao, có thể dừng sớm
-                        if len(similarities) >= limit * 2 and min(s["similarity"] for s in similarities) > min_similarity + 0.2:
-                            break
-                except Exception as e:
-                    logger.warning(f"Error processing embedding for conversation {conv_id}: {e}")
-                    continue
-            
-            processed += len(embeddings_batch)
-            
-            # Early termination nếu đã có đủ kết quả tốt
-            if len(similarities) >= limit * 2:
-                break
+        matched = int(candidates.size)
+        if matched == 0:
+            return []
+        # Top-k: argpartition O(N) rồi chỉ sort k phần tử
+        if matched > limit > 0:
+            part = np.argpartition(-candidate_scores, limit - 1)[:limit]
+            candidates, candidate_scores = candidates[part], candidate_scores[part]
+        order = np.argsort(-candidate_scores)[:limit]
+        return self._load_ranked_conversations(
+            db, ids, candidates[order], candidate_scores[order], matrix.shape[0], matched
+        )
+    
+    def _load_ranked_conversations(
+        self,
+        db: Session,
+        ids: np.ndarray,
+        top: np.ndarray,
+        top_scores: np.ndarray,
+        scored: int,
+        matched: int
+    ) -> List[Dict[str, Any]]:
+        """Load text của các rows top-k (đã sắp xếp theo score) thành kết quả search"""
         
-        # Sort by similarity và trả về top results
-        similarities.sort(key=lambda x: x["similarity"], reverse=True)
+        # Chỉ load text của top-k conversations
+        top_ids = [int(i) for i in ids[top]]
+        rows = db.execute(
+            text("""
+                SELECT id, user_message, ai_response, session_id, created_at
+                FROM agent_conversations
+                WHERE id IN :ids
+            """).bindparams(bindparam("ids", expanding=True)),
+            {"ids": top_ids}
+        ).fetchall()
+        rows_by_id = {row[0]: row for row in rows}
         
-        logger.debug(f"Processed {processed} embeddings, found {len(similarities)} similar conversations")
+        # Chỉ clamp về [0, 1] cho top-k trả về
+        top_scores = np.clip(top_scores, 0.0, 1.0)
+        similarities = []
+        for idx, score in zip(top, top_scores):
+            row = rows_by_id.get(int(ids[idx]))
+            if row is None:
+                continue
+            conv_id, user_msg, ai_resp, session_id, created_at = row
+            similarities.append({
+                "conversation_id": conv_id,
+                "user_message": user_msg,
+                "ai_response": ai_resp,
+                "similarity": round(float(score), 4),
+                "session_id": session_id,
+                "created_at": created_at.isoformat() if created_at else None
+            })
+        
+        logger.debug(f"Scored {scored} embeddings, found {matched} similar conversations")
         
-        return similarities[:limit]
+        return similarities
     
     async def find_best_response(
         self,
         user_message: str,
         limit: int = 3,
-        min_similarity: float = 0.6
+        min_similarity: float = 0.6,
+        query_embedding: Optional[List[float]] = None,
+        db: Optional[Session] = None
     ) -> Optional[Dict[str, Any]]:
         """
         Tìm best response cho user message dựa trên semantic search
@@ -291,6 +1175,8 @@ class SemanticSearchService:
             user_message: Message từ user
             limit: Số lượng candidates
             min_similarity: Độ tương tự tối thiểu
+            query_embedding: Embedding đã tính sẵn của user_message
+            db: Database session (mặc định dùng session của instance)
             
         Returns:
             Best response hoặc None
@@ -301,7 +1187,9 @@ class SemanticSearchService:
                 query_text=user_message,
                 limit=limit,
                 min_similarity=min_similarity,
-                filter_by_rating=4  # Chỉ lấy high-rated
+                filter_by_rating=4,  # Chỉ lấy high-rated
+                query_embedding=query_embedding,
+                db=db
             )
             
             if similar:
@@ -320,10 +1208,70 @@ class SemanticSearchService:
             logger.error(f"Error finding best response: {e}")
             return None
     
+    async def precompute_best_response(
+        self,
+        user_message: str,
+        min_similarity: float = 0.7,
+        db: Optional[Session] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Tìm best response (top-1 high-rated) cho user_message và lưu conversation_id vào cache
+        Chạy trong background indexer để create_conversation chỉ cần một cache GET
+        """
+        best = await self.find_best_response(
+            user_message=user_message,
+            limit=1,
+            min_similarity=min_similarity,
+            db=db
+        )
+        if best:
+            get_query_cache_service().set(
+                normalize_cache_text(user_message),
+                {"conversation_id": best["conversation_id"], "similarity": best["similarity"]},
+                ttl=BEST_RESPONSE_CACHE_TTL,
+                namespace=BEST_RESPONSE_CACHE_NAMESPACE
+            )
+        return best
+    
+    def get_precomputed_best_response(
+        self,
+        user_message: str,
+        db: Optional[Session] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Lấy best response đã tính sẵn (cache GET + load một row theo PK)
+        
+        Returns:
+            Best response cùng format với find_best_response, hoặc None nếu cache miss
+        """
+        db = db or self.db
+        cached = get_query_cache_service().get(
+            normalize_cache_text(user_message),
+            namespace=BEST_RESPONSE_CACHE_NAMESPACE
+        )
+        if not cached:
+            return None
+        
+        row = db.execute(
+            text("SELECT user_message, ai_response FROM agent_conversations WHERE id = :id"),
+            {"id": cached["conversation_id"]}
+        ).fetchone()
+        if not row or not row[1]:
+            return None
+        return {
+            "conversation_id": cached["conversation_id"],
+            "similar_user_message": row[0],
+            "suggested_response": row[1],
+            "similarity": cached["similarity"],
+            "confidence": "high" if cached["similarity"] > 0.8 else "medium"
+        }
+    
     async def get_semantic_context(
         self,
         user_message: str,
-        context_limit: int = 3
+        context_limit: int = 3,
+        query_embedding: Optional[List[float]] = None,
+        db: Optional[Session] = None
     ) -> List[Dict[str, Any]]:
         """
         Lấy semantic context (similar conversations) để cải thiện response
@@ -331,6 +1279,8 @@ class SemanticSearchService:
         Args:
             user_message: Message từ user
             context_limit: Số lượng context conversations
+            query_embedding: Embedding đã tính sẵn của user_message
+            db: Database session (mặc định dùng session của instance)
             
         Returns:
             List context conversations
@@ -340,7 +1290,9 @@ class SemanticSearchService:
                 query_text=user_message,
                 limit=context_limit,
                 min_similarity=0.5,
-                filter_by_rating=3  # Lấy cả medium-rated
+                filter_by_rating=3,  # Lấy cả medium-rated
+                query_embedding=query_embedding,
+                db=db
             )
             
             return similar
@@ -349,184 +1301,201 @@ class SemanticSearchService:
             return []
     
     def _cosine_similarity(self, vec1: np.ndarray, vec2: np.ndarray) -> float:
-        """Tính cosine similarity giữa 2 vectors"""
-        try:
-            # Normalize vectors
-            vec1_norm = vec1 / (np.linalg.norm(vec1) + 1e-8)
-            vec2_norm = vec2 / (np.linalg.norm(vec2) + 1e-8)
-            
-            # Cosine similarity
-            similarity = np.dot(vec1_norm, vec2_norm)
-            
-            # Ensure trong range [0, 1]
-            return max(0.0, min(1.0, float(similarity)))
-        except Exception as e:
-            logger.error(f"Error calculating cosine similarity: {e}")
-            return 0.0
+        """
+        Cosine similarity thô [-1, 1] giữa 2 vectors
+        Không try/except hay clamp: caller validate input một lần và clamp kết quả cuối
+        """
+        if NUMBA_AVAILABLE:
+            return float(_cosine_kernel(
+                np.asarray(vec1, dtype=np.float64), np.asarray(vec2, dtype=np.float64)
+            ))
+        # Một sqrt trên tích hai self-dot, không tạo 2 vector normalize tạm
+        den = math.sqrt(float(np.vdot(vec1, vec1)) * float(np.vdot(vec2, vec2))) + 1e-8
+        return float(np.dot(vec1, vec2)) / den
     
     async def index_conversation(
         self,
         conversation_id: int,
         user_message: str,
-        ai_response: Optional[str] = None
+        ai_response: Optional[str] = None,
+        db: Optional[Session] = None
     ) -> Dict[str, Any]:
         """
         Index conversation (tạo và lưu embeddings)
+        Dùng chung đường ghi với index_conversations_bulk (upsert theo conversation_id)
         
         Args:
             conversation_id: ID của conversation
             user_message: User message
             ai_response: AI response
+            db: Database session (mặc định dùng session của instance)
             
         Returns:
             Dict với kết quả indexing
         """
-        try:
-            from models import ConversationEmbedding
+        result = await self.index_conversations_bulk(
+            [(conversation_id, user_message, ai_response)], db=db
+        )
+        if result["indexed"]:
+            return {
+                "success": True,
+                "message": "Embedding indexed",
+                "conversation_id": conversation_id
+            }
+        return {
+            "success": False,
+            "error": result.get("error", "Failed to generate embeddings")
+        }
+    
+    async def index_conversations_bulk(
+        self,
+        conversations: List[Tuple[int, str, Optional[str]]],
+        db: Optional[Session] = None
+    ) -> Dict[str, Any]:
+        """
+        Index nhiều conversations: embed cả chunk trong một batch call và lưu bằng
+        một multi-row INSERT (upsert theo conversation_id), một commit
+        
+        Args:
+            conversations: List (conversation_id, user_message, ai_response)
+            db: Database session (mặc định dùng session của instance)
             
-            # Generate embeddings
-            embeddings = await embedding_service.generate_conversation_embeddings(
-                user_message=user_message,
-                ai_response=ai_response
+        Returns:
+            Dict với số lượng indexed/errors
+        """
+        db = db or self.db
+        from models import ConversationEmbedding
+        
+        use_vector_columns = False
+        if USE_PGVECTOR and hasattr(ConversationEmbedding, "combined_embedding_vector"):
+            try:
+                use_vector_columns = await asyncio.to_thread(has_vector_columns, db)
+            except Exception as e:
+                logger.warning(f"Failed to check vector columns: {e}")
+        
+        # Embed cả chunk bằng một batch call: [user_1..user_n, ai_1..ai_n]
+        conversations = list(conversations)
+        count = len(conversations)
+        try:
+            embeddings = await embedding_service.generate_embeddings_batch(
+                [user_msg for _, user_msg, _ in conversations]
+                + [ai_resp or "" for _, _, ai_resp in conversations]
             )
+        except Exception as e:
+            logger.error(f"Error generating batch embeddings for {count} conversations: {e}")
+            return {
+                "indexed": 0,
+                "errors": count,
+                "error": str(e)
+            }
+        
+        rows = []
+        errors = 0
+        for i, (conv_id, _, _) in enumerate(conversations):
+            user_emb = embeddings[i]
+            ai_emb = embeddings[count + i]
             
-            if not embeddings.get("combined_embedding"):
-                return {
-                    "success": False,
-                    "error": "Failed to generate embeddings"
-                }
-            
-            # Check if embedding already exists
-            existing = self.db.query(ConversationEmbedding).filter(
-                ConversationEmbedding.conversation_id == conversation_id
-            ).first()
-            
-            # Convert embeddings to formats
-            user_emb_json = json.dumps(embeddings["user_message_embedding"])
-            ai_emb_json = json.dumps(embeddings["ai_response_embedding"]) if embeddings.get("ai_response_embedding") else None
-            combined_emb_json = json.dumps(embeddings["combined_embedding"])
-            
-            # Convert to vector format nếu sử dụng pgvector
-            user_emb_vec = None
-            ai_emb_vec = None
-            combined_emb_vec = None
+            # Combined = trung bình user/AI embeddings (giống generate_conversation_embeddings)
+            if user_emb and ai_emb:
+                combined = ((np.array(user_emb) + np.array(ai_emb)) / 2).tolist()
+            else:
+                combined = user_emb or ai_emb
             
-            if USE_PGVECTOR:
-                try:
-                    # Check if vector columns exist
-                    check_sql = """
-                        SELECT column_name 
-                        FROM information_schema.columns 
-                        WHERE table_name = 'conversation_embeddings' 
-                        AND column_name = 'combined_embedding_vector'
-                    """
-                    result = self.db.execute(text(check_sql)).fetchone()
-                    
-                    if result:
-                        # Convert to PostgreSQL array format
-                        user_emb_vec = "[" + ",".join(map(str, embeddings["user_message_embedding"])) + "]"
-                        if embeddings.get("ai_response_embedding"):
-                            ai_emb_vec = "[" + ",".join(map(str, embeddings["ai_response_embedding"])) + "]"
-                        combined_emb_vec = "[" + ",".join(map(str, embeddings["combined_embedding"])) + "]"
-                except Exception as e:
-                    logger.warning(f"Failed to prepare vector format: {e}")
+            if not combined:
+                errors += 1
+                continue
+            combined_i8, combined_scale = quantize_int8(combined)
             
-            if existing:
-                # Update existing
-                existing.user_message_embedding = user_emb_json
-                existing.ai_response_embedding = ai_emb_json
-                existing.combined_embedding = combined_emb_json
-                existing.embedding_model = embeddings["embedding_model"]
-                existing.embedding_dimension = embeddings.get("dimension", 384)
-                
-                # Update vector columns nếu có
-                if combined_emb_vec:
-                    try:
-                        # Embed vector trực tiếp vào SQL string
-                        update_vec_sql = f"""
-                            UPDATE conversation_embeddings
-                            SET combined_embedding_vector = '{combined_emb_vec}'::vector
-                        """
-                        
-                        if user_emb_vec:
-                            update_vec_sql += f", user_message_embedding_vector = '{user_emb_vec}'::vector"
-                        
-                        if ai_emb_vec:
-                            update_vec_sql += f", ai_response_embedding_vector = '{ai_emb_vec}'::vector"
-                        
-                        update_vec_sql += " WHERE id = :id"
-                        params = {"id": existing.id}
-                        self.db.execute(text(update_vec_sql), params)
-                    except Exception as e:
-                        logger.warning(f"Failed to update vector columns: {e}")
-                
-                self.db.commit()
+            row = {
+                "conversation_id": conv_id,
+                "user_message_embedding": _json_dumps(user_emb) if user_emb else None,
+                "ai_response_embedding": _json_dumps(ai_emb) if ai_emb else None,
+                "combined_embedding": _json_dumps(combined),
+                "user_message_embedding_f32": to_f32_bytes(user_emb or None),
+                "ai_response_embedding_f32": to_f32_bytes(ai_emb or None),
+                "combined_embedding_f32": to_f32_bytes(combined),
+                "combined_embedding_i8": combined_i8.tobytes(),
+                "combined_embedding_scale": combined_scale,
+                "embedding_model": embedding_service.embedding_provider,
+                "embedding_dimension": len(user_emb) if user_emb else len(combined)
+            }
+            if use_vector_columns:
+                row["user_message_embedding_vector"] = user_emb
+                row["ai_response_embedding_vector"] = ai_emb
+                row["combined_embedding_vector"] = combined
+            rows.append(row)
+        
+        if rows:
+            try:
+                # INSERT + commit là sync I/O -> chạy trên thread, không block event loop
+                await asyncio.to_thread(self._insert_embedding_rows, db, rows)
+            except Exception as e:
+                logger.error(f"Error bulk inserting embeddings: {e}")
                 return {
-                    "success": True,
-                    "message": "Embedding updated",
-                    "conversation_id": conversation_id
+                    "indexed": 0,
+                    "errors": errors + len(rows),
+                    "error": str(e)
                 }
-            else:
-                # Create new
-                embedding_record = ConversationEmbedding(
-                    conversation_id=conversation_id,
-                    user_message_embedding=user_emb_json,
-                    ai_response_embedding=ai_emb_json,
-                    combined_embedding=combined_emb_json,
-                    embedding_model=embeddings["embedding_model"],
-                    embedding_dimension=embeddings.get("dimension", 384)
+        
+        return {
+            "indexed": len(rows),
+            "errors": errors
+        }
+    
+    def _insert_embedding_rows(self, db: Session, rows: List[Dict[str, Any]]) -> None:
+        """Một INSERT nhiều rows (upsert theo conversation_id) + một commit; rollback nếu lỗi"""
+        from models import ConversationEmbedding
+        
+        try:
+            # Một INSERT nhiều rows thay vì add/commit từng conversation
+            dialect_insert = {"postgresql": pg_insert, "sqlite": sqlite_insert}.get(db.get_bind().dialect.name)
+            if dialect_insert is not None:
+                # Conversation đã có embedding (re-index) -> cập nhật thay vì lỗi unique
+                stmt = dialect_insert(ConversationEmbedding)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=["conversation_id"],
+                    set_={
+                        **{key: stmt.excluded[key] for key in rows[0] if key != "conversation_id"},
+                        "updated_at": func.now()
+                    }
                 )
-                
-                self.db.add(embedding_record)
-                self.db.flush()  # Get the ID
-                
-                # Insert vector columns nếu có
-                if combined_emb_vec:
-                    try:
-                        # Embed vector trực tiếp vào SQL string
-                        insert_vec_sql = f"""
-                            UPDATE conversation_embeddings
-                            SET combined_embedding_vector = '{combined_emb_vec}'::vector
-                        """
-                        
-                        if user_emb_vec:
-                            insert_vec_sql += f", user_message_embedding_vector = '{user_emb_vec}'::vector"
-                        
-                        if ai_emb_vec:
-                            insert_vec_sql += f", ai_response_embedding_vector = '{ai_emb_vec}'::vector"
-                        
-                        insert_vec_sql += " WHERE id = :id"
-                        params = {"id": embedding_record.id}
-                        self.db.execute(text(insert_vec_sql), params)
-                    except Exception as e:
-                        logger.warning(f"Failed to insert vector columns: {e}")
-                
-                self.db.commit()
-                
-                self.db.add(embedding_record)
-                self.db.commit()
-                
-                return {
-                    "success": True,
-                    "message": "Embedding created",
-                    "conversation_id": conversation_id
-                }
+            else:
+                stmt = insert(ConversationEmbedding)
+            db.execute(stmt, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        self._invalidate_search_cache([row["conversation_id"] for row in rows])
+    
+    @staticmethod
+    def update_cached_rating(conversation_id: int, rating: Optional[int]) -> None:
+        """Đồng bộ rating mới vào các embedding matrices cached (gọi sau khi ghi feedback)"""
+        if rating is None:
+            return
+        for matrix_cache in _embedding_matrices.values():
+            matrix_cache.set_rating(conversation_id, rating)
+    
+    def _invalidate_search_cache(self, conversation_ids: Optional[List[int]] = None) -> None:
+        """Xóa cached semantic search results sau khi có embeddings mới"""
+        for matrix_cache in _embedding_matrices.values():
+            matrix_cache.mark_dirty(conversation_ids)
+        _semantic_result_cache.clear()
+        try:
+            # Bump version (một INCR) thay vì SCAN + UNLINK toàn keyspace sau mỗi lần index
+            get_query_cache_service().bump_namespace(SEMANTIC_CACHE_NAMESPACE)
         except Exception as e:
-            logger.error(f"Error indexing conversation: {e}")
-            self.db.rollback()
-            return {
-                "success": False,
-                "error": str(e)
-            }
+            logger.warning(f"Failed to invalidate semantic search cache: {e}")
     
-    def get_indexing_stats(self) -> Dict[str, Any]:
+    def get_indexing_stats(self, db: Optional[Session] = None) -> Dict[str, Any]:
         """Lấy thống kê về indexing"""
+        db = db or self.db
         try:
-            total_convs = self.db.execute(
+            total_convs = db.execute(
                 text("SELECT COUNT(*) FROM agent_conversations")
             ).scalar() or 0
             
-            indexed_convs = self.db.execute(
+            indexed_convs = db.execute(
                 text("SELECT COUNT(*) FROM conversation_embeddings")
             ).scalar() or 0
             
@@ -0,0 +1,175 @@
+"""
+Tests cho Advanced Cache Service (L1 sharded, negative filter, single-flight, L2 Redis)
+"""
+import threading
+import time
+
+import fakeredis
+import numpy as np
+import pytest
+
+import services.advanced_cache_service as acs
+from services.cache_components import NegativeLookupFilter, ShardedLRUCache
+from services.cache_operations import (
+    MSGPACK_AVAILABLE,
+    CacheOperations,
+    EncodedL2Value,
+    _l2_dumps,
+    _l2_loads,
+    _l2_payload,
+)
+
+
+@pytest.fixture
+def cache_service(monkeypatch):
+    """AdvancedCacheService với L2 là fakeredis (không warming, không L3)"""
+    monkeypatch.setattr(acs, "CACHE_WARMING_ENABLED", False)
+    service = acs.AdvancedCacheService()
+    service.redis_client = fakeredis.FakeRedis()
+    service.l2_enabled = True
+    return service
+
+
+def test_sharded_lru_cache_get_set_delete_many():
+    """Shards làm tròn lên lũy thừa 2, get/set/delete_many đi đúng shard"""
+    cache = ShardedLRUCache(max_size=1000, num_shards=5)
+    assert len(cache.shards) == 8
+    
+    for i in range(40):
+        cache.set(f"a:{i}" if i % 2 else f"b:{i}", i, ttl=60)
+    assert cache.size() == 40
+    assert cache.get("a:1") == 1 and cache.get("b:2") == 2
+    
+    assert cache.delete_many(lambda key: key.startswith("a:")) == 20
+    assert cache.get("a:1") is None
+    assert cache.size() == 20
+    assert cache.delete("b:2") and cache.get("b:2") is None
+    assert cache.clear() == 19
+
+
+def test_sharded_lru_cache_evicts_per_shard():
+    """Mỗi shard giữ tối đa ceil(max_size / shards) entries"""
+    cache = ShardedLRUCache(max_size=16, num_shards=4)
+    for i in range(200):
+        cache.set(f"k:{i}", i, ttl=60)
+    assert cache.size() <= 16
+    assert all(shard.size() <= 4 for shard in cache.shards)
+
+
+def test_negative_lookup_filter_add_discard_reset():
+    """Key miss nằm trong filter tới khi được set (discard) hoặc hết TTL"""
+    neg = NegativeLookupFilter(size=1 << 12, ttl=0.05)
+    neg.add("missing")
+    assert "missing" in neg
+    assert "other" not in neg
+    
+    neg.discard("missing")
+    assert "missing" not in neg
+    
+    neg.add("missing")
+    time.sleep(0.06)
+    assert "missing" not in neg
+
+
+def test_negative_filter_skips_l2_until_set(cache_service, monkeypatch):
+    """Lookup lặp lại của key vừa miss không hỏi Redis; set() gỡ key khỏi filter"""
+    calls = []
+    get_from_l2 = CacheOperations.get_from_l2
+    monkeypatch.setattr(
+        CacheOperations, "get_from_l2",
+        staticmethod(lambda client, key: calls.append(key) or get_from_l2(client, key))
+    )
+    
+    assert cache_service.get("neg:key") is None
+    assert cache_service.get("neg:key") is None
+    assert calls == ["neg:key"]
+    assert cache_service.stats.negative_hits == 1
+    
+    cache_service.set("neg:key", {"v": 1})
+    assert cache_service.get("neg:key") == {"v": 1}
+
+
+def test_get_or_compute_single_flight(cache_service):
+    """Nhiều threads cùng miss một key chỉ gọi loader một lần"""
+    calls = []
+    
+    def loader():
+        calls.append(1)
+        time.sleep(0.05)
+        return {"answer": 42}
+    
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache_service.get_or_compute("sf:key", loader)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    assert len(calls) == 1
+    assert results == [{"answer": 42}] * 8
+    assert cache_service.get("sf:key") == {"answer": 42}
+
+
+def test_get_or_compute_propagates_loader_error(cache_service):
+    """Loader lỗi: exception trả về cho caller, lần gọi sau load lại"""
+    def failing():
+        raise RuntimeError("boom")
+    
+    with pytest.raises(RuntimeError):
+        cache_service.get_or_compute("sf:error", failing)
+    assert cache_service.get_or_compute("sf:error", lambda: "ok") == "ok"
+
+
+@pytest.mark.parametrize("value, cache_type, prefix", [
+    ([float(i) / 3 for i in range(32)], "embedding", b"\x02"),
+    ([float(i) / 3 for i in range(32)], "generic", b"["),
+    ({"text": "xin chào", "scores": [0.1, 0.2]}, "generic", b"{"),
+    ([1.5, 2.5], "embedding", b"["),
+])
+def test_l2_encoding_by_cache_type(value, cache_type, prefix):
+    """Chỉ embeddings được lưu dạng float32; generic values giữ nguyên độ chính xác"""
+    if MSGPACK_AVAILABLE and prefix in (b"[", b"{"):
+        # Có msgpack thì generic values ghi msgpack thay cho JSON
+        prefix = b"\x01"
+    data = _l2_dumps(value, cache_type)
+    assert data[:1] == prefix
+    loaded = _l2_loads(data)
+    if prefix == b"\x02":
+        assert np.allclose(loaded, value)
+    else:
+        assert loaded == value
+
+
+def test_l2_encoding_ndarray_and_promoted_payload():
+    """ndarray float32 đọc ra ndarray; payload promote từ L3 dùng lại JSON text"""
+    vec = np.arange(16, dtype=np.float32)
+    data = _l2_dumps(vec)
+    assert data[:1] == b"\x03"
+    assert np.array_equal(_l2_loads(data), vec)
+    
+    raw_json = '{"a": 1}'
+    payload = _l2_payload({"a": 1}, raw_json)
+    assert isinstance(payload, EncodedL2Value)
+    assert _l2_dumps(payload) == raw_json.encode()
+    
+    embedding = [float(i) for i in range(16)]
+    assert _l2_payload(embedding, "[...]", "embedding")[:1] == b"\x02"
+
+
+def test_invalidate_pattern_l2_scan_unlink():
+    """SCAN + UNLINK theo batch chỉ xóa keys khớp pattern"""
+    client = fakeredis.FakeRedis()
+    for i in range(1200):
+        client.set(f"llm:{i}", b"x")
+    for i in range(10):
+        client.set(f"embedding:{i}", b"x")
+    
+    deleted = CacheOperations.invalidate_pattern_l2(client, "llm:", batch_size=500)
+    assert deleted == 1200
+    assert client.dbsize() == 10
+    
+    assert CacheOperations.invalidate_pattern_l2(client, "*") == 10
+    assert client.dbsize() == 0
@@ -0,0 +1,123 @@
+"""
+Tests cho API key authentication (TTL cache, invalid-digest cache, batch last_used_at)
+"""
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import middleware.auth as auth
+from models import APIKey, Base
+from services.api_key_service import APIKeyService
+
+
+@pytest.fixture
+def auth_db(monkeypatch):
+    """SQLite in-memory + bật API key từ database, cache sạch cho mỗi test"""
+    engine = create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    monkeypatch.setattr(auth, "REQUIRE_API_KEY", True)
+    monkeypatch.setattr(auth, "USE_DATABASE_API_KEYS", True)
+    monkeypatch.setattr(auth, "API_KEY_ENV", "")
+    auth.invalidate_api_key_cache()
+    auth._pending_last_used.clear()
+    yield db
+    auth.invalidate_api_key_cache()
+    auth._pending_last_used.clear()
+    db.close()
+
+
+@pytest.fixture
+def db_lookups(monkeypatch):
+    """Đếm số lần verify API key bằng query DB"""
+    calls = []
+    verify = APIKeyService.verify_api_key_hash
+    
+    def _verify(self, key_hash):
+        calls.append(key_hash)
+        return verify(self, key_hash)
+    
+    monkeypatch.setattr(APIKeyService, "verify_api_key_hash", _verify)
+    return calls
+
+
+def _request(db):
+    return SimpleNamespace(state=SimpleNamespace(db=db))
+
+
+@pytest.mark.asyncio
+async def test_verified_api_key_served_from_cache(auth_db, db_lookups):
+    """Key hợp lệ chỉ query DB lần đầu, các lần sau lấy snapshot từ TTL cache"""
+    created = APIKeyService(auth_db).create_api_key("test")
+    plain = created["api_key"]
+    
+    first = await auth.verify_api_key(_request(auth_db), plain)
+    second = await auth.verify_api_key(_request(auth_db), plain)
+    assert first.id == second.id == created["api_key_info"]["id"]
+    assert len(db_lookups) == 1
+    
+    # Revoke phải xóa key khỏi cache của process
+    auth.invalidate_api_key_cache(first.id)
+    await auth.verify_api_key(_request(auth_db), plain)
+    assert len(db_lookups) == 2
+
+
+@pytest.mark.asyncio
+async def test_invalid_api_key_digest_cached(auth_db, db_lookups):
+    """Key đúng format nhưng không có trong DB: 403 và không query lại trong TTL"""
+    junk = APIKeyService.generate_api_key()
+    for _ in range(3):
+        with pytest.raises(HTTPException) as exc:
+            await auth.verify_api_key(_request(auth_db), junk)
+        assert exc.value.status_code == 403
+    assert len(db_lookups) == 1
+
+
+@pytest.mark.asyncio
+async def test_malformed_api_key_skips_db(auth_db, db_lookups):
+    """Key sai format bị từ chối mà không hash/query DB"""
+    with pytest.raises(HTTPException) as exc:
+        await auth.verify_api_key(_request(auth_db), "not-a-key")
+    assert exc.value.status_code == 403
+    assert db_lookups == []
+
+
+@pytest.mark.asyncio
+async def test_last_used_batched_into_one_update(auth_db, monkeypatch):
+    """Cache hits gom last_used_at, flush bằng một UPDATE cho mọi keys"""
+    service = APIKeyService(auth_db)
+    keys = [service.create_api_key(f"key-{i}") for i in range(3)]
+    for created in keys:
+        await auth.verify_api_key(_request(auth_db), created["api_key"])
+    auth_db.query(APIKey).update({APIKey.last_used_at: None})
+    auth_db.commit()
+    
+    updates = []
+    mark_used = APIKeyService.mark_api_keys_used
+    monkeypatch.setattr(
+        APIKeyService, "mark_api_keys_used",
+        lambda self, used_at: updates.append(dict(used_at)) or mark_used(self, used_at)
+    )
+    # Chưa tới interval: chỉ gom, không ghi DB
+    monkeypatch.setattr(auth, "_last_used_flush_at", float("inf"))
+    for created in keys:
+        await auth.verify_api_key(_request(auth_db), created["api_key"])
+    assert updates == []
+    assert len(auth._pending_last_used) == 3
+    
+    monkeypatch.setattr(auth, "_last_used_flush_at", 0.0)
+    await auth.verify_api_key(_request(auth_db), keys[0]["api_key"])
+    assert len(updates) == 1
+    assert set(updates[0]) == {created["api_key_info"]["id"] for created in keys}
+    assert auth._pending_last_used == {}
+    auth_db.expire_all()
+    assert all(isinstance(key.last_used_at, datetime) for key in auth_db.query(APIKey))
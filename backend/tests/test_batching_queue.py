@@ -0,0 +1,156 @@
+"""
+Tests cho BatchingQueue và các buffers dùng nó (audit log, indexing)
+"""
+import asyncio
+import sys
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+import services.audit_log_buffer as alb
+import services.semantic_search_service as sss
+from models import APIKeyAuditLog, Base
+from services.batching_queue import BatchingQueue
+from services.indexing_buffer import IndexingBuffer
+
+
+@pytest.fixture
+def session_factory(monkeypatch):
+    """SQLite in-memory làm SessionLocal của config.app_config"""
+    engine = create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(engine)
+    factory = sessionmaker(bind=engine)
+    monkeypatch.setitem(sys.modules, "config.app_config", SimpleNamespace(SessionLocal=factory))
+    return factory
+
+
+def _audit_record(endpoint):
+    return {"api_key_id": 1, "endpoint": endpoint, "method": "GET", "status_code": 200}
+
+
+@pytest.mark.asyncio
+async def test_batching_queue_flushes_by_size_and_interval():
+    """Batch đầy flush ngay; batch chưa đầy flush sau flush_interval"""
+    batches = []
+    
+    async def flush(batch):
+        batches.append(list(batch))
+    
+    queue = BatchingQueue("test queue", flush, batch_size=3, flush_interval=0.05, max_pending=100)
+    assert not queue.put(1)
+    await queue.start()
+    for item in range(5):
+        assert queue.put(item)
+    await asyncio.sleep(0.15)
+    assert batches == [[0, 1, 2], [3, 4]]
+    await queue.stop()
+
+
+@pytest.mark.asyncio
+async def test_batching_queue_full_and_stop_flushes_remaining():
+    """Queue đầy thì put trả về False; stop() flush hết items còn lại"""
+    batches = []
+    release = asyncio.Event()
+    
+    async def flush(batch):
+        await release.wait()
+        batches.append(list(batch))
+    
+    queue = BatchingQueue("test queue", flush, batch_size=2, flush_interval=0.01, max_pending=2)
+    await queue.start()
+    assert queue.put("a")
+    await asyncio.sleep(0.05)
+    # Consumer đang kẹt trong flush(["a"]) -> queue chỉ nhận thêm max_pending items
+    assert queue.put("b") and queue.put("c")
+    assert not queue.put("d")
+    
+    release.set()
+    await queue.stop()
+    assert sorted(item for batch in batches for item in batch) == ["a", "b", "c"]
+
+
+@pytest.mark.asyncio
+async def test_audit_log_buffer_writes_batch(session_factory):
+    """Records đã enqueue được ghi bằng một batch INSERT khi stop()"""
+    buffer = alb.AuditLogBuffer()
+    await buffer.start()
+    for i in range(5):
+        assert buffer.enqueue(_audit_record(f"/api/{i}"))
+    await buffer.stop()
+    
+    db = session_factory()
+    rows = db.query(APIKeyAuditLog).order_by(APIKeyAuditLog.id).all()
+    assert [row.endpoint for row in rows] == [f"/api/{i}" for i in range(5)]
+    assert all(row.created_at is not None for row in rows)
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_audit_log_buffer_falls_back_to_row_inserts(session_factory, monkeypatch):
+    """Batch lỗi vì một row: các rows còn lại vẫn được ghi, row lỗi được đếm vào metrics"""
+    errors = []
+    monkeypatch.setattr(alb, "METRICS_AVAILABLE", True)
+    monkeypatch.setattr(alb, "metrics_service", SimpleNamespace(
+        record_error=lambda error_type, service, count=1: errors.append((error_type, count))
+    ))
+    batch = [_audit_record("/ok/1"), _audit_record(None), _audit_record("/ok/2")]
+    await alb.AuditLogBuffer()._flush(batch)
+    
+    db = session_factory()
+    assert sorted(row.endpoint for row in db.query(APIKeyAuditLog)) == ["/ok/1", "/ok/2"]
+    assert errors == [("audit_log_dropped", 1)]
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_audit_log_buffer_retries_transient_errors(session_factory, monkeypatch):
+    """Lỗi tạm thời (DB mất kết nối) được thử lại cả batch trước khi ghi từng row"""
+    monkeypatch.setattr(alb, "AUDIT_LOG_RETRY_BACKOFF", 0.0)
+    attempts = []
+    insert_batch = alb.AuditLogBuffer._insert_batch
+    
+    def flaky(batch):
+        attempts.append(len(batch))
+        if len(attempts) < 3:
+            raise ConnectionError("database unavailable")
+        insert_batch(batch)
+    
+    monkeypatch.setattr(alb.AuditLogBuffer, "_insert_batch", staticmethod(flaky))
+    await alb.AuditLogBuffer()._flush([_audit_record("/a"), _audit_record("/b")])
+    
+    assert attempts == [2, 2, 2]
+    db = session_factory()
+    assert db.query(APIKeyAuditLog).count() == 2
+    db.close()
+
+
+@pytest.mark.asyncio
+async def test_indexing_buffer_indexes_batch(session_factory, monkeypatch):
+    """Indexing buffer gọi index_conversations_bulk một lần cho cả batch"""
+    indexed, precomputed = [], []
+    
+    async def index_bulk(self, conversations, db=None):
+        indexed.append(list(conversations))
+        return {"indexed": len(conversations), "errors": 0}
+    
+    async def precompute(self, user_message, db=None, **kwargs):
+        precomputed.append(user_message)
+    
+    monkeypatch.setattr(sss.SemanticSearchService, "index_conversations_bulk", index_bulk)
+    monkeypatch.setattr(sss.SemanticSearchService, "precompute_best_response", precompute)
+    
+    buffer = IndexingBuffer()
+    await buffer.start()
+    for i in range(3):
+        assert buffer.enqueue(i, f"q{i}", f"a{i}")
+    await buffer.stop()
+    
+    assert indexed == [[(0, "q0", "a0"), (1, "q1", "a1"), (2, "q2", "a2")]]
+    assert precomputed == ["q0", "q1", "q2"]
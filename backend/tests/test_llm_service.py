@@ -86,4 +86,26 @@ async def test_check_ollama_connection():
         
         status = await service.check_ollama_connection()
         assert isinstance(status, dict)
-        assert "connected" in status
\ No newline at end of file
+        assert "connected" in status
+
+@pytest.mark.parametrize("raw_insights, expected", [
+    ({"greeting": 3}, []),
+    ({}, []),
+    ([], []),
+    (None, []),
+    (["a", "b", "c", "d"], ["a", "b", "c"]),
+    (("a",), ["a"]),
+])
+def test_get_system_prompt_insights(raw_insights, expected):
+    """Test get_system_prompt với insights dạng dict/rỗng/list"""
+    service = LLMService()
+    prompt = service.get_system_prompt(pattern_insights={
+        "insights": raw_insights,
+        "recommended_approach": {"style": "similar_to_high_rated"},
+    })
+    assert isinstance(prompt, str)
+    for insight in expected:
+        assert f"- {insight}\n" in prompt
+    if not expected:
+        assert "Lưu ý từ phân tích patterns" not in prompt
+    assert "- d\n" not in prompt
@@ -0,0 +1,244 @@
+"""
+Tests cho Semantic Search Service
+"""
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from models import Base, ConversationEmbedding
+import services.semantic_search_service as sss
+
+
+@pytest.fixture
+def embeddings_db():
+    """SQLite in-memory session với schema đầy đủ"""
+    engine = create_engine(
+        "sqlite://",
+        poolclass=StaticPool,
+        connect_args={"check_same_thread": False}
+    )
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    yield db
+    db.close()
+
+
+def _index(db, rng, conversation_ids, dim=16, center=None):
+    """Ghi embeddings ngẫu nhiên quanh `center` (thay thế row cũ nếu đã có)"""
+    for conv_id in conversation_ids:
+        vec = rng.standard_normal(dim).astype(np.float32)
+        if center is not None:
+            vec += center
+        vec_i8, scale = sss.quantize_int8(vec)
+        db.query(ConversationEmbedding).filter_by(conversation_id=conv_id).delete()
+        db.add(ConversationEmbedding(
+            conversation_id=conv_id,
+            user_message_embedding=sss._json_dumps(vec.tolist()),
+            combined_embedding=sss._json_dumps(vec.tolist()),
+            user_message_embedding_f32=vec.tobytes(),
+            combined_embedding_f32=vec.tobytes(),
+            combined_embedding_i8=vec_i8.tobytes(),
+            combined_embedding_scale=scale,
+            embedding_model="test",
+            embedding_dimension=dim
+        ))
+    db.commit()
+
+
+@pytest.mark.parametrize("column, quantized", [
+    ("combined_embedding", True),
+    ("user_message_embedding", False),
+])
+def test_embedding_matrix_incremental_refresh(embeddings_db, column, quantized):
+    """Append rows mới + re-index tại chỗ cho kết quả giống full build"""
+    rng = np.random.default_rng(0)
+    cache = sss.EmbeddingMatrixCache(column, quantized=quantized)
+    
+    _index(embeddings_db, rng, range(1, 6))
+    matrix, ids, _, _, _ = cache.get(embeddings_db)
+    assert matrix.shape[0] == 5
+    published, snapshot = matrix, matrix.copy()
+    
+    _index(embeddings_db, rng, range(6, 40))
+    cache.mark_dirty(list(range(6, 40)))
+    _index(embeddings_db, rng, [3])
+    cache.mark_dirty([3])
+    matrix, ids, norms, bits, ratings = cache.get(embeddings_db)
+    # Re-index không ghi vào ma trận đã publish (copy-on-write)
+    assert np.array_equal(published, snapshot)
+    assert not np.array_equal(matrix[:5], snapshot)
+    
+    fresh = sss.EmbeddingMatrixCache(column, quantized=quantized)
+    f_matrix, f_ids, f_norms, f_bits, f_ratings = fresh.get(embeddings_db)
+    order, f_order = np.argsort(ids), np.argsort(f_ids)
+    assert np.array_equal(ids[order], f_ids[f_order])
+    assert np.array_equal(matrix[order], f_matrix[f_order])
+    assert np.array_equal(bits[order], f_bits[f_order])
+    assert np.array_equal(ratings[order], f_ratings[f_order])
+    if quantized:
+        assert np.allclose(norms[order], f_norms[f_order])
+    else:
+        assert norms is None and f_norms is None
+
+
+def test_embedding_matrix_load_keeps_rows_committed_after_count(embeddings_db, monkeypatch):
+    """Rows commit giữa COUNT và SELECT: id <= MAX vẫn được load, id lớn hơn để dành cho refresh"""
+    rng = np.random.default_rng(1)
+    cache = sss.EmbeddingMatrixCache("combined_embedding", quantized=True)
+    _index(embeddings_db, rng, range(10, 15))
+    execute = embeddings_db.execute
+    
+    def _execute(statement, *args, **kwargs):
+        result = execute(statement, *args, **kwargs)
+        if statement is cache._count_sql:
+            _index(embeddings_db, rng, [2, 100])
+        return result
+    
+    monkeypatch.setattr(embeddings_db, "execute", _execute)
+    _, ids, _, _, _ = cache.get(embeddings_db)
+    assert sorted(ids.tolist()) == [2, 10, 11, 12, 13, 14]
+    
+    monkeypatch.setattr(embeddings_db, "execute", execute)
+    cache.mark_dirty()
+    _, ids, _, _, _ = cache.get(embeddings_db)
+    assert sorted(ids.tolist()) == [2, 10, 11, 12, 13, 14, 100]
+
+
+def _top_k_reference(scores, threshold, k, allowed=None):
+    """Top-k bằng numpy argsort thuần: (indices, scores, số rows >= threshold)"""
+    mask = scores >= threshold
+    if allowed is not None:
+        mask &= allowed
+    candidates = np.flatnonzero(mask)
+    order = candidates[np.argsort(-scores[candidates], kind="stable")][:k]
+    return order, scores[order], int(candidates.size)
+
+
+def _random_corpus(rng, rows=500, dim=32, quantized=False):
+    """(matrix, norms) giống EmbeddingMatrixCache: int8 + norms, hoặc float32 đã normalize"""
+    matrix = rng.standard_normal((rows, dim)).astype(np.float32)
+    if quantized:
+        matrix = np.stack([sss.quantize_int8(row)[0] for row in matrix])
+        return matrix, np.linalg.norm(matrix.astype(np.float32), axis=1) + 1e-8
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix, None
+
+
+def test_cosine_batch_kernel_matches_numpy():
+    """Kernel int8 batch cho cùng scores với matrix.astype(float32) @ q / norms"""
+    pytest.importorskip("numba")
+    rng = np.random.default_rng(1)
+    matrix, norms = _random_corpus(rng, quantized=True)
+    query = sss.unit_query_vector(rng.standard_normal(matrix.shape[1]))
+    
+    scores = sss._get_cosine_kernels(matrix.shape[1])[0](matrix, query, norms)
+    expected = (matrix.astype(np.float32) @ query) / norms
+    assert np.allclose(scores, expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("quantized", [True, False])
+@pytest.mark.parametrize("use_allowed", [True, False])
+@pytest.mark.parametrize("threshold, k", [(-np.inf, 10), (0.2, 5), (0.2, 400), (0.99, 3)])
+def test_cosine_topk_kernel_matches_argsort(quantized, use_allowed, threshold, k):
+    """Fused top-k (heap) khớp argsort thuần, kể cả sentinel rỗng của norms/allowed và heap chưa đầy"""
+    pytest.importorskip("numba")
+    rng = np.random.default_rng(2)
+    matrix, norms = _random_corpus(rng, quantized=quantized)
+    query = sss.unit_query_vector(rng.standard_normal(matrix.shape[1]))
+    allowed = rng.random(matrix.shape[0]) < 0.6 if use_allowed else None
+    empty = np.empty(0, dtype=np.float32)
+    
+    top, top_scores, matched = sss._get_cosine_kernels(matrix.shape[1])[1](
+        matrix, query, norms if norms is not None else empty,
+        allowed if allowed is not None else np.empty(0, dtype=np.bool_),
+        np.float32(threshold), k
+    )
+    
+    scores = matrix.astype(np.float32) @ query
+    if norms is not None:
+        scores = scores / norms
+    ref_top, ref_scores, ref_matched = _top_k_reference(scores.astype(np.float32), threshold, k, allowed)
+    assert matched == ref_matched
+    assert top.tolist() == ref_top.tolist()
+    assert np.allclose(top_scores, ref_scores, atol=1e-5)
+
+
+@pytest.mark.parametrize("use_allowed", [True, False])
+def test_hamming_shortlist_matches_argsort(use_allowed):
+    """Shortlist chứa đúng k Hamming distances nhỏ nhất (không lấy rows bị filter)"""
+    rng = np.random.default_rng(3)
+    matrix, _ = _random_corpus(rng, rows=300, dim=64)
+    bits = np.packbits(matrix > 0, axis=1)
+    query = sss.unit_query_vector(rng.standard_normal(matrix.shape[1]))
+    allowed = rng.random(matrix.shape[0]) < 0.5 if use_allowed else None
+    k = 20
+    
+    shortlist = sss._hamming_shortlist(bits, query, k, allowed)
+    
+    distances = ((matrix > 0) != (query > 0)).sum(axis=1)
+    if allowed is not None:
+        assert allowed[shortlist].all()
+        distances = np.where(allowed, distances, np.iinfo(np.int32).max)
+    assert len(set(shortlist.tolist())) == k
+    # Ties: so sánh multiset distances thay vì chính xác indices
+    assert sorted(distances[shortlist].tolist()) == np.sort(distances)[:k].tolist()
+    assert sss._hamming_shortlist(bits, query, matrix.shape[0] + 1).tolist() == list(range(matrix.shape[0]))
+
+
+@pytest.mark.asyncio
+async def test_hamming_shortlist_search_ranks_only_shortlist(embeddings_db, monkeypatch):
+    """min_similarity=0 + query ngược hướng: rows ngoài shortlist (chưa có score) không lọt vào kết quả"""
+    rng = np.random.default_rng(5)
+    center = np.full(16, 3.0, dtype=np.float32)
+    _index(embeddings_db, rng, range(1, 61), center=center)
+    cache = sss.EmbeddingMatrixCache("combined_embedding", quantized=True)
+    monkeypatch.setitem(sss._embedding_matrices, "combined_embedding", cache)
+    monkeypatch.setattr(sss, "BINARY_PRESCREEN_MIN_ROWS", 10)
+    monkeypatch.setattr(sss, "BINARY_PRESCREEN_FACTOR", 5)
+    
+    service = sss.SemanticSearchService()
+    ranked = {}
+    
+    def _capture(db, ids, top, top_scores, scored, matched):
+        ranked.update(ids=ids[top], scores=top_scores, matched=matched)
+        return []
+    
+    monkeypatch.setattr(service, "_load_ranked_conversations", _capture)
+    query = sss.unit_query_vector(-center)
+    await service._search_with_json(embeddings_db, query, 2, 0.0, True, None, 100)
+    
+    matrix, ids, norms, bits, _ = cache.get(embeddings_db)
+    shortlist = sss._hamming_shortlist(bits, query, 10)
+    scores = sss._cosine_scores(matrix[shortlist], norms[shortlist], query)
+    assert (scores < 0).all()
+    assert ranked["matched"] == 10
+    assert set(ranked["ids"].tolist()) <= set(ids[shortlist].tolist())
+    assert np.allclose(ranked["scores"], np.sort(scores)[::-1][:2])
+
+
+def test_semantic_result_cache_lookup_matches_argmax():
+    """Lookup trả về entry có cosine lớn nhất (giống argmax thuần), None nếu dưới threshold"""
+    rng = np.random.default_rng(4)
+    cache = sss.SemanticResultCache(max_entries=8, threshold=0.9, ttl=60)
+    vectors = [sss.unit_query_vector(rng.standard_normal(16)) for _ in range(10)]
+    for i, vec in enumerate(vectors):
+        cache.store(vec, "params", [{"id": i}])
+    
+    # max_entries=8 -> 2 entries đầu bị evict
+    assert cache.lookup(vectors[0], "params") is None
+    for i in range(2, 10):
+        query = sss.unit_query_vector(vectors[i] + 0.01 * rng.standard_normal(16))
+        expected = int(np.argmax(np.stack(vectors[2:]) @ query)) + 2
+        assert cache.lookup(query, "params") == [{"id": expected}]
+        assert cache.lookup(query, "other-params") is None
+    
+    far = sss.unit_query_vector(rng.standard_normal(16))
+    if (np.stack(vectors[2:]) @ far).max() < 0.9:
+        assert cache.lookup(far, "params") is None
+    
+    expired = sss.SemanticResultCache(max_entries=8, threshold=0.9, ttl=-1)
+    expired.store(vectors[0], "params", [{"id": 0}])
+    assert expired.lookup(vectors[0], "params") is None
+    cache.clear()
+    assert cache.lookup(vectors[5], "params") is None